@@ -0,0 +1,27 @@
+"""Бэкенд аутентификации с кэшированием пользователя.
+
+AuthenticationMiddleware на каждом запросе загружает пользователя по id
+из сессии. Бэкенд держит объект User в общем кэше, пока запись не
+изменится (см. core.signals).
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+USER_KEY = 'auth:user:{}'
+
+
+def user_key(user_id):
+    return USER_KEY.format(user_id)
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        key = user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,50 @@
+"""Настройка SQLite для боевой нагрузки.
+
+При открытии соединения включаются WAL и прагмы из SQLITE_PRAGMAS:
+читатели перестают блокировать писателя, а занятая база ожидается
+busy_timeout миллисекунд, а не сразу падает с «database is locked».
+Оставшиеся конфликты записи обрабатывает retry_on_locked.
+"""
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+from core import metrics
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+def is_locked_error(error):
+    return 'database is locked' in str(error)
+
+
+def retry_on_locked(func):
+    """Повторяет запись с экспоненциальной задержкой, если база занята.
+
+    Внутри транзакции повтор бессмысленен, поэтому ошибка пробрасывается
+    сразу.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        delay = settings.DB_RETRY_BASE_DELAY
+        for attempt in range(settings.DB_RETRY_ATTEMPTS):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if (not is_locked_error(error)
+                        or connection.in_atomic_block
+                        or attempt == settings.DB_RETRY_ATTEMPTS - 1):
+                    raise
+                metrics.incr('db.locked_retries')
+                time.sleep(delay * (1 + random.random()))
+                delay *= 2
+    return wrapper
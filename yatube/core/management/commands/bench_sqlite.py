@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+DEFAULT_PRAGMAS = {}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность SQLite при одновременных '
+            'чтениях и записях с настройками по умолчанию и с '
+            'SQLITE_PRAGMAS.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+
+    def handle(self, *args, **options):
+        for title, pragmas, timeout in (
+            ('по умолчанию', DEFAULT_PRAGMAS, 5),
+            ('SQLITE_PRAGMAS', settings.SQLITE_PRAGMAS,
+             settings.DATABASES['default'].get('OPTIONS', {})
+             .get('timeout', 5)),
+        ):
+            result = self.run(pragmas, timeout, options)
+            seconds = options['seconds']
+            self.stdout.write(
+                f'{title}: чтений {result["reads"] / seconds:.0f}/с, '
+                f'записей {result["writes"] / seconds:.0f}/с, '
+                f'ошибок блокировки {result["locked"]}'
+            )
+
+    def connect(self, path, pragmas, timeout):
+        db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        for pragma, value in pragmas.items():
+            db.execute(f'PRAGMA {pragma} = {value}')
+        return db
+
+    def run(self, pragmas, timeout, options):
+        result = {'reads': 0, 'writes': 0, 'locked': 0}
+        lock = threading.Lock()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite3')
+            db = self.connect(path, pragmas, timeout)
+            db.execute('CREATE TABLE post (id INTEGER PRIMARY KEY, '
+                       'author_id INTEGER, text TEXT)')
+            db.execute('CREATE INDEX post_author ON post (author_id)')
+            db.executemany('INSERT INTO post (author_id, text) VALUES (?, ?)',
+                           ((i % 100, 'x' * 200) for i in range(10000)))
+            db.commit()
+            db.close()
+            deadline = time.monotonic() + options['seconds']
+
+            def work(kind):
+                db = self.connect(path, pragmas, timeout)
+                done = locked = 0
+                i = 0
+                while time.monotonic() < deadline:
+                    i += 1
+                    try:
+                        if kind == 'writes':
+                            db.execute('INSERT INTO post (author_id, text) '
+                                       'VALUES (?, ?)', (i % 100, 'y' * 200))
+                            db.commit()
+                        else:
+                            db.execute('SELECT id, text FROM post '
+                                       'WHERE author_id = ? '
+                                       'ORDER BY id DESC LIMIT 10',
+                                       (i % 100,)).fetchall()
+                        done += 1
+                    except sqlite3.OperationalError:
+                        locked += 1
+                db.close()
+                with lock:
+                    result[kind] += done
+                    result['locked'] += locked
+
+            threads = (
+                [threading.Thread(target=work, args=('reads',))
+                 for _ in range(options['readers'])]
+                + [threading.Thread(target=work, args=('writes',))
+                   for _ in range(options['writers'])]
+            )
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return result
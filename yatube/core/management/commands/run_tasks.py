@@ -0,0 +1,67 @@
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from core import tasks
+
+PURGE_INTERVAL = 60 * 60
+
+
+def run_task(task_id):
+    close_old_connections()
+    try:
+        return tasks.run_task(task_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Выполняет задачи из очереди core.tasks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=settings.TASK_WORKERS)
+        parser.add_argument('--processes', action='store_true',
+                            help='Пул процессов вместо пула потоков')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить готовые задачи и выйти')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if options['processes']:
+            # Дочерние процессы не должны наследовать открытые соединения.
+            connections.close_all()
+            pool = ProcessPoolExecutor(workers)
+        else:
+            pool = ThreadPoolExecutor(workers)
+        done = failed = 0
+        purged_at = 0
+        # Пока воркер отмечается, задачи с TASKS_EAGER = None ставятся
+        # в очередь, а не выполняются в запросе.
+        name = f'{socket.gethostname()}:{os.getpid()}'
+        try:
+            with pool:
+                while True:
+                    tasks.heartbeat(name)
+                    task_ids = tasks.claim(workers * 2)
+                    for ok in pool.map(run_task, task_ids):
+                        if ok:
+                            done += 1
+                        else:
+                            failed += 1
+                    if time.monotonic() - purged_at > PURGE_INTERVAL:
+                        tasks.purge_done(settings.TASK_KEEP_DONE)
+                        purged_at = time.monotonic()
+                    if task_ids:
+                        continue
+                    if options['once']:
+                        break
+                    time.sleep(settings.TASK_POLL_INTERVAL)
+        finally:
+            tasks.retire(name)
+        self.stdout.write(f'Выполнено задач: {done}, с ошибкой: {failed}')
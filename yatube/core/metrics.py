@@ -0,0 +1,35 @@
+"""Простые счётчики и таймеры поверх общего кэша.
+
+Значения читаются функцией get и доступны всем воркерам, которые
+используют один и тот же кэш.
+"""
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+METRIC_KEY = 'metrics:{}'
+
+
+def incr(name, value=1):
+    key = METRIC_KEY.format(name)
+    if not cache.add(key, value, None):
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            cache.set(key, value, None)
+
+
+def get(name):
+    return cache.get(METRIC_KEY.format(name), 0)
+
+
+@contextmanager
+def timer(name):
+    """Считает число вызовов name.count и суммарное время name.ms."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        incr(f'{name}.count')
+        incr(f'{name}.ms', int((time.monotonic() - started) * 1000))
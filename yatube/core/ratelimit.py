@@ -0,0 +1,101 @@
+"""Ограничение частоты запросов к пишущим представлениям.
+
+Используется скользящее окно из двух соседних счётчиков в общем кэше:
+число запросов за последние window секунд оценивается как счётчик
+текущего окна плюс доля счётчика предыдущего. Счётчики меняются
+атомарными add/incr, к базе декоратор не обращается.
+
+Лимиты задаются в RATE_LIMITS по имени маршрута и области: 'user' —
+на пользователя (только для вошедших), 'ip' — на адрес клиента.
+"""
+import functools
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from core import metrics
+
+RATE_KEY = 'ratelimit:{}:{}:{}'
+
+
+def _count(key, window):
+    if cache.add(key, 1, window * 2):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, window * 2)
+        return 1
+
+
+def undo(key, window, now):
+    """Возвращает запрос, учтённый hit(key, ..., window, now)."""
+    try:
+        cache.decr(f'{key}:{int(now // window)}')
+    except ValueError:
+        pass
+
+
+def hit(key, limit, window, now=None):
+    """Учитывает запрос и возвращает, сколько секунд ждать; 0 — запрос
+    разрешён."""
+    now = time.time() if now is None else now
+    index, offset = divmod(now, window)
+    index = int(index)
+    current = _count(f'{key}:{index}', window)
+    previous = cache.get(f'{key}:{index - 1}', 0)
+    if previous * (1 - offset / window) + current <= limit:
+        return 0
+    # Отклонённый запрос не расходует лимит.
+    undo(key, window, now)
+    if current <= limit:
+        # Хватит подождать, пока вклад предыдущего окна не уменьшится.
+        wait = window * (1 - (limit - current) / previous) - offset
+    else:
+        wait = window - offset + window * (1 - (limit - 1) / current)
+    return max(1, math.ceil(wait))
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def ratelimit(route, methods=('POST',)):
+    """Отвечает 429 с Retry-After, если клиент превысил лимиты маршрута
+    route. Запросы с методами не из methods не ограничиваются;
+    methods=None ограничивает все."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if methods is not None and request.method not in methods:
+                return view(request, *args, **kwargs)
+            limits = settings.RATE_LIMITS.get(route, {})
+            idents = {'ip': client_ip(request)}
+            if request.user.is_authenticated:
+                idents['user'] = request.user.pk
+            now = time.time()
+            counted = []
+            for scope, (limit, window) in limits.items():
+                if scope not in idents:
+                    continue
+                key = RATE_KEY.format(route, scope, idents[scope])
+                wait = hit(key, limit, window, now)
+                if not wait:
+                    counted.append((key, window))
+                    continue
+                # Запрос отклонён целиком: области, которые его уже
+                # учли, тоже не должны расходовать лимит.
+                for counted_key, counted_window in counted:
+                    undo(counted_key, counted_window, now)
+                metrics.incr(f'ratelimit.{route}.{scope}.rejected')
+                response = HttpResponse(
+                    'Слишком много запросов, попробуйте позже.', status=429
+                )
+                response['Retry-After'] = str(wait)
+                return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
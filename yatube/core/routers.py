@@ -0,0 +1,84 @@
+"""Маршрутизация чтения на реплики.
+
+Чтение уходит на случайную реплику из DATABASE_REPLICAS, запись — на
+default. Пользователь, который только что что-то записал, в течение
+READ_AFTER_WRITE_WINDOW секунд читает только с default, чтобы сразу
+увидеть свои изменения: ReplicaPinningMiddleware ставит для этого куку.
+
+Для проверки на одной машине реплики описываются в DATABASES как
+отдельные файлы SQLite с 'TEST': {'MIRROR': 'default'} и заполняются
+командой sync_replicas.
+"""
+import random
+import threading
+
+from django.conf import settings
+
+PRIMARY = 'default'
+PIN_COOKIE = 'pin_primary'
+
+_state = threading.local()
+
+
+def reset(pinned=False):
+    _state.pinned = pinned
+    _state.wrote = False
+
+
+def wrote():
+    return getattr(_state, 'wrote', False)
+
+
+def pin():
+    """Отмечает запись в запросе: дальше читать нужно с default.
+    Роутеры, которые выбирают базу для записи раньше ReplicaRouter,
+    вызывают pin() сами."""
+    _state.wrote = True
+    _state.pinned = True
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or getattr(_state, 'pinned', False):
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # После первой записи в запросе читать тоже нужно с default.
+        pin()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Закрепляет чтение за default на время запроса, если у клиента есть
+    кука недавней записи, и ставит эту куку после запроса с записью."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reset(pinned=PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+            if wrote():
+                response.set_cookie(
+                    PIN_COOKIE, '1',
+                    max_age=settings.READ_AFTER_WRITE_WINDOW,
+                    httponly=True
+                )
+            return response
+        finally:
+            reset()
@@ -0,0 +1,194 @@
+"""Очередь фоновых задач в таблице core_task.
+
+Задача — функция модуля, помеченная декоратором task. Представление
+ставит её в очередь вызовом func.enqueue(...) и сразу отвечает, а
+выполняет задачу воркер manage.py run_tasks. Очередь лежит в default
+и пишется отдельным запросом после изменений, которые вызвали задачу
+(посты могут лежать в другом шарде), поэтому поставленная задача
+переживает перезапуск воркера, но сбой процесса между сохранением
+поста и постановкой задачи её теряет.
+
+Воркер забирает задачи по приоритету, выполняет их в пуле потоков или
+процессов и при ошибке повторяет с экспоненциальной задержкой. Задача
+с ключом key ставится в очередь только один раз, пока она не выполнена
+или не исчерпала попытки: у упавшей задачи ключ снимается.
+
+Воркеры отмечаются в таблице TaskWorker. Если TASKS_EAGER = None и ни
+одного живого воркера нет, задачи выполняются сразу при постановке,
+чтобы без run_tasks рассылка по лентам не останавливалась.
+"""
+import json
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core import metrics
+from core.db import retry_on_locked
+from core.models import Task, TaskWorker
+from core.routers import PRIMARY
+
+logger = logging.getLogger(__name__)
+
+
+def task(priority=0, max_attempts=None):
+    """Делает функцию задачей: появляется func.enqueue(args, kwargs,
+    key=None, countdown=0). Аргументы должны сериализоваться в JSON."""
+    def decorator(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+
+        def enqueue_func(args=(), kwargs=None, key=None, countdown=0):
+            return enqueue(name, args, kwargs, key=key, priority=priority,
+                           countdown=countdown, max_attempts=max_attempts)
+
+        func.is_task = True
+        func.task_name = name
+        func.enqueue = enqueue_func
+        return func
+    return decorator
+
+
+@retry_on_locked
+def enqueue(name, args=(), kwargs=None, key=None, priority=0, countdown=0,
+            max_attempts=None):
+    """Ставит задачу в очередь. Повтор с тем же key ничего не делает."""
+    if _eager():
+        return import_string(name)(*args, **(kwargs or {}))
+    _queue().bulk_create([Task(
+        name=name,
+        payload=json.dumps({'args': list(args), 'kwargs': kwargs or {}}),
+        key=key,
+        priority=priority,
+        max_attempts=max_attempts or settings.TASK_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=countdown),
+    )], ignore_conflicts=key is not None)
+    metrics.incr('tasks.enqueued')
+
+
+def _eager():
+    if settings.TASKS_EAGER is not None:
+        return settings.TASKS_EAGER
+    return not worker_alive()
+
+
+def worker_alive():
+    """Есть ли воркер, который отмечался в последние
+    TASK_WORKER_TIMEOUT секунд."""
+    threshold = timezone.now() - timedelta(
+        seconds=settings.TASK_WORKER_TIMEOUT
+    )
+    return TaskWorker.objects.using(PRIMARY).filter(
+        seen__gte=threshold
+    ).exists()
+
+
+@retry_on_locked
+def heartbeat(name):
+    """Отмечает воркера name живым."""
+    TaskWorker.objects.using(PRIMARY).update_or_create(
+        name=name, defaults={'seen': timezone.now()}
+    )
+
+
+@retry_on_locked
+def retire(name):
+    TaskWorker.objects.using(PRIMARY).filter(name=name).delete()
+
+
+def _queue():
+    # Очередь читается только с основной базы: на реплике только что
+    # поставленной задачи может ещё не быть.
+    return Task.objects.using(PRIMARY)
+
+
+def _ready(now):
+    # Задачи упавшего воркера возвращаются в очередь по истечении аренды.
+    return (Q(status=Task.QUEUED, run_at__lte=now)
+            | Q(status=Task.RUNNING, locked_until__lt=now))
+
+
+@retry_on_locked
+def claim(limit):
+    """Забирает до limit готовых задач и возвращает их id.
+
+    Каждая задача захватывается условным UPDATE, поэтому несколько
+    воркеров не выполнят одну задачу дважды.
+    """
+    now = timezone.now()
+    candidates = list(_queue()
+                      .filter(_ready(now))
+                      .order_by('-priority', 'run_at', 'id')
+                      .values_list('id', flat=True)[:limit])
+    lease = now + timedelta(seconds=settings.TASK_LEASE)
+    return [
+        task_id for task_id in candidates
+        if _queue().filter(_ready(now), id=task_id).update(
+            status=Task.RUNNING, locked_until=lease,
+            attempts=F('attempts') + 1
+        )
+    ]
+
+
+def retry_delay(attempts):
+    delay = min(settings.TASK_RETRY_BASE_DELAY * 2 ** (attempts - 1),
+                settings.TASK_RETRY_MAX_DELAY)
+    return delay * (1 + random.random() / 2)
+
+
+@retry_on_locked
+def _finish(task_id, **fields):
+    _queue().filter(id=task_id).update(locked_until=None, **fields)
+
+
+def run_task(task_id):
+    """Выполняет захваченную задачу и записывает результат."""
+    try:
+        task_obj = _queue().get(id=task_id)
+        payload = json.loads(task_obj.payload)
+        func = import_string(task_obj.name)
+        if not getattr(func, 'is_task', False):
+            raise ValueError(f'{task_obj.name} не помечена как задача')
+        with metrics.timer(f'tasks.{task_obj.name}'):
+            func(*payload['args'], **payload['kwargs'])
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Задача %s упала:\n%s', task_id, error)
+        attempts = _queue().filter(id=task_id).values_list(
+            'attempts', 'max_attempts'
+        ).first()
+        if attempts and attempts[0] < attempts[1]:
+            metrics.incr('tasks.retried')
+            _finish(task_id, status=Task.QUEUED, last_error=error,
+                    run_at=timezone.now() + timedelta(
+                        seconds=retry_delay(attempts[0])))
+        else:
+            metrics.incr('tasks.failed')
+            # Снятый ключ позволяет поставить задачу заново.
+            _finish(task_id, status=Task.FAILED, last_error=error, key=None)
+        return False
+    else:
+        metrics.incr('tasks.done')
+        _finish(task_id, status=Task.DONE)
+        return True
+
+
+def run_pending(limit=100):
+    """Выполняет готовые задачи в текущем потоке; возвращает их число."""
+    task_ids = claim(limit)
+    for task_id in task_ids:
+        run_task(task_id)
+    return len(task_ids)
+
+
+def purge_done(older_than):
+    """Удаляет выполненные и упавшие задачи старше older_than секунд,
+    освобождая ключи выполненных."""
+    threshold = timezone.now() - timedelta(seconds=older_than)
+    deleted, _ = _queue().filter(status__in=[Task.DONE, Task.FAILED],
+                                 created__lt=threshold).delete()
+    return deleted
@@ -0,0 +1,44 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+User = get_user_model()
+
+
+class CachedAuthTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cached')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_authenticated_request_without_session_and_user_queries(self):
+        """Сессия и пользователь читаются из кэша"""
+        url = reverse('about:author')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.context['user'], self.user)
+
+    def test_user_cache_invalidated_on_save(self):
+        """Изменение пользователя сбрасывает его кэш"""
+        url = reverse('about:author')
+        self.client.get(url)
+        self.user.first_name = 'Новое имя'
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.context['user'].first_name, 'Новое имя')
+
+    def test_purge_sessions(self):
+        """Команда purge_sessions удаляет только истёкшие сессии"""
+        Session.objects.update(expire_date=timezone.now())
+        Client().force_login(self.user)
+        call_command('purge_sessions', '--batch-size', '1',
+                     stdout=StringIO())
+        self.assertEqual(Session.objects.count(), 1)
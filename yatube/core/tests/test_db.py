@@ -0,0 +1,39 @@
+from unittest import mock
+
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core.db import retry_on_locked
+
+
+class SQLitePragmasTest(TestCase):
+    def test_pragmas_applied_on_connect(self):
+        """При открытии соединения включаются прагмы SQLITE_PRAGMAS"""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+
+@override_settings(DB_RETRY_ATTEMPTS=3, DB_RETRY_BASE_DELAY=0)
+class RetryOnLockedTest(SimpleTestCase):
+    def test_retries_locked_writes(self):
+        """Запись повторяется, пока база занята"""
+        write = mock.Mock(side_effect=[
+            OperationalError('database is locked'), 'ok'
+        ])
+        self.assertEqual(retry_on_locked(write)(), 'ok')
+        self.assertEqual(write.call_count, 2)
+
+    def test_other_errors_not_retried(self):
+        """Другие ошибки базы не повторяются"""
+        write = mock.Mock(side_effect=OperationalError('no such table'))
+        with self.assertRaises(OperationalError):
+            retry_on_locked(write)()
+        self.assertEqual(write.call_count, 1)
+
+    def test_gives_up_after_attempts(self):
+        """После DB_RETRY_ATTEMPTS попыток ошибка пробрасывается"""
+        write = mock.Mock(side_effect=OperationalError('database is locked'))
+        with self.assertRaises(OperationalError):
+            retry_on_locked(write)()
+        self.assertEqual(write.call_count, 3)
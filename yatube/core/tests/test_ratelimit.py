@@ -0,0 +1,80 @@
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from core import metrics
+from core.ratelimit import RATE_KEY, hit, ratelimit
+
+User = get_user_model()
+
+
+@ratelimit('test', methods=None)
+def view(request):
+    return HttpResponse('ok')
+
+
+@ratelimit('scopes', methods=None)
+def scoped_view(request):
+    return HttpResponse('ok')
+
+
+@override_settings(RATE_LIMITS={
+    'test': {'ip': (2, 60)},
+    'scopes': {'ip': (2, 60), 'user': (1, 60)},
+    'add_comment': {'user': (1, 60), 'ip': (100, 60)},
+})
+class RateLimitTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def request(self):
+        request = self.factory.get('/')
+        request.user = AnonymousUser()
+        return request
+
+    def test_limit_per_ip_without_queries(self):
+        """Лишний запрос получает 429 с Retry-After, без запросов к базе"""
+        with self.assertNumQueries(0):
+            responses = [view(self.request()) for _ in range(3)]
+        self.assertEqual([r.status_code for r in responses],
+                         [HTTPStatus.OK, HTTPStatus.OK,
+                          HTTPStatus.TOO_MANY_REQUESTS])
+        self.assertGreater(int(responses[-1]['Retry-After']), 0)
+        self.assertEqual(metrics.get('ratelimit.test.ip.rejected'), 1)
+
+    def test_sliding_window(self):
+        """Запросы прошлого окна учитываются пропорционально"""
+        self.assertEqual(hit('window', 2, 60, now=59), 0)
+        self.assertEqual(hit('window', 2, 60, now=59), 0)
+        self.assertGreater(hit('window', 2, 60, now=61), 0)
+        self.assertEqual(hit('window', 2, 60, now=115), 0)
+
+    def test_limit_per_user(self):
+        """Лимит пользователя действует на add_comment"""
+        user = User.objects.create_user(username='spammer')
+        post = user.posts.create(text='Пост')
+        client = Client()
+        client.force_login(user)
+        url = reverse('posts:add_comment', kwargs={'post_id': post.id})
+        client.post(url, {'text': 'Первый'})
+        response = client.post(url, {'text': 'Второй'})
+        self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertEqual(post.comments.count(), 1)
+
+    def test_rejected_request_rolls_back_all_scopes(self):
+        """Запрос, отклонённый лимитом одной области, не расходует
+        лимиты остальных"""
+        request = self.factory.get('/')
+        request.user = User.objects.create_user(username='limited')
+        responses = [scoped_view(request) for _ in range(3)]
+        self.assertEqual([r.status_code for r in responses],
+                         [HTTPStatus.OK, HTTPStatus.TOO_MANY_REQUESTS,
+                          HTTPStatus.TOO_MANY_REQUESTS])
+        key = RATE_KEY.format('scopes', 'ip', '127.0.0.1')
+        self.assertEqual(hit(key, 2, 60), 0)
@@ -0,0 +1,48 @@
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from core import routers
+from posts.models import Post
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.factory = RequestFactory()
+        routers.reset()
+
+    def tearDown(self):
+        routers.reset()
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        """Чтение идёт на реплику, запись — на основную базу"""
+        self.assertEqual(self.router.db_for_read(Post), 'replica')
+        self.assertEqual(self.router.db_for_write(Post), 'default')
+
+    def test_reads_pinned_after_write(self):
+        """После записи запрос читает с основной базы"""
+        self.router.db_for_write(Post)
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_middleware_sets_and_honours_pin_cookie(self):
+        """Кука после записи закрепляет следующие чтения за основной базой"""
+        def write_view(request):
+            self.router.db_for_write(Post)
+            return HttpResponse()
+
+        def read_view(request):
+            return HttpResponse(self.router.db_for_read(Post))
+
+        response = routers.ReplicaPinningMiddleware(write_view)(
+            self.factory.post('/')
+        )
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        request = self.factory.get('/')
+        request.COOKIES[routers.PIN_COOKIE] = '1'
+        response = routers.ReplicaPinningMiddleware(read_view)(request)
+        self.assertEqual(response.content, b'default')
+        response = routers.ReplicaPinningMiddleware(read_view)(
+            self.factory.get('/')
+        )
+        self.assertEqual(response.content, b'replica')
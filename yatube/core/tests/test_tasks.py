@@ -0,0 +1,89 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import tasks
+from core.models import Task
+
+CALLS = []
+
+
+@tasks.task()
+def remember(value):
+    CALLS.append(value)
+
+
+@tasks.task(priority=5)
+def urgent(value):
+    CALLS.append(value)
+
+
+@tasks.task(max_attempts=2)
+def broken():
+    raise RuntimeError('сломалось')
+
+
+@override_settings(TASK_RETRY_BASE_DELAY=0, TASKS_EAGER=False)
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueue_and_run(self):
+        """Задача выполняется воркером и помечается выполненной"""
+        remember.enqueue(['привет'])
+        self.assertEqual(CALLS, [])
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertEqual(CALLS, ['привет'])
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+
+    def test_idempotency_key(self):
+        """Задача с тем же ключом ставится в очередь один раз"""
+        remember.enqueue([1], key='once')
+        remember.enqueue([2], key='once')
+        tasks.run_pending()
+        self.assertEqual(CALLS, [1])
+
+    def test_priority(self):
+        """Задачи с большим приоритетом выполняются раньше"""
+        remember.enqueue(['обычная'])
+        urgent.enqueue(['срочная'])
+        tasks.run_pending()
+        self.assertEqual(CALLS, ['срочная', 'обычная'])
+
+    def test_retry_then_fail(self):
+        """Упавшая задача повторяется, пока не кончатся попытки"""
+        broken.enqueue()
+        tasks.run_pending()
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+        self.assertIn('сломалось', task.last_error)
+        Task.objects.update(run_at=timezone.now())
+        tasks.run_pending()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+
+    def test_failed_task_frees_key(self):
+        """Задачу с ключом можно поставить снова, когда прежняя упала"""
+        broken.enqueue(key='retry')
+        Task.objects.update(attempts=1)
+        tasks.run_pending()
+        broken.enqueue(key='retry')
+        self.assertEqual(Task.objects.filter(key='retry').count(), 1)
+        self.assertEqual(Task.objects.count(), 2)
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager(self):
+        """В режиме TASKS_EAGER задача выполняется сразу"""
+        remember.enqueue(['сразу'])
+        self.assertEqual(CALLS, ['сразу'])
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASKS_EAGER=None)
+    def test_eager_without_worker(self):
+        """Без живого воркера задача выполняется сразу, с воркером —
+        ставится в очередь"""
+        remember.enqueue(['без воркера'])
+        self.assertEqual(CALLS, ['без воркера'])
+        tasks.heartbeat('worker')
+        remember.enqueue(['в очередь'])
+        self.assertEqual(CALLS, ['без воркера'])
+        self.assertEqual(Task.objects.count(), 1)
@@ -0,0 +1,139 @@
+"""Архив постов по месяцам.
+
+Страница месяца выбирает посты диапазоном по индексу pub_date.
+Навигация по месяцам читает готовые счётчики PostMonthCount: сигналы
+постов увеличивают и уменьшают их при публикации, смене группы и
+удалении, поэтому GROUP BY по таблице постов выполняется только
+командой rebuild_archive при первичном заполнении.
+
+Счётчики ведутся в трёх областях: весь сайт (''), группа ('group:<id>')
+и автор ('author:<id>'). Месяц определяется в часовом поясе TIME_ZONE.
+"""
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from core.db import retry_on_locked
+from . import sharding
+from .models import Post, PostMonthCount
+
+SITE = ''
+MONTHS_KEY = 'archive:months:{}'
+BATCH_SIZE = 1000
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def author_scope(author_id):
+    return f'author:{author_id}'
+
+
+def months_key(scope):
+    return MONTHS_KEY.format(scope)
+
+
+def month_of(pub_date):
+    local = timezone.localtime(pub_date)
+    return local.year, local.month
+
+
+def month_range(year, month):
+    """Границы месяца [start, end); ValueError для несуществующего."""
+    start = timezone.make_aware(datetime(year, month, 1))
+    end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+    return start, end
+
+
+def scopes_of(author_id, group_id):
+    scopes = [SITE, author_scope(author_id)]
+    if group_id is not None:
+        scopes.append(group_scope(group_id))
+    return scopes
+
+
+@retry_on_locked
+def _apply(deltas):
+    PostMonthCount.objects.bulk_create(
+        [PostMonthCount(scope=scope, year=year, month=month)
+         for (scope, year, month), delta in deltas.items() if delta > 0],
+        ignore_conflicts=True
+    )
+    for (scope, year, month), delta in deltas.items():
+        if delta:
+            PostMonthCount.objects.filter(
+                scope=scope, year=year, month=month
+            ).update(count=F('count') + delta)
+    cache.delete_many({months_key(scope) for scope, _, _ in deltas})
+
+
+def count_posts(posts, delta=1):
+    """Прибавляет delta к месяцам постов posts во всех их областях."""
+    deltas = Counter()
+    for post in posts:
+        year, month = month_of(post.pub_date)
+        for scope in scopes_of(post.author_id, post.group_id):
+            deltas[scope, year, month] += delta
+    if deltas:
+        _apply(deltas)
+
+
+def group_changed(post, previous_group_id):
+    """Переносит пост между счётчиками групп после редактирования."""
+    year, month = month_of(post.pub_date)
+    deltas = Counter()
+    if previous_group_id is not None:
+        deltas[group_scope(previous_group_id), year, month] -= 1
+    if post.group_id is not None:
+        deltas[group_scope(post.group_id), year, month] += 1
+    _apply(deltas)
+
+
+def months(scope):
+    """[(год, месяц, число постов)] области от новых месяцев к старым."""
+    key = months_key(scope)
+    result = cache.get(key)
+    if result is None:
+        result = list(PostMonthCount.objects
+                      .filter(scope=scope, count__gt=0)
+                      .order_by('-year', '-month')
+                      .values_list('year', 'month', 'count'))
+        cache.set(key, result, settings.ARCHIVE_TIMEOUT)
+    return result
+
+
+def rebuild():
+    """Пересчитывает все счётчики по таблицам постов всех шардов;
+    возвращает число строк сводки."""
+    counts = Counter()
+    for alias in sharding.aliases():
+        rows = (Post.objects.using(alias)
+                .annotate(month=TruncMonth('pub_date'))
+                .order_by()
+                .values_list('author_id', 'group_id', 'month')
+                .annotate(Count('id')))
+        for author_id, group_id, month, count in rows:
+            month = timezone.localtime(month)
+            for scope in scopes_of(author_id, group_id):
+                counts[scope, month.year, month.month] += count
+    with transaction.atomic():
+        old_scopes = set(PostMonthCount.objects
+                         .values_list('scope', flat=True).distinct())
+        PostMonthCount.objects.all().delete()
+        PostMonthCount.objects.bulk_create(
+            [PostMonthCount(scope=scope, year=year, month=month, count=count)
+             for (scope, year, month), count in counts.items()],
+            batch_size=BATCH_SIZE
+        )
+    cache.delete_many(
+        [months_key(scope)
+         for scope in old_scopes | {scope for scope, _, _ in counts}]
+    )
+    return len(counts)
@@ -0,0 +1,40 @@
+"""Кэш отрендеренных карточек постов.
+
+Карточка не зависит от пользователя, поэтому её HTML можно хранить в
+общем кэше и переиспользовать во всех лентах. Карточка сбрасывается при
+изменении или удалении поста и после фоновой генерации миниатюр: до неё
+карточка ссылается на заглушки.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .thumbnails import prefetch_card_thumbnails
+
+CARD_KEY = 'post_card:{}'
+CARD_TEMPLATE = 'posts/includes/card.html'
+
+
+def card_key(post_id):
+    return CARD_KEY.format(post_id)
+
+
+def render_cards(posts):
+    """Возвращает HTML карточек в порядке posts, рендеря только промахи."""
+    keys = [card_key(post.id) for post in posts]
+    cards = cache.get_many(keys)
+    prefetch_card_thumbnails(
+        [post for key, post in zip(keys, posts) if key not in cards]
+    )
+    rendered = {
+        key: render_to_string(CARD_TEMPLATE, {'post': post})
+        for key, post in zip(keys, posts) if key not in cards
+    }
+    if rendered:
+        cache.set_many(rendered, settings.POST_CARD_TIMEOUT)
+        cards.update(rendered)
+    return [cards[key] for key in keys]
+
+
+def invalidate(post_id):
+    cache.delete(card_key(post_id))
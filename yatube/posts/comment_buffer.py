@@ -0,0 +1,255 @@
+"""Буферизованная запись комментариев.
+
+При COMMENT_BUFFERING представление add_comment не пишет комментарий
+в основную базу, а добавляет его в локальный буфер — отдельный файл
+SQLite с synchronous=FULL. Запрос ждёт только эту запись, и после
+ответа комментарий уже не потеряется. Фоновый поток процесса (или
+команда flush_comments) переносит буфер в основную базу пачками через
+bulk_create и только потом удаляет перенесённые строки. Поток
+просыпается от нового комментария, но не чаще раза в
+COMMENT_FLUSH_INTERVAL секунд, чтобы комментарии успевали копиться.
+
+Выборка, перенос и удаление пачки идут внутри BEGIN IMMEDIATE буфера:
+пачку забирает один переносчик, а остальные ждут и берут следующую.
+Поэтому comments_flushed отправляется для каждого комментария один раз.
+
+У каждого комментария есть token. Если процесс упадёт между
+bulk_create и удалением из буфера, повторный перенос пропустит уже
+записанные комментарии, и дублей не будет. Пока комментарий лежит
+в буфере, его автор видит его на странице поста (см. pending).
+
+Комментарии к удалённым постам и от удалённых пользователей
+отбрасываются. Если база всё же отвергла пачку, она записывается по
+одному комментарию, а строки с ошибкой переносятся в таблицу
+comment_buffer_dead буфера: одна плохая строка не останавливает
+перенос остальных.
+"""
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.dispatch import Signal
+
+from core import metrics
+from . import sharding
+from .models import Comment, Post, User
+
+logger = logging.getLogger(__name__)
+
+# Отправляется один раз на пачку перенесённых комментариев:
+# counts — {post_id: число комментариев}.
+comments_flushed = Signal(providing_args=['post_ids', 'count', 'counts'])
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS comment_buffer (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT NOT NULL UNIQUE,
+    post_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    created REAL NOT NULL
+)
+'''
+
+DEAD_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS comment_buffer_dead (
+    seq INTEGER PRIMARY KEY,
+    token TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    created REAL NOT NULL,
+    error TEXT NOT NULL
+)
+'''
+
+_local = threading.local()
+_flusher = None
+_flusher_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def _connection():
+    path = settings.COMMENT_BUFFER_PATH
+    connection = getattr(_local, 'connection', None)
+    if connection is None or _local.path != path:
+        connection = sqlite3.connect(path, timeout=20,
+                                     isolation_level=None)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = FULL')
+        connection.execute(SCHEMA)
+        connection.execute(DEAD_SCHEMA)
+        connection.execute('CREATE INDEX IF NOT EXISTS comment_buffer_post '
+                           'ON comment_buffer (post_id, author_id)')
+        _local.connection = connection
+        _local.path = path
+    return connection
+
+
+def append(post_id, author_id, text):
+    """Добавляет комментарий в буфер и будит фоновый перенос."""
+    token = uuid.uuid4().hex
+    _connection().execute(
+        'INSERT INTO comment_buffer (token, post_id, author_id, text, '
+        'created) VALUES (?, ?, ?, ?, ?)',
+        (token, post_id, author_id, text, time.time())
+    )
+    metrics.incr('comments.buffered')
+    start_flusher()
+    _wakeup.set()
+    return token
+
+
+def pending(post, author):
+    """Ещё не перенесённые комментарии author к post — несохранённые
+    объекты Comment в порядке добавления."""
+    rows = _connection().execute(
+        'SELECT token, text, created FROM comment_buffer '
+        'WHERE post_id = ? AND author_id = ? ORDER BY seq',
+        (post.id, author.id)
+    ).fetchall()
+    return [
+        Comment(post=post, author=author, text=text,
+                token=uuid.UUID(token),
+                created=datetime.fromtimestamp(created, tz=timezone.utc))
+        for token, text, created in rows
+    ]
+
+
+def _insert(alias, comments):
+    """Записывает comments в шард alias; возвращает {token: ошибка}
+    комментариев, которые база не приняла."""
+    queryset = Comment.objects.using(alias)
+    try:
+        with transaction.atomic(using=alias):
+            queryset.bulk_create(comments, ignore_conflicts=True)
+        return {}
+    except IntegrityError:
+        pass
+    failed = {}
+    for comment in comments:
+        try:
+            with transaction.atomic(using=alias):
+                queryset.bulk_create([comment], ignore_conflicts=True)
+        except IntegrityError as error:
+            failed[comment.token.hex] = str(error)
+    return failed
+
+
+def _save(rows):
+    """Переносит строки буфера в базу; возвращает (записанные
+    комментарии, {token: ошибка} отвергнутых базой)."""
+    authors = set(User.objects.filter(id__in={row[3] for row in rows})
+                  .values_list('id', flat=True))
+    by_shard = {}
+    for _, token, post_id, author_id, text, _ in rows:
+        if author_id not in authors:
+            # Автор удалён, пока комментарий ждал в буфере.
+            continue
+        comment = Comment(post_id=post_id, author_id=author_id, text=text,
+                          token=uuid.UUID(token))
+        if sharding.enabled():
+            comment.id = sharding.next_id(Comment)
+        by_shard.setdefault(sharding.locate_post(post_id), []).append(
+            comment
+        )
+    saved = []
+    failed = {}
+    for alias, comments in by_shard.items():
+        if alias is None and sharding.enabled():
+            # Пост удалён, пока комментарий ждал в буфере.
+            continue
+        existing = set(Post.objects.using(alias)
+                       .filter(id__in={c.post_id for c in comments})
+                       .values_list('id', flat=True))
+        comments = [comment for comment in comments
+                    if comment.post_id in existing]
+        rejected = _insert(alias, comments)
+        failed.update(rejected)
+        saved.extend(comment for comment in comments
+                     if comment.token.hex not in rejected)
+    return saved, failed
+
+
+def flush(batch_size=None):
+    """Переносит одну пачку из буфера в базу; возвращает её размер."""
+    batch_size = batch_size or settings.COMMENT_FLUSH_BATCH
+    connection = _connection()
+    # Блокировка записи буфера держится до удаления пачки: другой
+    # переносчик не выберет те же строки.
+    connection.execute('BEGIN IMMEDIATE')
+    saved = []
+    try:
+        rows = connection.execute(
+            'SELECT seq, token, post_id, author_id, text, created '
+            'FROM comment_buffer ORDER BY seq LIMIT ?', (batch_size,)
+        ).fetchall()
+        if rows:
+            saved, failed = _save(rows)
+            connection.executemany(
+                'INSERT OR REPLACE INTO comment_buffer_dead (seq, token, '
+                'post_id, author_id, text, created, error) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [row + (failed[row[1]],) for row in rows
+                 if row[1] in failed]
+            )
+            connection.execute(
+                'DELETE FROM comment_buffer WHERE seq <= ?', (rows[-1][0],)
+            )
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+    if not rows:
+        return 0
+    if failed:
+        logger.error('Комментарии не перенесены и отложены в '
+                     'comment_buffer_dead: %s', ', '.join(failed))
+        metrics.incr('comments.dead', len(failed))
+    counts = Counter(comment.post_id for comment in saved)
+    if counts:
+        comments_flushed.send(sender=Comment, post_ids=sorted(counts),
+                              count=len(saved), counts=dict(counts))
+    metrics.incr('comments.flushed', len(saved))
+    return len(rows)
+
+
+def flush_all():
+    total = 0
+    while True:
+        count = flush()
+        if not count:
+            return total
+        total += count
+
+
+def _flush_forever():
+    while True:
+        _wakeup.wait()
+        _wakeup.clear()
+        close_old_connections()
+        try:
+            flush_all()
+        except Exception:
+            logger.exception('Не удалось перенести комментарии из буфера')
+            # Буфер не пуст: повторить, не дожидаясь нового комментария.
+            _wakeup.set()
+        time.sleep(settings.COMMENT_FLUSH_INTERVAL)
+
+
+def start_flusher():
+    """Запускает фоновый поток переноса, если он ещё не запущен."""
+    global _flusher
+    if _flusher is not None or not settings.COMMENT_FLUSH_IN_PROCESS:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_forever, daemon=True,
+                                        name='comment-flusher')
+            _flusher.start()
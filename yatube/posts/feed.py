@@ -0,0 +1,263 @@
+"""Гибридная лента подписок.
+
+Посты обычных авторов доставляются в ленты подписчиков при публикации
+(push): в кэше у каждого пользователя хранится готовая хронология
+последних записей. Авторы, у которых подписчиков не меньше
+FEED_PULL_THRESHOLD, в хронологии не участвуют: их посты читаются при
+запросе ленты из индекса (author, pub_date) и сливаются с хронологией
+k-путевым слиянием через кучу.
+
+Посты групп, на которые подписан пользователь, входят в то же слияние
+отдельными потоками из индекса (group, pub_date). Поток группы общий
+для всех её подписчиков и кэшируется до следующего поста в группе.
+Пост автора из подписок, опубликованный в группе из подписок, попадает
+в слияние дважды и отбрасывается при повторе.
+
+Рассылка меняет хронологию под блокировкой в кэше на её ключ: воркеры
+run_tasks рассылают посты параллельно, и без неё одновременное чтение
+и запись одной хронологии теряли бы чужой пост. Занятую хронологию
+рассылка ждёт и вставляет пост по порядку pub_date.
+"""
+import heapq
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from core import metrics
+from . import follow_graph, sharding
+from .models import Follow, GroupSubscription, Post
+
+TIMELINE_KEY = 'feed:timeline:{}'
+FOLLOWER_COUNT_KEY = 'feed:followers:{}'
+GROUPS_KEY = 'feed:groups:{}'
+GROUP_STREAM_KEY = 'feed:group:{}'
+TIMELINE_LOCK_KEY = 'feed:timeline:lock:{}'
+TIMELINE_LOCK_TIMEOUT = 5
+TIMELINE_LOCK_POLL = 0.01
+FAN_OUT_CHUNK = 500
+
+
+def timeline_key(user_id):
+    return TIMELINE_KEY.format(user_id)
+
+
+def _lock_timeline(key):
+    return cache.add(TIMELINE_LOCK_KEY.format(key), 1, TIMELINE_LOCK_TIMEOUT)
+
+
+def _unlock_timelines(keys):
+    cache.delete_many([TIMELINE_LOCK_KEY.format(key) for key in keys])
+
+
+def follower_count_key(author_id):
+    return FOLLOWER_COUNT_KEY.format(author_id)
+
+
+def follower_counts(author_ids):
+    """Возвращает {author_id: число подписчиков} одним запросом на промах."""
+    keys = {follower_count_key(author_id): author_id
+            for author_id in author_ids}
+    counts = {keys[key]: count
+              for key, count in cache.get_many(keys).items()}
+    missing = set(author_ids) - counts.keys()
+    if missing:
+        loaded = dict.fromkeys(missing, 0)
+        loaded.update(
+            Follow.objects
+            .filter(author_id__in=missing)
+            .values_list('author_id')
+            .annotate(Count('id'))
+        )
+        cache.set_many(
+            {follower_count_key(author_id): count
+             for author_id, count in loaded.items()},
+            settings.FEED_TIMEOUT
+        )
+        counts.update(loaded)
+    return counts
+
+
+def is_pulled(follower_count):
+    return follower_count >= settings.FEED_PULL_THRESHOLD
+
+
+def _entry(pub_date, post_id, author_id):
+    return (pub_date.timestamp(), post_id, author_id)
+
+
+def _build_timeline(author_ids):
+    rows = sharding.merge(
+        Post.objects
+        .filter(author_id__in=author_ids)
+        .order_by('-pub_date', '-id')
+        .values_list('pub_date', 'id', 'author_id'),
+        settings.FEED_TIMELINE_SIZE, key=None
+    )
+    return [_entry(*row) for row in rows]
+
+
+def _pushed_stream(user_id, pushed_ids):
+    key = timeline_key(user_id)
+    timeline = cache.get(key)
+    if timeline is None:
+        metrics.incr('feed.push.miss')
+        # Хронология кэшируется под той же блокировкой, что и рассылка:
+        # иначе пост, разосланный во время сборки, пропал бы из неё.
+        # Если блокировку держит рассылка, хронология собирается без
+        # сохранения.
+        locked = _lock_timeline(key)
+        try:
+            timeline = _build_timeline(pushed_ids)
+            if locked:
+                cache.set(key, timeline, settings.FEED_TIMEOUT)
+        finally:
+            if locked:
+                _unlock_timelines([key])
+    # Хронология могла сохранить записи авторов, от которых пользователь
+    # отписался или которые с тех пор перешли на чтение при запросе.
+    return (entry for entry in timeline if entry[2] in pushed_ids)
+
+
+def _pulled_stream(author_id):
+    rows = (Post.objects
+            .using(sharding.shard_for_author(author_id))
+            .filter(author_id=author_id)
+            .order_by('-pub_date', '-id')
+            .values_list('pub_date', 'id', 'author_id')
+            [:settings.FEED_TIMELINE_SIZE])
+    return (_entry(*row) for row in rows)
+
+
+def subscribed_group_ids(user_id):
+    """Id групп, на которые подписан пользователь."""
+    key = GROUPS_KEY.format(user_id)
+    group_ids = cache.get(key)
+    if group_ids is None:
+        group_ids = list(GroupSubscription.objects
+                         .filter(user_id=user_id)
+                         .order_by('group_id')
+                         .values_list('group_id', flat=True))
+        cache.set(key, group_ids, settings.FEED_TIMEOUT)
+    return group_ids
+
+
+def _group_stream(group_id):
+    key = GROUP_STREAM_KEY.format(group_id)
+    entries = cache.get(key)
+    if entries is None:
+        metrics.incr('feed.group.miss')
+        rows = sharding.merge(
+            Post.objects
+            .filter(group_id=group_id)
+            .order_by('-pub_date', '-id')
+            .values_list('pub_date', 'id', 'author_id'),
+            settings.FEED_TIMELINE_SIZE, key=None
+        )
+        entries = [_entry(*row) for row in rows]
+        cache.set(key, entries, settings.FEED_TIMEOUT)
+    return entries
+
+
+def _unique(entries):
+    # Повторы одного поста одинаковы и после слияния идут подряд.
+    previous = None
+    for entry in entries:
+        if entry != previous:
+            yield entry
+        previous = entry
+
+
+def feed_entries(user_id):
+    """Записи ленты пользователя (timestamp, id, author_id) от новых
+    к старым."""
+    author_ids = follow_graph.get_following_ids(user_id)
+    group_ids = subscribed_group_ids(user_id)
+    if not author_ids and not group_ids:
+        return []
+    counts = follower_counts(author_ids)
+    pulled = [author_id for author_id in author_ids
+              if is_pulled(counts[author_id])]
+    pushed = set(author_ids) - set(pulled)
+    streams = []
+    if pushed:
+        with metrics.timer('feed.push'):
+            streams.append(list(_pushed_stream(user_id, pushed)))
+    # Потоки читаются целиком внутри своих таймеров: генератор
+    # выполнил бы запрос только при слиянии.
+    with metrics.timer('feed.pull'):
+        streams.extend(list(_pulled_stream(author_id))
+                       for author_id in pulled)
+    with metrics.timer('feed.groups'):
+        streams.extend(_group_stream(group_id) for group_id in group_ids)
+    with metrics.timer('feed.merge'):
+        merged = _unique(heapq.merge(*streams, reverse=True))
+        return list(islice(merged, settings.FEED_TIMELINE_SIZE))
+
+
+def feed_post_ids(user_id):
+    """Возвращает id постов ленты пользователя от новых к старым."""
+    return [entry[1] for entry in feed_entries(user_id)]
+
+
+def _insert_entry(timeline, entry):
+    """Вставляет запись в хронологию от новых к старым: посты,
+    разосланные параллельно, могут прийти не по порядку."""
+    if entry in timeline:
+        return
+    index = next((index for index, item in enumerate(timeline)
+                  if item < entry), len(timeline))
+    timeline.insert(index, entry)
+    del timeline[settings.FEED_TIMELINE_SIZE:]
+
+
+def fan_out(post):
+    """Доставляет новый пост в закэшированные ленты подписчиков."""
+    if is_pulled(follower_counts([post.author_id])[post.author_id]):
+        metrics.incr('feed.pull.skipped_fan_out')
+        return
+    entry = _entry(post.pub_date, post.id, post.author_id)
+    follower_ids = (Follow.objects
+                    .filter(author_id=post.author_id)
+                    .values_list('user_id', flat=True)
+                    .iterator())
+    delivered = 0
+    while True:
+        chunk = list(islice(follower_ids, FAN_OUT_CHUNK))
+        if not chunk:
+            break
+        pending = [timeline_key(user_id) for user_id in chunk]
+        while pending:
+            locked = [key for key in pending if _lock_timeline(key)]
+            try:
+                timelines = cache.get_many(locked)
+                for timeline in timelines.values():
+                    _insert_entry(timeline, entry)
+                cache.set_many(timelines, settings.FEED_TIMEOUT)
+            finally:
+                _unlock_timelines(locked)
+            delivered += len(timelines)
+            done = set(locked)
+            pending = [key for key in pending if key not in done]
+            if pending:
+                # Блокировку держат доли секунды; упавший воркер
+                # отпустит её по истечении TIMELINE_LOCK_TIMEOUT.
+                time.sleep(TIMELINE_LOCK_POLL)
+    metrics.incr('feed.push.delivered', delivered)
+
+
+def invalidate(user_ids=(), author_ids=(), group_ids=()):
+    """Сбрасывает хронологии пользователей, счётчики подписчиков и
+    потоки групп."""
+    cache.delete_many(
+        [timeline_key(user_id) for user_id in user_ids]
+        + [follower_count_key(author_id) for author_id in author_ids]
+        + [GROUP_STREAM_KEY.format(group_id) for group_id in group_ids]
+    )
+
+
+def invalidate_groups(user_id):
+    """Сбрасывает список групп пользователя после (от)подписки."""
+    cache.delete(GROUPS_KEY.format(user_id))
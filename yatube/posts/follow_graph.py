@@ -0,0 +1,93 @@
+"""Кэш графа подписок.
+
+Для каждого пользователя в общем кэше хранится отсортированный массив
+id авторов, на которых он подписан. Проверка подписки и построение
+ленты обходятся без обращения к таблице Follow. Подписка и отписка
+сбрасывают массив пользователя, и он загружается заново при чтении.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Follow
+
+FOLLOWING_KEY = 'follow_graph:following:{}'
+
+
+def _key(user_id):
+    return FOLLOWING_KEY.format(user_id)
+
+
+def _load(user_ids):
+    """Читает подписки нескольких пользователей одним запросом."""
+    graph = {user_id: array('q') for user_id in user_ids}
+    edges = (Follow.objects
+             .filter(user_id__in=user_ids)
+             .order_by('user_id', 'author_id')
+             .values_list('user_id', 'author_id'))
+    for user_id, author_id in edges:
+        graph[user_id].append(author_id)
+    return graph
+
+
+def _contains(ids, author_id):
+    position = bisect_left(ids, author_id)
+    return position < len(ids) and ids[position] == author_id
+
+
+def get_following_ids_many(user_ids):
+    """Возвращает {user_id: array id авторов} для набора пользователей."""
+    user_ids = set(user_ids)
+    keys = {_key(user_id): user_id for user_id in user_ids}
+    cached = cache.get_many(keys)
+    graph = {keys[key]: ids for key, ids in cached.items()}
+    missing = user_ids - graph.keys()
+    if missing:
+        loaded = _load(missing)
+        cache.set_many(
+            {_key(user_id): ids for user_id, ids in loaded.items()},
+            settings.FOLLOW_GRAPH_TIMEOUT
+        )
+        graph.update(loaded)
+    return graph
+
+
+def get_following_ids(user_id):
+    """Возвращает отсортированный массив id авторов пользователя."""
+    return get_following_ids_many([user_id])[user_id]
+
+
+def is_following(user_id, author_id):
+    return _contains(get_following_ids(user_id), author_id)
+
+
+def is_following_many(user_id, author_ids):
+    """Проверяет подписку сразу на несколько авторов.
+
+    Нужен лентам, которые рисуют кнопки подписки для каждой карточки.
+    """
+    ids = get_following_ids(user_id)
+    return {author_id: _contains(ids, author_id) for author_id in author_ids}
+
+
+def add_follow(user_id, author_id):
+    """Сбрасывает граф пользователя после подписки.
+
+    Граф не правится на месте: два одновременных изменения прочитали бы
+    один массив, и сохранилось бы только последнее. Следующее чтение
+    загрузит граф из базы одним запросом.
+    """
+    cache.delete(_key(user_id))
+
+
+def remove_follow(user_id, author_id):
+    """Сбрасывает граф пользователя после отписки."""
+    cache.delete(_key(user_id))
+
+
+def reset(user_id):
+    """Запоминает пустой граф, например для только что созданного
+    пользователя."""
+    cache.set(_key(user_id), array('q'), settings.FOLLOW_GRAPH_TIMEOUT)
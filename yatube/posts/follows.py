@@ -0,0 +1,99 @@
+"""Запись подписок на авторов и группы.
+
+Подписка на автора выполняется одним INSERT: конфликт по ограничению
+unique_users перехватывается, и производные данные (граф, ленты,
+популярность) обновляет сигнал post_save только для новой подписки.
+Подписка на группу — INSERT с игнорированием конфликта по
+unique_group_subscriptions, отписка — одним DELETE. Повторные и
+конкурентные запросы безопасны.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from core.db import retry_on_locked
+from . import feed, follow_graph
+from .models import Follow, GroupSubscription
+
+
+@retry_on_locked
+def follow(user_id, author_id):
+    if user_id == author_id:
+        return
+    try:
+        with transaction.atomic():
+            Follow.objects.create(user_id=user_id, author_id=author_id)
+    except IntegrityError:
+        # Подписка уже есть.
+        pass
+
+
+@retry_on_locked
+def unfollow(user_id, author_id):
+    Follow.objects.filter(user_id=user_id, author_id=author_id).delete()
+    follow_graph.remove_follow(user_id, author_id)
+    feed.invalidate(user_ids=[user_id], author_ids=[author_id])
+
+
+@retry_on_locked
+def subscribe_group(user_id, group_id):
+    GroupSubscription.objects.bulk_create(
+        [GroupSubscription(user_id=user_id, group_id=group_id)],
+        ignore_conflicts=True
+    )
+    feed.invalidate_groups(user_id)
+
+
+@retry_on_locked
+def unsubscribe_group(user_id, group_id):
+    GroupSubscription.objects.filter(user_id=user_id,
+                                     group_id=group_id).delete()
+    feed.invalidate_groups(user_id)
+
+
+def after_bulk_follow(edges):
+    """Обслуживание производных данных после пакетной записи рёбер.
+
+    Графы и ленты затронутых пользователей, а также счётчики подписчиков
+    авторов сбрасываются одной операцией на пачку и перечитываются при
+    следующем обращении.
+    """
+    user_ids = {user_id for user_id, _ in edges}
+    cache.delete_many(
+        [follow_graph.FOLLOWING_KEY.format(user_id) for user_id in user_ids]
+    )
+    feed.invalidate(user_ids=user_ids,
+                    author_ids={author_id for _, author_id in edges})
+
+
+@retry_on_locked
+def _flush(batch):
+    Follow.objects.bulk_create(
+        [Follow(user_id=user_id, author_id=author_id)
+         for user_id, author_id in batch],
+        ignore_conflicts=True
+    )
+    after_bulk_follow(batch)
+
+
+def bulk_follow(edges, batch_size=None):
+    """Импортирует пары (user_id, author_id) пачками.
+
+    edges может быть любым итератором, поэтому в памяти одновременно
+    находится не больше одной пачки. Возвращает число обработанных рёбер.
+    """
+    batch_size = batch_size or settings.FOLLOW_IMPORT_BATCH_SIZE
+    batch = []
+    total = 0
+    for user_id, author_id in edges:
+        if user_id == author_id:
+            continue
+        batch.append((user_id, author_id))
+        if len(batch) >= batch_size:
+            _flush(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        _flush(batch)
+        total += len(batch)
+    return total
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from posts import suggestions
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рекомендации «на кого подписаться» по графу '
+            'подписок и активности авторов в группах.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument(
+            '--user', type=int, nargs='*', dest='user_ids',
+            help='Пересчитать только этих пользователей'
+        )
+
+    def handle(self, *args, **options):
+        total = suggestions.compute(options['user_ids'],
+                                    options['batch_size'])
+        self.stdout.write(f'Пересчитано пользователей: {total}')
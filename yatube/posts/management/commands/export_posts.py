@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = ('Выгружает группы, посты и комментарии в NDJSON. Файл с '
+            'расширением .gz, .bz2 или .xz сжимается.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу выгрузки')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Сколько постов читать одним запросом')
+
+    def handle(self, *args, **options):
+        try:
+            total = transfer.export_posts(options['path'],
+                                          options['chunk_size'])
+        except OSError as error:
+            raise CommandError(error)
+        self.stdout.write(f'Выгружено постов: {total}')
@@ -0,0 +1,23 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import comment_buffer
+
+
+class Command(BaseCommand):
+    help = ('Переносит комментарии из локального буфера в базу. Запускается '
+            'при старте сервера, чтобы дописать буфер упавших процессов, '
+            'или постоянно с --loop.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Не завершаться, переносить постоянно')
+
+    def handle(self, *args, **options):
+        total = comment_buffer.flush_all()
+        while options['loop']:
+            time.sleep(settings.COMMENT_FLUSH_INTERVAL)
+            total += comment_buffer.flush_all()
+        self.stdout.write(f'Перенесено комментариев: {total}')
@@ -0,0 +1,134 @@
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.default import kvstore
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from posts import sharding
+from posts.models import MediaBlob, Post
+
+CHUNK_SIZE = 2000
+
+
+def referenced_images(chunk_size=CHUNK_SIZE):
+    """Имена картинок, на которые ссылаются посты всех шардов; читается
+    пачками по первичному ключу."""
+    names = set()
+    for alias in sharding.aliases():
+        last_id = 0
+        while True:
+            rows = list(Post.objects
+                        .using(alias)
+                        .filter(id__gt=last_id)
+                        .exclude(image='')
+                        .order_by('id')
+                        .values_list('id', 'image')[:chunk_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            names.update(name for _, name in rows)
+    return names
+
+
+def kvstore_rows(identity, chunk_size=CHUNK_SIZE):
+    """Пары (ключ без префикса, значение) хранилища sorl, пачками."""
+    prefix = add_prefix('', identity)
+    last_key = prefix
+    while True:
+        rows = list(KVStoreModel.objects
+                    .filter(key__gt=last_key, key__startswith=prefix)
+                    .order_by('key')
+                    .values_list('key', 'value')[:chunk_size])
+        if not rows:
+            return
+        last_key = rows[-1][0]
+        for key, value in rows:
+            yield del_prefix(key), deserialize(value)
+
+
+def live_thumbnails(sources):
+    """Делит ключи sorl на живые миниатюры и ключи, которые больше
+    не нужны, потому что их исходник не используется постами."""
+    image_names = {key: value['name']
+                   for key, value in kvstore_rows('image')}
+    alive = set()
+    dead_keys = []
+    for source_key, thumbnail_keys in kvstore_rows('thumbnails'):
+        if image_names.get(source_key) in sources:
+            alive.update(image_names[key] for key in thumbnail_keys
+                         if key in image_names)
+            continue
+        dead_keys.append(add_prefix(source_key, 'thumbnails'))
+        dead_keys.append(add_prefix(source_key, 'image'))
+        dead_keys.extend(add_prefix(key, 'image') for key in thumbnail_keys)
+    return alive, dead_keys
+
+
+def files_under(root, directory, min_age):
+    """Относительные имена файлов каталога, не моложе min_age секунд."""
+    threshold = time.time() - min_age
+    for dirpath, _, filenames in os.walk(os.path.join(root, directory)):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.stat(path).st_mtime <= threshold:
+                yield os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки постов и миниатюры sorl, на которые больше '
+            'ничего не ссылается.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только вывести список файлов')
+        parser.add_argument('--rate', type=float, default=100,
+                            help='Не больше стольких удалений в секунду')
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='Не трогать файлы моложе, секунд')
+
+    def handle(self, *args, **options):
+        upload_to = Post._meta.get_field('image').upload_to
+        sources = referenced_images()
+        thumbnails, dead_keys = live_thumbnails(sources)
+        orphans = (
+            name
+            for directory, alive in (
+                (upload_to, sources),
+                (thumbnail_settings.THUMBNAIL_PREFIX, thumbnails),
+            )
+            for name in files_under(settings.MEDIA_ROOT, directory,
+                                    options['min_age'])
+            if name not in alive
+        )
+        removed = 0
+        for chunk in chunked(orphans, CHUNK_SIZE):
+            for name in chunk:
+                if options['dry_run']:
+                    self.stdout.write(name)
+                    continue
+                os.remove(os.path.join(settings.MEDIA_ROOT, name))
+                removed += 1
+                if options['rate']:
+                    time.sleep(1 / options['rate'])
+            if not options['dry_run']:
+                MediaBlob.objects.filter(name__in=chunk).delete()
+        if not options['dry_run']:
+            for keys in chunked(dead_keys, CHUNK_SIZE):
+                kvstore._delete_raw(*keys)
+        self.stdout.write(f'Удалено файлов: {removed}, '
+                          f'ненужных записей sorl: {len(dead_keys)}')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from posts import sharding
+from posts.models import Post
+from posts.thumbnails import generate_card_thumbnails
+
+
+class Command(BaseCommand):
+    help = ('Заранее генерирует все размеры и форматы миниатюр карточек '
+            'для постов с картинками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--after-id', type=int, default=0,
+                            help='Начать с постов новее этого id')
+
+    def handle(self, *args, **options):
+        generated = 0
+        for alias in sharding.aliases():
+            last_id = options['after_id']
+            while True:
+                posts = list(Post.objects
+                             .using(alias)
+                             .filter(id__gt=last_id)
+                             .exclude(image='')
+                             .order_by('id')
+                             .only('id', 'image')[:options['batch_size']])
+                if not posts:
+                    break
+                last_id = posts[-1].id
+                for post in posts:
+                    generated += generate_card_thumbnails(post.image)
+                self.stdout.write(f'Обработаны посты до id {last_id}')
+        self.stdout.write(f'Миниатюр: {generated}')
@@ -0,0 +1,34 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from posts.follows import bulk_follow
+
+
+class Command(BaseCommand):
+    help = ('Импортирует подписки из CSV с колонками user_id,author_id. '
+            'Уже существующие подписки пропускаются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к CSV-файлу')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument(
+            '--skip-header', action='store_true',
+            help='Пропустить первую строку файла'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='') as csv_file:
+                reader = csv.reader(csv_file)
+                if options['skip_header']:
+                    next(reader, None)
+                edges = (
+                    (int(user_id), int(author_id))
+                    for user_id, author_id in reader
+                )
+                total = bulk_follow(edges, options['batch_size'])
+        except (OSError, ValueError, IntegrityError) as error:
+            raise CommandError(error)
+        self.stdout.write(f'Обработано подписок: {total}')
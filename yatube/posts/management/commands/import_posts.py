@@ -0,0 +1,113 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+
+from posts import polling, transfer
+
+
+def import_chunk(lines):
+    close_old_connections()
+    try:
+        return transfer.import_chunk(lines)
+    finally:
+        close_old_connections()
+
+
+def checkpoint_header(path, batch_size):
+    """Первая строка контрольной точки: номера пачек имеют смысл только
+    для того же файла и того же --batch-size."""
+    return (f'# batch-size={batch_size} size={os.path.getsize(path)} '
+            f'path={os.path.abspath(path)}\n')
+
+
+def read_checkpoint(path):
+    """Возвращает (заголовок, номера загруженных пачек)."""
+    if not os.path.exists(path):
+        return None, set()
+    with open(path) as checkpoint:
+        lines = [line for line in checkpoint if line.strip()]
+    header = lines.pop(0) if lines and lines[0].startswith('#') else None
+    return header, {int(line) for line in lines}
+
+
+class Command(BaseCommand):
+    help = ('Загружает выгрузку export_posts. Пользователи и группы '
+            'сопоставляются по username и slug, недостающие создаются. '
+            'Загруженные пачки отмечаются в файле контрольной точки, и '
+            'повторный запуск продолжает с места остановки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу выгрузки')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Строк выгрузки в одной пачке')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Число процессов загрузки')
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки, по умолчанию <path>.checkpoint'
+        )
+        parser.add_argument('--restart', action='store_true',
+                            help='Не учитывать контрольную точку')
+
+    def handle(self, *args, **options):
+        checkpoint_path = (options['checkpoint']
+                           or options['path'] + '.checkpoint')
+        try:
+            header = checkpoint_header(options['path'],
+                                       options['batch_size'])
+            saved, done = (None, set()) if options['restart'] else (
+                read_checkpoint(checkpoint_path)
+            )
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        if done and saved != header:
+            raise CommandError(
+                f'Контрольная точка {checkpoint_path} записана для другого '
+                'файла или --batch-size: запустите загрузку с теми же '
+                'параметрами или с --restart'
+            )
+        chunks = transfer.read_chunks(options['path'],
+                                      options['batch_size'], done)
+        posts = comments = 0
+        try:
+            with open(checkpoint_path, 'a' if done else 'w') as checkpoint:
+                if not done:
+                    checkpoint.write(header)
+
+                def finished(number, result):
+                    nonlocal posts, comments
+                    posts += result[0]
+                    comments += result[1]
+                    checkpoint.write(f'{number}\n')
+                    checkpoint.flush()
+                    os.fsync(checkpoint.fileno())
+
+                if options['workers'] == 1:
+                    for number, lines in chunks:
+                        finished(number, import_chunk(lines))
+                else:
+                    self.run_parallel(chunks, options['workers'], finished)
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(error)
+        cache.delete(polling.LATEST_KEY)
+        self.stdout.write(f'Новых постов: {posts}, '
+                          f'обработано комментариев: {comments}')
+
+    def run_parallel(self, chunks, workers, finished):
+        """Держит в работе не больше двух пачек на процесс, чтобы не
+        читать весь файл в память."""
+        # Дочерние процессы не должны наследовать открытые соединения.
+        connections.close_all()
+        with ProcessPoolExecutor(workers) as pool:
+            running = {}
+            for number, lines in chunks:
+                running[pool.submit(import_chunk, lines)] = number
+                if len(running) >= workers * 2:
+                    completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        finished(running.pop(future), future.result())
+            for future in list(running):
+                finished(running.pop(future), future.result())
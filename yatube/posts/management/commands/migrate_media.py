@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import sharding
+from posts.models import Post
+from posts.storage import acquire, content_name, file_digest, is_content_name
+
+
+def link_by_content(storage, name):
+    """Создаёт жёсткую ссылку на файл по адресу его содержимого.
+
+    Исходный файл удаляется только после обновления базы.
+    """
+    path = storage.path(name)
+    if not os.path.exists(path):
+        return name, None
+    with open(path, 'rb') as source:
+        digest = file_digest(iter(partial(source.read, 64 * 1024), b''))
+    new_name = content_name(name, digest)
+    new_path = storage.path(new_name)
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    try:
+        os.link(path, new_path)
+    except FileExistsError:
+        pass
+    return name, new_name
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов из плоского каталога в хранилище '
+            'с адресацией по содержимому.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=settings.MEDIA_MIGRATION_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def image_batches(self, alias, batch_size):
+        """Имена картинок шарда пачками по первичному ключу постов:
+        столбец image не индексирован, а id — да."""
+        last_id = 0
+        while True:
+            rows = list(Post.objects.using(alias)
+                        .filter(id__gt=last_id)
+                        .exclude(image='')
+                        .order_by('id')
+                        .values_list('id', 'image')[:batch_size])
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            # Уже перенесённые строки получают новое имя, поэтому повторно
+            # они отсеиваются через is_content_name.
+            yield list(dict.fromkeys(name for _, name in rows))
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        moved = 0
+        missing = set()
+        with ThreadPoolExecutor(options['workers']) as pool:
+            for alias in sharding.aliases():
+                for names in self.image_batches(alias, options['batch_size']):
+                    batch = [name for name in names
+                             if not is_content_name(name)
+                             and name not in missing]
+                    for name, new_name in pool.map(
+                        partial(link_by_content, storage), batch
+                    ):
+                        if new_name is None:
+                            missing.add(name)
+                            continue
+                        count = sum(
+                            Post.objects.using(other).filter(
+                                image=name
+                            ).update(image=new_name)
+                            for other in sharding.aliases()
+                        )
+                        acquire(new_name, count)
+                        os.remove(storage.path(name))
+                        moved += 1
+        self.stdout.write(f'Перенесено файлов: {moved}, '
+                          f'не найдено на диске: {len(missing)}')
@@ -0,0 +1,145 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import sharding
+from posts.models import AuthorShard, Comment, Post, User
+from posts.storage import acquire
+from posts.transfer import keep_auto_now_add
+
+
+def batches(queryset, batch_size):
+    """Объекты queryset пачками по первичному ключу."""
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id)
+                    .order_by('id')[:batch_size])
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+
+def _copy_new(queryset, target, batch_size, copied_ids):
+    """Копирует в target строки queryset, id которых нет в copied_ids,
+    и добавляет их туда. Возвращает скопированные объекты."""
+    model = queryset.model
+    copied = []
+    for batch in batches(queryset, batch_size):
+        new = [obj for obj in batch if obj.id not in copied_ids]
+        if new:
+            model.objects.using(target).bulk_create(new)
+            copied_ids.update(obj.id for obj in new)
+            copied.extend(new)
+    return copied
+
+
+def _copy_author(author_id, source, target, batch_size, post_ids,
+                 comment_ids):
+    """Одна транзакция копирования: посты автора и комментарии к ним,
+    которых ещё нет в target. Возвращает число скопированных строк."""
+    with transaction.atomic(using=target):
+        posts = _copy_new(
+            Post.objects.using(source).filter(author_id=author_id),
+            target, batch_size, post_ids
+        )
+        for post in posts:
+            if post.image:
+                # Удаление из старого шарда отпустит эту ссылку.
+                acquire(post.image.name)
+        # Комментарии ищутся по id постов, а не через JOIN: так
+        # находятся и те, чей пост в source уже удалён.
+        ids = sorted(post_ids)
+        comments = 0
+        for start in range(0, len(ids), batch_size):
+            comments += len(_copy_new(
+                Comment.objects.using(source).filter(
+                    post_id__in=ids[start:start + batch_size]
+                ),
+                target, batch_size, comment_ids
+            ))
+    return len(posts) + comments
+
+
+def _delete_copied(source, post_ids, comment_ids, batch_size):
+    """Удаляет из source скопированные комментарии, затем посты."""
+    for ids, model in ((sorted(comment_ids), Comment),
+                       (sorted(post_ids), Post)):
+        for start in range(0, len(ids), batch_size):
+            model.objects.using(source).filter(
+                id__in=ids[start:start + batch_size]
+            ).delete()
+
+
+def move_author(author_id, target, batch_size):
+    """Копирует посты автора и комментарии к ним в target, переключает
+    шард автора и удаляет записи из старого шарда.
+
+    Запросы, выбравшие шард до переключения, ещё могут писать в
+    старый шард. Поэтому после переключения строки, которых нет в
+    target, копируются повторно, пока очередной проход не найдёт
+    ничего нового, а после удаления старый шард проверяется ещё раз:
+    пост или комментарий, оставшийся там, переносится следующим
+    кругом. Потеряться может только комментарий, записанный между
+    последним проходом и каскадным удалением его поста. Счётчики
+    архива не меняются: удаление копий из старого шарда их не уменьшает
+    (см. posts.signals). Возвращает число перенесённых постов."""
+    source = sharding.shard_for_author(author_id)
+    if source == target:
+        return 0
+    post_ids, comment_ids = set(), set()
+    with keep_auto_now_add(Post._meta.get_field('pub_date'),
+                           Comment._meta.get_field('created')):
+        _copy_author(author_id, source, target, batch_size,
+                     post_ids, comment_ids)
+        if target == sharding.default_shard(author_id):
+            AuthorShard.objects.filter(author_id=author_id).delete()
+        else:
+            AuthorShard.objects.update_or_create(
+                author_id=author_id, defaults={'alias': target}
+            )
+        cache.delete(sharding.author_shard_key(author_id))
+        while True:
+            while _copy_author(author_id, source, target, batch_size,
+                               post_ids, comment_ids):
+                pass
+            cache.delete_many([sharding.post_shard_key(post_id)
+                               for post_id in post_ids])
+            _delete_copied(source, post_ids, comment_ids, batch_size)
+            if not _copy_author(author_id, source, target, batch_size,
+                                post_ids, comment_ids):
+                return len(post_ids)
+
+
+class Command(BaseCommand):
+    help = 'Переносит авторов между шардами постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help='Авторы, которых нужно перенести')
+        parser.add_argument('--to', help='Алиас шарда назначения')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--stats', action='store_true',
+                            help='Вывести число постов в каждом шарде')
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('POST_SHARDS не задан')
+        if options['usernames']:
+            target = options['to']
+            if target not in settings.POST_SHARDS:
+                raise CommandError(f'{target!r} нет в POST_SHARDS')
+            authors = dict(User.objects
+                           .filter(username__in=options['usernames'])
+                           .values_list('username', 'id'))
+            for username in options['usernames']:
+                if username not in authors:
+                    raise CommandError(f'Нет пользователя {username}')
+                moved = move_author(authors[username], target,
+                                    options['batch_size'])
+                self.stdout.write(f'{username}: перенесено постов {moved}')
+        if options['stats']:
+            for alias in settings.POST_SHARDS:
+                count = Post.objects.using(alias).count()
+                self.stdout.write(f'{alias}: {count}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts import archive
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает помесячные счётчики архива по таблицам постов. '
+            'Нужна один раз после миграции; дальше счётчики обновляются '
+            'сигналами.')
+
+    def handle(self, *args, **options):
+        total = archive.rebuild()
+        self.stdout.write(f'Строк сводки: {total}')
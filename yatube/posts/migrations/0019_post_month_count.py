@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-19 09:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_group_subscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostMonthCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=50)),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='postmonthcount',
+            constraint=models.UniqueConstraint(fields=('scope', 'year', 'month'), name='unique_scope_month'),
+        ),
+    ]
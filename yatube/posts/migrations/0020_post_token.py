@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-19 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_post_month_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='token',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, router
+
+from .storage import ContentAddressedStorage
 
 
 User = get_user_model()
@@ -14,9 +16,21 @@ class Group(models.Model):
         return self.title
 
 
+class ShardedQuerySet(models.QuerySet):
+    """create() передаёт роутеру создаваемый объект, чтобы пост или
+    комментарий без явного using() попал в шард своего автора."""
+
+    def create(self, **kwargs):
+        obj = self.model(**kwargs)
+        self._for_write = True
+        using = self._db or router.db_for_write(self.model, instance=obj)
+        obj.save(force_insert=True, using=using)
+        return obj
+
+
 class Post(models.Model):
     text = models.TextField()
-    pub_date = models.DateTimeField(auto_now_add=True)
+    pub_date = models.DateTimeField(auto_now_add=True, db_index=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -33,14 +47,29 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    # Пишется пачками из posts.view_counts.
+    views = models.PositiveIntegerField('Просмотры', default=0,
+                                        editable=False)
+    # Ключ поста из выгрузки: повторный импорт его не задублирует.
+    token = models.UUIDField(null=True, blank=True, unique=True,
+                             editable=False)
+
+    objects = ShardedQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.text[:15]
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['author', '-pub_date'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date'],
+                         name='post_group_pub_date_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -57,6 +86,11 @@ class Comment(models.Model):
     text = models.TextField('Текст комментария',
                             help_text='Введите комментарий')
     created = models.DateTimeField(auto_now_add=True)
+    # Ключ комментария из буфера: повторный перенос его не задублирует.
+    token = models.UUIDField(null=True, blank=True, unique=True,
+                             editable=False)
+
+    objects = ShardedQuerySet.as_manager()
 
 
 class Follow(models.Model):
@@ -81,3 +115,112 @@ class Follow(models.Model):
 
     def __str__(self) -> str:
         return self.author
+
+
+class GroupSubscription(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='group_subscriptions'
+    )
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.CASCADE,
+        related_name='subscriptions'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'group'),
+                name='unique_group_subscriptions'
+            )
+        ]
+
+    def __str__(self) -> str:
+        return str(self.group)
+
+
+class MediaBlob(models.Model):
+    """Файл хранилища и число постов, которые на него ссылаются."""
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.IntegerField(default=0)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class AuthorShard(models.Model):
+    """Шард автора, если он отличается от шарда по умолчанию."""
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shard'
+    )
+    alias = models.CharField(max_length=100)
+
+    def __str__(self) -> str:
+        return self.alias
+
+
+class ShardSequence(models.Model):
+    """Общий для всех шардов счётчик id модели: воркеры берут из него
+    id блоками."""
+    name = models.CharField(max_length=100, unique=True)
+    next_id = models.BigIntegerField()
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class TrendingScore(models.Model):
+    """Счёт популярности поста в эпохе era (см. posts.trending).
+
+    Ссылка на пост хранится числом: посты могут лежать в других шардах.
+    """
+    post_id = models.IntegerField(unique=True)
+    era = models.IntegerField()
+    score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['era', '-score'],
+                         name='trending_era_score_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.post_id}: {self.score}'
+
+
+class FollowSuggestion(models.Model):
+    """Рекомендованные пользователю авторы, посчитанные командой
+    compute_suggestions: JSON-список пар [id, username] по убыванию веса."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='follow_suggestions'
+    )
+    authors = models.TextField(default='[]')
+    computed = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return self.authors
+
+
+class PostMonthCount(models.Model):
+    """Число постов за месяц в области архива (см. posts.archive)."""
+    scope = models.CharField(max_length=50)
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('scope', 'year', 'month'),
+                name='unique_scope_month'
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.scope} {self.year}-{self.month:02}: {self.count}'
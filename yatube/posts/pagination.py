@@ -0,0 +1,123 @@
+"""Постраничный вывод по ключу (keyset pagination).
+
+В отличие от Paginator не считает общее число записей и не использует
+OFFSET: следующая страница выбирается условием key < cursor по
+индексированной колонке, поэтому стоимость не зависит от глубины.
+"""
+from datetime import datetime, timedelta, timezone
+
+from django.db.models import Q
+
+from yatube.settings import LIMIT_PAGES
+
+CURSOR_PARAM = 'after'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def get_cursor(request):
+    cursor = request.GET.get(CURSOR_PARAM)
+    if cursor is None or not cursor.isdigit():
+        return None
+    return int(cursor)
+
+
+def keyset_page(queryset, request, key='id', limit=LIMIT_PAGES):
+    """Возвращает {'object_list', 'next_cursor'} для убывающего key.
+
+    queryset может возвращать как объекты моделей, так и словари values().
+    """
+    cursor = get_cursor(request)
+    if cursor is not None:
+        queryset = queryset.filter(**{f'{key}__lt': cursor})
+    rows = list(queryset.order_by(f'-{key}')[:limit + 1])
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_next:
+        last = rows[-1]
+        next_cursor = last[key] if isinstance(last, dict) else getattr(
+            last, key
+        )
+    return {
+        'object_list': rows,
+        'next_cursor': next_cursor,
+    }
+
+
+def encode_post_cursor(post):
+    """Курсор поста: время публикации в микросекундах и id."""
+    microseconds = (post.pub_date - EPOCH) // timedelta(microseconds=1)
+    return f'{microseconds}_{post.id}'
+
+
+def _cursor_parts(value):
+    try:
+        first, second = (int(part) for part in value.split('_'))
+    except (AttributeError, ValueError):
+        return None
+    return first, second
+
+
+def decode_post_cursor(value):
+    parts = _cursor_parts(value)
+    if parts is None:
+        return None
+    microseconds, post_id = parts
+    return EPOCH + timedelta(microseconds=microseconds), post_id
+
+
+def post_keyset_page(queryset, request, limit=LIMIT_PAGES):
+    """Keyset-страница постов в порядке (-pub_date, -id)."""
+    cursor = decode_post_cursor(request.GET.get(CURSOR_PARAM))
+    if cursor is not None:
+        pub_date, post_id = cursor
+        queryset = queryset.filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=post_id)
+        )
+    posts = list(queryset.order_by('-pub_date', '-id')[:limit + 1])
+    return {
+        'object_list': posts[:limit],
+        'next_cursor': (encode_post_cursor(posts[limit - 1])
+                        if len(posts) > limit else None),
+    }
+
+
+def _entry_key(entry):
+    timestamp, post_id = entry[:2]
+    return round(timestamp * 1_000_000), post_id
+
+
+def entry_list_page(entries, request, limit=LIMIT_PAGES):
+    """Keyset-страница по готовой ленте записей (timestamp, id, ...),
+    упорядоченной по убыванию (pub_date, id). Курсор тот же, что у
+    post_keyset_page, поэтому страница продолжается с нужного места,
+    даже если пост-курсор удалён или вытеснен из ленты."""
+    cursor = _cursor_parts(request.GET.get(CURSOR_PARAM))
+    start = 0
+    if cursor is not None:
+        start = next((index for index, entry in enumerate(entries)
+                      if _entry_key(entry) < cursor), len(entries))
+    page = entries[start:start + limit]
+    has_next = len(entries) > start + limit
+    return {
+        'object_list': [entry[1] for entry in page],
+        'next_cursor': ('{}_{}'.format(*_entry_key(page[-1]))
+                        if has_next else None),
+    }
+
+
+def ranked_list_page(ranking, request, limit=LIMIT_PAGES):
+    """Страница рейтинга. ranking(version) возвращает (версия, id) —
+    снимок этой версии, если он ещё есть, иначе текущий. Курсор —
+    версия снимка и позиция следующей страницы: порядок рейтинга
+    задают счета, а не id, и пока снимок тот же, страницы стыкуются
+    без пропусков и повторов."""
+    cursor = _cursor_parts(request.GET.get(CURSOR_PARAM))
+    version, post_ids = ranking(cursor[0] if cursor else None)
+    start = max(cursor[1], 0) if cursor else 0
+    end = start + limit
+    return {
+        'object_list': post_ids[start:end],
+        'next_cursor': (f'{version}_{end}'
+                        if len(post_ids) > end else None),
+    }
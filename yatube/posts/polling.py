@@ -0,0 +1,143 @@
+"""Дешёвый опрос лент на появление новых постов.
+
+В кэше хранится отметка о последнем опубликованном посте (id и время)
+и наибольший выданный id. Пока клиент знает самый новый пост, ответ на
+опрос строится без обращения к базе.
+
+Новизна поста определяется парой (pub_date, id), а не одним id: с
+шардированием процессы резервируют id блоками (sharding.next_id), и
+пост, опубликованный позже, может получить меньший id.
+"""
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db.models import Max, Q
+
+from . import feed, sharding
+from .models import Post
+
+LATEST_KEY = 'posts:latest'
+LATEST_LOCK_KEY = 'posts:latest:lock'
+LATEST_LOCK_TIMEOUT = 5
+LATEST_LOCK_POLL = 0.01
+MAX_TIMESTAMP = datetime(9999, 12, 31, tzinfo=timezone.utc).timestamp()
+
+
+def _datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def _load_marker():
+    rows = sharding.merge(
+        Post.objects.order_by('-pub_date', '-id')
+        .values_list('pub_date', 'id'),
+        1, key=None
+    )
+    max_id = max(
+        Post.objects.using(alias).aggregate(Max('id'))['id__max'] or 0
+        for alias in sharding.aliases()
+    )
+    if not rows:
+        return (0, 0, max_id)
+    pub_date, post_id = rows[0]
+    return (post_id, pub_date.timestamp(), max_id)
+
+
+def _marker():
+    marker = cache.get(LATEST_KEY)
+    if marker is None:
+        # Отметку сохраняет только держатель блокировки, иначе её могла
+        # бы затереть отметка, прочитанная до публикации нового поста.
+        locked = cache.add(LATEST_LOCK_KEY, 1, LATEST_LOCK_TIMEOUT)
+        try:
+            marker = _load_marker()
+            if locked:
+                cache.set(LATEST_KEY, marker, None)
+        finally:
+            if locked:
+                cache.delete(LATEST_LOCK_KEY)
+    return marker
+
+
+def get_latest():
+    """Возвращает (id, timestamp) последнего поста или (0, 0)."""
+    latest_id, latest_ts, _ = _marker()
+    return latest_id, latest_ts
+
+
+def max_post_id():
+    """Наибольший id поста во всех шардах или 0."""
+    return _marker()[2]
+
+
+def set_latest(post):
+    """Учитывает новый пост в отметке.
+
+    Посты публикуются параллельно, поэтому отметка меняется под
+    блокировкой: пост, сохранённый раньше, не затрёт более новый.
+    """
+    while not cache.add(LATEST_LOCK_KEY, 1, LATEST_LOCK_TIMEOUT):
+        time.sleep(LATEST_LOCK_POLL)
+    try:
+        marker = cache.get(LATEST_KEY)
+        if marker is not None:
+            latest_id, latest_ts, max_id = marker
+            timestamp = post.pub_date.timestamp()
+            if (timestamp, post.id) > (latest_ts, latest_id):
+                latest_id, latest_ts = post.id, timestamp
+            cache.set(LATEST_KEY,
+                      (latest_id, latest_ts, max(max_id, post.id)), None)
+    finally:
+        cache.delete(LATEST_LOCK_KEY)
+
+
+def _newer_than(since_id):
+    """Условие «новее поста since_id» по (pub_date, id); пустое, если
+    такого поста нет."""
+    pub_date = (Post.objects.using(sharding.locate_post(since_id))
+                .filter(pk=since_id)
+                .values_list('pub_date', flat=True)
+                .first())
+    if pub_date is None:
+        return Q()
+    return Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, id__gt=since_id)
+
+
+def newer_post_ids(since_id=None, since_ts=None, limit=None):
+    """Id постов новее отметки клиента, не больше limit, от новых
+    к старым. Использует диапазон по (pub_date, id) или по pub_date."""
+    latest_id, latest_ts = get_latest()
+    if since_id is not None and since_id == latest_id:
+        return []
+    if since_ts is not None and since_ts >= latest_ts:
+        return []
+    posts = Post.objects.order_by('-pub_date', '-id')
+    if since_id is not None:
+        posts = posts.filter(_newer_than(since_id))
+    if since_ts is not None:
+        posts = posts.filter(pub_date__gt=_datetime(since_ts))
+    rows = sharding.merge(posts.values_list('pub_date', 'id'), limit,
+                          key=None)
+    return [post_id for _, post_id in rows]
+
+
+def newer_feed_post_ids(user_id, since_id=None, since_ts=None, limit=None):
+    """То же для ленты подписок: ответ берётся из кэшированной ленты."""
+    post_ids = feed.feed_post_ids(user_id)
+    if since_id in post_ids:
+        # Лента упорядочена по (pub_date, id): новее посты над отметкой.
+        post_ids = post_ids[:post_ids.index(since_id)]
+        since_id = None
+    if since_id is not None or since_ts is not None:
+        posts = Post.objects.filter(id__in=post_ids[:limit])
+        if since_id is not None:
+            posts = posts.filter(_newer_than(since_id))
+        if since_ts is not None:
+            posts = posts.filter(pub_date__gt=_datetime(since_ts))
+        rows = sharding.merge(
+            posts.order_by('-pub_date', '-id').values_list('pub_date', 'id'),
+            limit, key=None
+        )
+        post_ids = [post_id for _, post_id in rows]
+    return post_ids[:limit]
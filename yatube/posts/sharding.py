@@ -0,0 +1,304 @@
+"""Шардирование постов и комментариев по автору.
+
+Посты автора и комментарии к ним живут в одной базе из POST_SHARDS.
+Шард автора по умолчанию — POST_SHARDS[author_id % N], а авторы,
+перенесённые командой rebalance_shards, записаны в таблице AuthorShard
+в default. Пользователи, группы и подписки остаются в default.
+
+Запросы с известным автором или постом (профиль, страница поста,
+комментарии) идут в один шард через AuthorShardRouter. Общие ленты
+(главная, группа) собираются со всех шардов слиянием по pub_date.
+
+Роутер выбирает шард по объекту-подсказке. Post.objects.create()
+передаёт роутеру сам создаваемый объект (ShardedQuerySet), а
+bulk_create без using() подсказки не получает и пишет в default.
+id постов и комментариев выдаёт общий счётчик ShardSequence: при
+переносе автора строки сохраняют свои id.
+
+Если POST_SHARDS пуст, шардирование выключено и всё работает как без
+него: маршрутизация отдаётся следующему роутеру.
+"""
+import heapq
+import threading
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Max
+from django.http import Http404
+
+from core import routers as replicas
+
+from .models import AuthorShard, Comment, Post, ShardSequence, User
+
+AUTHOR_SHARD_KEY = 'shard:author:{}'
+POST_SHARD_KEY = 'shard:post:{}'
+SHARDED_MODELS = (Post, Comment)
+PRIMARY = 'default'
+
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def enabled():
+    return bool(settings.POST_SHARDS)
+
+
+def aliases():
+    """Базы, по которым разложены посты; [None] без шардирования —
+    тогда базу выбирают остальные роутеры."""
+    return list(settings.POST_SHARDS) or [None]
+
+
+def author_shard_key(author_id):
+    return AUTHOR_SHARD_KEY.format(author_id)
+
+
+def post_shard_key(post_id):
+    return POST_SHARD_KEY.format(post_id)
+
+
+def default_shard(author_id):
+    shards = settings.POST_SHARDS
+    return shards[author_id % len(shards)]
+
+
+def shard_for_author(author_id):
+    """База с постами автора или None без шардирования."""
+    if not enabled() or author_id is None:
+        return None
+    key = author_shard_key(author_id)
+    alias = cache.get(key)
+    if alias is None:
+        alias = (AuthorShard.objects.filter(author_id=author_id)
+                 .values_list('alias', flat=True).first()
+                 or default_shard(author_id))
+        cache.set(key, alias, settings.POST_SHARD_TIMEOUT)
+    return alias
+
+
+def locate_post(post_id):
+    """База, в которой лежит пост, или None, если поста нет нигде."""
+    if not enabled():
+        return None
+    key = post_shard_key(post_id)
+    alias = cache.get(key)
+    if alias is not None:
+        return alias
+    for alias in aliases():
+        if Post.objects.using(alias).filter(pk=post_id).exists():
+            cache.set(key, alias, settings.POST_SHARD_TIMEOUT)
+            return alias
+    return None
+
+
+def get_post_or_404(post_id):
+    if not enabled():
+        try:
+            return Post.objects.get(pk=post_id)
+        except Post.DoesNotExist:
+            raise Http404
+    alias = locate_post(post_id)
+    if alias is None:
+        raise Http404
+    try:
+        return Post.objects.using(alias).get(pk=post_id)
+    except Post.DoesNotExist:
+        cache.delete(post_shard_key(post_id))
+        raise Http404
+
+
+def _reserve_block(model):
+    name = model._meta.label_lower
+    size = settings.POST_SHARD_ID_BLOCK
+    sequences = ShardSequence.objects.using(PRIMARY)
+    if not sequences.filter(name=name).exists():
+        start = max(
+            model.objects.using(alias).aggregate(Max('id'))['id__max'] or 0
+            for alias in aliases()
+        ) + 1
+        sequences.bulk_create([ShardSequence(name=name, next_id=start)],
+                              ignore_conflicts=True)
+    with transaction.atomic(using=PRIMARY):
+        sequences.filter(name=name).update(next_id=F('next_id') + size)
+        end = sequences.values_list('next_id', flat=True).get(name=name)
+    return iter(range(end - size, end))
+
+
+def next_id(model):
+    """Следующий id поста или комментария, уникальный во всех шардах.
+
+    Автоинкремент каждого шарда для этого не годится: перенесённые
+    между шардами строки сохраняют свои id.
+    """
+    with _blocks_lock:
+        block = _blocks.get(model)
+        new_id = next(block, None) if block else None
+        if new_id is None:
+            block = _blocks[model] = _reserve_block(model)
+            new_id = next(block)
+        return new_id
+
+
+def with_related(queryset, *fields):
+    """select_related для постов: в шардах нет пользователей и групп,
+    поэтому вместо JOIN они загружаются отдельным запросом из default."""
+    if enabled():
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+def in_bulk(queryset, ids):
+    """in_bulk по всем шардам: по запросу на шард."""
+    found = {}
+    for alias in aliases():
+        found.update(queryset.using(alias).in_bulk(ids))
+    return found
+
+
+def merge(queryset, stop, key, reverse=True):
+    """Выполняет отсортированный queryset на каждом шарде и сливает
+    первые stop строк через кучу."""
+    streams = [queryset.using(alias)[:stop] for alias in aliases()]
+    return list(islice(heapq.merge(*streams, key=key, reverse=reverse),
+                       stop))
+
+
+class MergedPosts:
+    """Посты со всех шардов в порядке ordering.
+
+    Поддерживает то, что нужно Paginator и post_keyset_page: count(),
+    срезы, filter(), prefetch_related() и order_by(). Срез [a:b] читает
+    с каждого шарда первые b строк, поэтому глубокие страницы дороже,
+    чем с keyset.
+    """
+    ordered = True
+
+    def __init__(self, queryset, ordering=('-pub_date', '-id')):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+
+    def _clone(self, queryset=None, ordering=None):
+        return MergedPosts(
+            self.queryset if queryset is None else queryset,
+            self.ordering if ordering is None else ordering
+        )
+
+    def filter(self, *args, **kwargs):
+        return self._clone(self.queryset.filter(*args, **kwargs))
+
+    def prefetch_related(self, *fields):
+        return self._clone(self.queryset.prefetch_related(*fields))
+
+    def order_by(self, *ordering):
+        return self._clone(ordering=ordering)
+
+    def count(self):
+        return sum(self.queryset.using(alias).count()
+                   for alias in aliases())
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        key = attrgetter(*(field.lstrip('-') for field in self.ordering))
+        rows = merge(self.queryset.order_by(*self.ordering), index.stop,
+                     key, reverse=self.ordering[0].startswith('-'))
+        return rows[start:]
+
+
+def all_posts(queryset):
+    """Обёртка для общих лент: без шардирования queryset не меняется."""
+    if not enabled():
+        return queryset
+    return MergedPosts(queryset)
+
+
+def is_shard_database(alias):
+    """Все базы, кроме default и реплик, — шарды. Шард ещё до включения
+    в POST_SHARDS можно создать командой migrate --database."""
+    return alias != PRIMARY and alias not in settings.DATABASE_REPLICAS
+
+
+def _is_sharded(model):
+    return issubclass(model, SHARDED_MODELS)
+
+
+def shard_of(model, instance):
+    """Шард для запроса к model, связанного с instance."""
+    if isinstance(instance, User):
+        # Комментарии пользователя разбросаны по шардам чужих постов.
+        return shard_for_author(instance.pk) if model is Post else None
+    if isinstance(instance, Post):
+        if instance._state.adding:
+            return shard_for_author(instance.author_id)
+        return instance._state.db
+    if isinstance(instance, Comment):
+        if not instance._state.adding:
+            return instance._state.db
+        post = instance._state.fields_cache.get('post')
+        if post is not None:
+            return shard_of(Post, post)
+        if instance.post_id is not None:
+            return locate_post(instance.post_id)
+    return None
+
+
+class AuthorShardRouter:
+    """Отправляет запросы к Post и Comment в шард автора поста."""
+
+    def db_for_read(self, model, **hints):
+        if not enabled() or not _is_sharded(model):
+            return None
+        return shard_of(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        alias = self.db_for_read(model, **hints)
+        if alias is not None:
+            # ReplicaRouter до записи в шард не доходит.
+            replicas.pin()
+        return alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not enabled():
+            return None
+        sharded = [isinstance(obj, SHARDED_MODELS) for obj in (obj1, obj2)]
+        if not any(sharded):
+            return None
+        if not all(sharded):
+            # Ссылки на пользователей и группы в default — по замыслу.
+            return True
+        return (obj1._state.db == obj2._state.db
+                or obj1._state.adding or obj2._state.adding)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not is_shard_database(db):
+            return None
+        # В шардах нужны только таблицы постов и комментариев.
+        return app_label == 'posts' and model_name in ('post', 'comment')
+
+
+def disable_foreign_keys(connection):
+    """В шардах нет пользователей и групп, поэтому SQLite не должен
+    проверять внешние ключи на них."""
+    if connection.vendor == 'sqlite' and is_shard_database(connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA foreign_keys = OFF')
+
+
+def delete_author_data(user_id, keep_alias):
+    """Удаляет посты и комментарии пользователя во всех шардах, кроме
+    keep_alias: каскад удаления работает только внутри одной базы."""
+    for alias in settings.POST_SHARDS:
+        if alias == keep_alias:
+            continue
+        Post.objects.using(alias).filter(author_id=user_id).delete()
+        Comment.objects.using(alias).filter(author_id=user_id).delete()
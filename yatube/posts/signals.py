@@ -0,0 +1,134 @@
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import (archive, cards, comment_buffer, feed, follow_graph, polling,
+               sharding, storage, syndication, tasks, thumbnails, trending,
+               view_counts)
+from .models import Comment, Follow, Post, User
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        follow_graph.add_follow(instance.user_id, instance.author_id)
+        feed.invalidate(user_ids=[instance.user_id],
+                        author_ids=[instance.author_id])
+        trending.record_follow(instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    follow_graph.remove_follow(instance.user_id, instance.author_id)
+    feed.invalidate(user_ids=[instance.user_id],
+                    author_ids=[instance.author_id])
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, **kwargs):
+    instance._previous_image = None
+    instance._previous_group_id = None
+    # Новый файл сохраняется после сигнала, и хранилище берёт на него
+    # ссылку.
+    instance._uploading_image = (bool(instance.image)
+                                 and not instance.image._committed)
+    if not instance._state.adding:
+        instance._previous_image, instance._previous_group_id = (
+            Post.objects.using(instance._state.db).filter(pk=instance.pk)
+            .values_list('image', 'group_id').first() or (None, None)
+        )
+    elif instance.pk is None and sharding.enabled():
+        instance.pk = sharding.next_id(Post)
+
+
+@receiver(pre_save, sender=Comment)
+def comment_saving(sender, instance, **kwargs):
+    if instance.pk is None and sharding.enabled():
+        instance.pk = sharding.next_id(Comment)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        trending.record(instance.post_id, 'comment')
+
+
+@receiver(comment_buffer.comments_flushed)
+def comments_flushed(sender, counts, **kwargs):
+    trending.record_many(counts, 'comment')
+
+
+@receiver(view_counts.views_flushed)
+def views_flushed(sender, counts, **kwargs):
+    trending.record_many(counts, 'view')
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if created:
+        polling.set_latest(instance)
+        tasks.fan_out_post.enqueue([instance.id],
+                                   key=f'fan_out:{instance.id}')
+        archive.count_posts([instance])
+    else:
+        cards.invalidate(instance.id)
+        if instance.group_id != previous_group_id:
+            archive.group_changed(instance, previous_group_id)
+    syndication.post_changed(instance, previous_group_id, listed=created)
+    group_ids = {instance.group_id, previous_group_id} - {None}
+    if group_ids:
+        feed.invalidate(group_ids=group_ids)
+    previous = getattr(instance, '_previous_image', None)
+    if instance.image and instance.image.name != previous:
+        tasks.generate_post_thumbnails.enqueue(
+            [instance.id], key=f'thumbnails:{instance.image.name}'
+        )
+    if previous and previous != instance.image.name:
+        storage.release(instance.image.storage, previous)
+        thumbnails.invalidate_local_caches()
+    elif previous and getattr(instance, '_uploading_image', False):
+        # Загружен тот же файл: пост уже держал на него ссылку, а
+        # хранилище взяло ещё одну.
+        storage.release(instance.image.storage, previous)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, using, **kwargs):
+    cards.invalidate(instance.id)
+    if not sharding.enabled() or (
+            using == sharding.shard_for_author(instance.author_id)):
+        # Копия в шарде, откуда автора перенесли, в архиве не считалась.
+        archive.count_posts([instance], -1)
+    syndication.post_changed(instance, listed=True)
+    if instance.group_id:
+        feed.invalidate(group_ids=[instance.group_id])
+    if instance.image:
+        storage.release(instance.image.storage, instance.image.name)
+        thumbnails.invalidate_local_caches()
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    if created:
+        follow_graph.reset(instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Подписки удаляются каскадно одним запросом, без сигналов,
+    # поэтому графы подписчиков сбрасываются здесь.
+    user_ids = [instance.pk,
+                *instance.following.values_list('user_id', flat=True)]
+    cache.delete_many(
+        [follow_graph.FOLLOWING_KEY.format(user_id) for user_id in user_ids]
+    )
+    feed.invalidate(user_ids=user_ids)
+    sharding.delete_author_data(instance.pk, instance._state.db)
+
+
+@receiver(connection_created)
+def shard_connected(sender, connection, **kwargs):
+    sharding.disable_foreign_keys(connection)
@@ -0,0 +1,123 @@
+"""Хранилище картинок постов с адресацией по содержимому.
+
+Имя файла — хэш содержимого, разложенный по вложенным каталогам-шардам:
+posts/ab/cd/abcdef....jpg. Одинаковые загрузки хранятся один раз, а
+число ссылок на файл учитывается в модели MediaBlob: файл удаляется
+с диска, когда ссылок не остаётся.
+
+Уменьшение счётчика и удаление файла выполняются в одной транзакции
+с блокировкой строки MediaBlob, а сохранение сначала берёт ссылку и
+только потом проверяет, есть ли файл на диске. Поэтому файл не
+удаляется, пока на него ссылается хотя бы один пост.
+"""
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import router, transaction
+from django.db.models import F
+
+DIGEST_LENGTH = hashlib.sha256().digest_size * 2
+HEX_DIGITS = set('0123456789abcdef')
+
+
+def _shards(digest):
+    return [digest[i * 2:i * 2 + 2]
+            for i in range(settings.MEDIA_SHARD_DEPTH)]
+
+
+def content_name(name, digest):
+    """Строит имя файла по хэшу, сохраняя каталог и расширение name."""
+    directory = os.path.dirname(name)
+    extension = os.path.splitext(name)[1].lower()
+    return os.path.join(directory, *_shards(digest), digest + extension)
+
+
+def file_digest(chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_content_name(name):
+    """Проверяет, что файл уже лежит по адресу своего содержимого."""
+    digest = os.path.splitext(os.path.basename(name))[0]
+    if len(digest) != DIGEST_LENGTH or set(digest) - HEX_DIGITS:
+        return False
+    directories = name.split('/')[:-1]
+    return directories[-settings.MEDIA_SHARD_DEPTH:] == _shards(digest)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым, совпадение имён означает
+        # совпадение файлов.
+        return name
+
+    def _save(self, name, content):
+        name = content_name(name, file_digest(content.chunks()))
+        # Ссылка берётся до проверки файла: release() не удалит файл,
+        # пока на него есть ссылки.
+        acquire(name)
+        full_path = self.path(name)
+        if not os.path.exists(full_path):
+            directory = os.path.dirname(full_path)
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            # Параллельная загрузка того же файла запишет те же байты,
+            # поэтому атомарная замена безопасна.
+            os.replace(temp_path, full_path)
+        return name
+
+
+def _blob_model():
+    return apps.get_model('posts', 'MediaBlob')
+
+
+def acquire(name, count=1):
+    """Увеличивает число ссылок на файл."""
+    MediaBlob = _blob_model()
+    with transaction.atomic(using=router.db_for_write(MediaBlob)):
+        MediaBlob.objects.bulk_create(
+            [MediaBlob(name=name, refcount=0)], ignore_conflicts=True
+        )
+        MediaBlob.objects.filter(name=name).update(
+            refcount=F('refcount') + count
+        )
+
+
+def release(storage, name):
+    """Уменьшает число ссылок и удаляет файл, на который никто
+    не ссылается."""
+    MediaBlob = _blob_model()
+    with transaction.atomic(using=router.db_for_write(MediaBlob)):
+        blobs = MediaBlob.objects.select_for_update().filter(name=name)
+        blobs.update(refcount=F('refcount') - 1)
+        deleted, _ = blobs.filter(refcount__lte=0).delete()
+        if deleted:
+            # Файл удаляется до конца транзакции: acquire() того же
+            # имени ждёт её и после этого запишет файл заново.
+            storage.delete(name)
+
+
+@contextmanager
+def release_on_error(field_file):
+    """Отпускает ссылку на только что загруженный файл, если запись,
+    которая на него ссылается, не сохранилась."""
+    uploading = bool(field_file) and not field_file._committed
+    try:
+        yield
+    except Exception:
+        if uploading and field_file._committed:
+            release(field_file.storage, field_file.name)
+        raise
@@ -0,0 +1,167 @@
+"""Рекомендации «на кого подписаться».
+
+Живой запрос «подписки подписчиков» по таблице Follow слишком дорог,
+поэтому рекомендации считает пакетная команда compute_suggestions.
+Граф подписок один раз читается в компактные массивы id:
+у каждого пользователя — авторы, у каждого автора — подписчики.
+Кандидату начисляется
+
+* по единице за каждого пользователя, который подписан на того же
+  автора, что и пользователь, и на кандидата (совместные подписки);
+* SUGGESTIONS_GROUP_WEIGHT за каждую группу пользователя, в которой
+  кандидат входит в SUGGESTIONS_GROUP_AUTHORS самых активных авторов.
+
+Лучшие SUGGESTIONS_SIZE кандидатов сохраняются в FollowSuggestion
+и в кэш. Страница получает их одним чтением кэша, а уже оформленные
+подписки отсеивает по графу follow_graph.
+"""
+import heapq
+import json
+from array import array
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from core.db import retry_on_locked
+from . import follow_graph, sharding
+from .models import Follow, FollowSuggestion, Post, User
+
+SUGGESTIONS_KEY = 'suggestions:{}'
+CHUNK_SIZE = 5000
+
+
+def suggestions_key(user_id):
+    return SUGGESTIONS_KEY.format(user_id)
+
+
+def load_graph():
+    """Возвращает ({user_id: array авторов}, {author_id: array
+    подписчиков}); оба массива отсортированы."""
+    following = defaultdict(lambda: array('q'))
+    followers = defaultdict(lambda: array('q'))
+    edges = (Follow.objects
+             .order_by('user_id', 'author_id')
+             .values_list('user_id', 'author_id')
+             .iterator(chunk_size=CHUNK_SIZE))
+    for user_id, author_id in edges:
+        following[user_id].append(author_id)
+        followers[author_id].append(user_id)
+    return dict(following), dict(followers)
+
+
+def load_groups():
+    """Возвращает ({user_id: группы, где он писал}, {group_id: самые
+    активные авторы группы})."""
+    post_counts = Counter()
+    for alias in sharding.aliases():
+        rows = (Post.objects.using(alias)
+                .exclude(group=None)
+                .order_by()
+                .values_list('group_id', 'author_id')
+                .annotate(Count('id')))
+        for group_id, author_id, count in rows:
+            post_counts[group_id, author_id] += count
+    user_groups = defaultdict(set)
+    group_authors = defaultdict(list)
+    for (group_id, author_id), count in post_counts.items():
+        user_groups[author_id].add(group_id)
+        group_authors[group_id].append((count, author_id))
+    top_authors = {
+        group_id: [author_id for _, author_id in heapq.nlargest(
+            settings.SUGGESTIONS_GROUP_AUTHORS, authors
+        )]
+        for group_id, authors in group_authors.items()
+    }
+    return dict(user_groups), top_authors
+
+
+def _sample(ids, limit):
+    step = -(-len(ids) // limit)
+    return ids[::step] if step > 1 else ids
+
+
+def rank(user_id, following, followers, user_groups, top_authors):
+    """Id рекомендованных авторов пользователя по убыванию веса."""
+    followed = following.get(user_id, ())
+    scores = Counter()
+    for author_id in followed:
+        for other_id in _sample(followers[author_id],
+                                settings.SUGGESTIONS_MAX_FOLLOWERS):
+            if other_id != user_id:
+                scores.update(following[other_id])
+    for group_id in user_groups.get(user_id, ()):
+        for author_id in top_authors[group_id]:
+            scores[author_id] += settings.SUGGESTIONS_GROUP_WEIGHT
+    excluded = {user_id, *followed}
+    best = heapq.nlargest(
+        settings.SUGGESTIONS_SIZE,
+        ((score, -author_id) for author_id, score in scores.items()
+         if author_id not in excluded)
+    )
+    return [-author_id for _, author_id in best]
+
+
+@retry_on_locked
+def _save(ranked):
+    author_ids = {author_id for ids in ranked.values() for author_id in ids}
+    usernames = dict(User.objects.filter(id__in=author_ids)
+                     .values_list('id', 'username'))
+    authors = {
+        user_id: [[author_id, usernames[author_id]] for author_id in ids
+                  if author_id in usernames]
+        for user_id, ids in ranked.items()
+    }
+    FollowSuggestion.objects.filter(user_id__in=list(authors)).delete()
+    FollowSuggestion.objects.bulk_create(
+        FollowSuggestion(user_id=user_id, authors=json.dumps(pairs))
+        for user_id, pairs in authors.items() if pairs
+    )
+    cache.set_many(
+        {suggestions_key(user_id): pairs
+         for user_id, pairs in authors.items()},
+        settings.SUGGESTIONS_TIMEOUT
+    )
+
+
+def compute(user_ids=None, batch_size=None):
+    """Пересчитывает рекомендации пользователей user_ids (по умолчанию
+    всех) и возвращает их число."""
+    batch_size = batch_size or settings.SUGGESTIONS_BATCH_SIZE
+    following, followers = load_graph()
+    user_groups, top_authors = load_groups()
+    if user_ids is None:
+        user_ids = (User.objects.order_by('id')
+                    .values_list('id', flat=True)
+                    .iterator(chunk_size=CHUNK_SIZE))
+    user_ids = iter(user_ids)
+    total = 0
+    while True:
+        batch = list(islice(user_ids, batch_size))
+        if not batch:
+            return total
+        _save({
+            user_id: rank(user_id, following, followers, user_groups,
+                          top_authors)
+            for user_id in batch
+        })
+        total += len(batch)
+
+
+def for_user(user_id, limit=None):
+    """Пары (id, username) авторов, на которых стоит подписаться."""
+    key = suggestions_key(user_id)
+    authors = cache.get(key)
+    if authors is None:
+        row = (FollowSuggestion.objects.filter(user_id=user_id)
+               .values_list('authors', flat=True).first())
+        authors = json.loads(row) if row else []
+        cache.set(key, authors, settings.SUGGESTIONS_TIMEOUT)
+    limit = limit or settings.SUGGESTIONS_SHOWN
+    followed = follow_graph.is_following_many(
+        user_id, [author_id for author_id, _ in authors]
+    )
+    return [(author_id, username) for author_id, username in authors
+            if not followed[author_id]][:limit]
@@ -0,0 +1,247 @@
+"""Карта сайта и ленты RSS/Atom.
+
+Карта сайта — индекс и части по SITEMAP_CHUNK_SIZE постов. Часть n
+содержит посты с id из [n * size + 1, (n + 1) * size]; id выдаются
+общим счётчиком, поэтому части не пересекаются и находятся без OFFSET.
+Часть читается со всех шардов итератором по первичному ключу и
+отдаётся потоком: модели постов не создаются, а строки базы не
+накапливаются.
+
+Ответы версионируются по области: сайт, группа, автор (как в архиве)
+или часть карты сайта. Сигналы постов увеличивают версию области.
+ETag строится по версии, поэтому клиент с актуальной копией получает
+304. Готовое тело ленты кэшируется до смены версии; части карты сайта
+не кэшируются и не собираются в памяти целиком, повторные запросы к
+ним закрывает 304.
+"""
+import heapq
+import time
+
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.feedgenerator import Atom1Feed
+
+from . import archive, polling, sharding
+from .models import Group, Post, User
+
+VERSION_KEY = 'syndication:version:{}'
+BODY_KEY = 'syndication:body:{}:{}'
+SITEMAP_SCOPE = 'sitemap:{}'
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+ITERATOR_CHUNK = 2000
+
+
+def version(scope):
+    """Текущая версия области. Новая версия начинается со времени,
+    чтобы после потери кэша не совпасть со старой."""
+    key = VERSION_KEY.format(scope)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key)
+    return value
+
+
+def bump(scopes):
+    for scope in scopes:
+        try:
+            cache.incr(VERSION_KEY.format(scope))
+        except ValueError:
+            # Версии нет в кэше: следующее чтение начнёт новую.
+            pass
+
+
+def sitemap_chunk_of(post_id):
+    return (post_id - 1) // settings.SITEMAP_CHUNK_SIZE
+
+
+def post_changed(post, previous_group_id=None, listed=False):
+    """Меняет версии лент поста; listed — пост появился в карте сайта
+    или пропал из неё."""
+    scopes = archive.scopes_of(post.author_id, post.group_id)
+    if previous_group_id is not None:
+        scopes.append(archive.group_scope(previous_group_id))
+    if listed:
+        scopes.append(SITEMAP_SCOPE.format(sitemap_chunk_of(post.id)))
+    bump(scopes)
+
+
+def _serve(request, scope, render):
+    """Отдаёт 304 или результат render(версия области)."""
+    current = version(scope)
+    etag = quote_etag(f'{scope}-{current}')
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    response = render(current)
+    response['ETag'] = etag
+    return response
+
+
+class PostsFeed(Feed):
+    description = 'Новые записи на Yatube'
+
+    def items(self, obj):
+        queryset = sharding.with_related(self.posts(obj), 'author', 'group')
+        return list(sharding.all_posts(queryset)[:settings.FEED_ITEMS])
+
+    def posts(self, obj):
+        return Post.objects.all()
+
+    def item_title(self, item):
+        return str(item)
+
+    def item_description(self, item):
+        return item.text
+
+    def item_link(self, item):
+        return reverse('posts:post_detail', args=[item.id])
+
+    def item_pubdate(self, item):
+        return item.pub_date
+
+    def item_author_name(self, item):
+        return item.author.get_full_name() or item.author.username
+
+    def item_categories(self, item):
+        return [item.group.title] if item.group else []
+
+
+class IndexFeed(PostsFeed):
+    title = 'Последние обновления на сайте'
+
+    def link(self):
+        return reverse('posts:index')
+
+
+class GroupFeed(PostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Group, slug=slug)
+
+    def title(self, obj):
+        return f'Записи сообщества {obj.title}'
+
+    def description(self, obj):
+        return obj.description
+
+    def link(self, obj):
+        return reverse('posts:group_list', args=[obj.slug])
+
+    def posts(self, obj):
+        return obj.group.all()
+
+
+class AuthorFeed(PostsFeed):
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def title(self, obj):
+        return f'Записи пользователя {obj.get_full_name() or obj.username}'
+
+    def link(self, obj):
+        return reverse('posts:profile', args=[obj.username])
+
+    def posts(self, obj):
+        return obj.posts.all()
+
+
+def _atom(feed_class):
+    return type(f'Atom{feed_class.__name__}', (feed_class,), {
+        'feed_type': Atom1Feed,
+        'subtitle': feed_class.description,
+    })
+
+
+FEEDS = {
+    'rss': {'index': IndexFeed(), 'group': GroupFeed(),
+            'author': AuthorFeed()},
+    'atom': {'index': _atom(IndexFeed)(), 'group': _atom(GroupFeed)(),
+             'author': _atom(AuthorFeed)()},
+}
+
+
+def serve_feed(request, kind, name, scope, **kwargs):
+    if kind not in FEEDS:
+        raise Http404
+    feed = FEEDS[kind][name]
+
+    def render(current):
+        key = BODY_KEY.format(request.get_host() + request.path, current)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        response = feed(request, **kwargs)
+        cache.set(key, (response.content, response['Content-Type']),
+                  settings.SYNDICATION_TIMEOUT)
+        return response
+
+    return _serve(request, scope, render)
+
+
+def sitemap_chunks():
+    max_id = polling.max_post_id()
+    return sitemap_chunk_of(max_id) + 1 if max_id else 0
+
+
+def sitemap_index(request):
+    chunks = sitemap_chunks()
+    etag = quote_etag(f'sitemap-{chunks}')
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    urls = ''.join(
+        '<sitemap><loc>{}</loc></sitemap>'.format(request.build_absolute_uri(
+            reverse('posts:sitemap_chunk', args=[chunk])
+        ))
+        for chunk in range(chunks)
+    )
+    response = HttpResponse(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<sitemapindex xmlns="{SITEMAP_NS}">{urls}</sitemapindex>\n',
+        content_type='application/xml'
+    )
+    response['ETag'] = etag
+    return response
+
+
+def _chunk_rows(chunk):
+    start = chunk * settings.SITEMAP_CHUNK_SIZE + 1
+    streams = [
+        Post.objects.using(alias)
+        .filter(id__gte=start, id__lt=start + settings.SITEMAP_CHUNK_SIZE)
+        .order_by('id')
+        .values_list('id', 'pub_date')
+        .iterator(chunk_size=ITERATOR_CHUNK)
+        for alias in sharding.aliases()
+    ]
+    return heapq.merge(*streams)
+
+
+def _chunk_xml(request, chunk):
+    base = request.build_absolute_uri('/')[:-1]
+    template = base + reverse(
+        'posts:post_detail', kwargs={'post_id': 0}
+    ).replace('/0/', '/{}/')
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           f'<urlset xmlns="{SITEMAP_NS}">')
+    for post_id, pub_date in _chunk_rows(chunk):
+        yield (f'<url><loc>{template.format(post_id)}</loc>'
+               f'<lastmod>{pub_date.date().isoformat()}</lastmod></url>')
+    yield '</urlset>\n'
+
+
+def sitemap_chunk(request, chunk):
+    if chunk >= sitemap_chunks():
+        raise Http404
+    return _serve(
+        request, SITEMAP_SCOPE.format(chunk),
+        lambda current: StreamingHttpResponse(
+            _chunk_xml(request, chunk), content_type='application/xml'
+        )
+    )
@@ -0,0 +1,27 @@
+"""Фоновые задачи постов; выполняются воркером run_tasks."""
+from core.tasks import task
+from . import cards, feed, sharding, thumbnails
+from .models import Post
+
+
+def _load_post(post_id):
+    return (Post.objects.using(sharding.locate_post(post_id))
+            .filter(pk=post_id).first())
+
+
+@task(priority=10)
+def fan_out_post(post_id):
+    """Доставляет новый пост в ленты подписчиков."""
+    post = _load_post(post_id)
+    if post is not None:
+        feed.fan_out(post)
+
+
+@task()
+def generate_post_thumbnails(post_id):
+    """Заранее рисует миниатюры новой картинки поста и сбрасывает
+    карточку, закэшированную с заглушками."""
+    post = _load_post(post_id)
+    if post is not None and post.image:
+        thumbnails.generate_card_thumbnails(post.image)
+        cards.invalidate(post.id)
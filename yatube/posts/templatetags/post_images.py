@@ -0,0 +1,35 @@
+import logging
+
+from django import template
+from sorl.thumbnail.conf import settings as thumbnail_settings
+
+from posts.thumbnails import responsive_image as responsive_image_data
+
+register = template.Library()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = '(min-width: 992px) 960px, 100vw'
+
+
+@register.inclusion_tag('posts/includes/responsive_image.html')
+def responsive_image(image, sizes=DEFAULT_SIZES, css_class='card-img my-2'):
+    """Выводит <picture> с srcset по готовым размерам миниатюр.
+
+    Как и тег thumbnail из sorl, при ошибке ничего не выводит, если не
+    включён THUMBNAIL_DEBUG.
+    """
+    context = {'image': None, 'sizes': sizes, 'css_class': css_class}
+    if not image:
+        return context
+    try:
+        data = responsive_image_data(image)
+        fallback = data['fallback']
+        data.update(width=fallback.width, height=fallback.height)
+    except Exception:
+        if thumbnail_settings.THUMBNAIL_DEBUG:
+            raise
+        logger.exception('Не удалось вывести миниатюру %s', image)
+        return context
+    context.update(data, image=image)
+    return context
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import archive
+from ..models import Group, Post, PostMonthCount
+
+User = get_user_model()
+
+
+class ArchiveTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='archivist')
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='Описание')
+        cls.old = cls.author.posts.create(text='Старый', group=cls.group)
+        cls.new = cls.author.posts.create(text='Новый')
+        # auto_now_add не даёт задать дату при создании.
+        Post.objects.filter(id=cls.old.id).update(
+            pub_date=timezone.make_aware(datetime(2020, 1, 31, 23, 30))
+        )
+        archive.rebuild()
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_month_page(self):
+        """Страница месяца показывает только посты этого месяца и
+        навигацию по месяцам из сводки"""
+        url = reverse('posts:group_archive',
+                      kwargs={'slug': 'group', 'year': 2020, 'month': 1})
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual([post.id for post in response.context['page_obj']],
+                         [self.old.id])
+        self.assertEqual([(item[0], item[2])
+                          for item in response.context['months']],
+                         [(url, 1)])
+        self.assertEqual(
+            self.client.get(reverse(
+                'posts:archive', kwargs={'year': 2020, 'month': 13}
+            )).status_code,
+            404
+        )
+
+    def test_counts_follow_changes(self):
+        """Счётчики меняются при создании, смене группы и удалении"""
+        now = timezone.localtime()
+        post = self.author.posts.create(text='Ещё', group=self.group)
+        self.assertEqual(archive.months(archive.SITE)[0],
+                         (now.year, now.month, 2))
+        post.group = None
+        post.save()
+        self.assertEqual(archive.months(archive.group_scope(self.group.id)),
+                         [(2020, 1, 1)])
+        self.new.delete()
+        post.delete()
+        self.assertFalse(
+            PostMonthCount.objects.filter(scope=archive.SITE,
+                                          year=now.year, month=now.month,
+                                          count__gt=0).exists()
+        )
@@ -0,0 +1,135 @@
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError
+from django.db.models import QuerySet
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from .. import comment_buffer
+from ..models import Comment, Post
+
+User = get_user_model()
+TEMP_DIR = tempfile.mkdtemp()
+
+
+@override_settings(COMMENT_BUFFERING=True, COMMENT_FLUSH_IN_PROCESS=False,
+                   COMMENT_BUFFER_PATH=f'{TEMP_DIR}/buffer.sqlite3')
+class CommentBufferTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='commenter')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        comment_buffer.flush_all()
+        Comment.objects.all().delete()
+        self.client = Client()
+        self.client.force_login(self.author)
+        self.url = reverse('posts:post_detail',
+                           kwargs={'post_id': self.post.id})
+
+    def add_comment(self, text):
+        self.client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.id}),
+            {'text': text}
+        )
+
+    def test_author_sees_buffered_comment(self):
+        """Автор видит свой комментарий до переноса в базу, другие — нет"""
+        self.add_comment('Из буфера')
+        self.assertFalse(Comment.objects.exists())
+        response = self.client.get(self.url)
+        self.assertEqual([c.text for c in response.context['comments']],
+                         ['Из буфера'])
+        reader = Client()
+        reader.force_login(self.reader)
+        response = reader.get(self.url)
+        self.assertEqual(list(response.context['comments']), [])
+
+    def test_flush_in_batches(self):
+        """Буфер переносится пачками, а повторный перенос не дублирует"""
+        for i in range(3):
+            self.add_comment(f'Комментарий {i}')
+        rows = comment_buffer._connection().execute(
+            'SELECT seq, token, post_id, author_id, text, created '
+            'FROM comment_buffer ORDER BY seq'
+        ).fetchall()
+        self.assertEqual(comment_buffer.flush(batch_size=2), 2)
+        comment_buffer._save(rows)
+        self.assertEqual(comment_buffer.flush_all(), 1)
+        self.assertEqual(Comment.objects.count(), 3)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['comments']), 3)
+
+    def test_concurrent_flush_waits_for_claimed_batch(self):
+        """Второй переносчик не забирает пачку, которую ещё переносит
+        первый, и сигнал о ней отправляется один раз"""
+        for i in range(3):
+            self.add_comment(f'Комментарий {i}')
+        flushed = []
+        results = []
+
+        def receiver(sender, count, **kwargs):
+            flushed.append(count)
+
+        def save(rows):
+            # Пока первый переносчик пишет пачку, запускается второй.
+            thread = threading.Thread(
+                target=lambda: results.append(comment_buffer.flush())
+            )
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            threads.append(thread)
+            return original_save(rows)
+
+        threads = []
+        original_save = comment_buffer._save
+        comment_buffer.comments_flushed.connect(receiver)
+        self.addCleanup(comment_buffer.comments_flushed.disconnect, receiver)
+        with mock.patch.object(comment_buffer, '_save', save):
+            self.assertEqual(comment_buffer.flush(), 3)
+        threads[0].join()
+        self.assertEqual((flushed, results), ([3], [0]))
+
+    def test_deleted_author_does_not_block_buffer(self):
+        """Комментарий удалённого пользователя отбрасывается, а
+        остальные переносятся"""
+        stranger = User.objects.create_user(username='stranger')
+        comment_buffer.append(self.post.id, stranger.id, 'Пропадёт')
+        self.add_comment('Дойдёт')
+        stranger.delete()
+        self.assertEqual(comment_buffer.flush_all(), 2)
+        self.assertEqual(list(Comment.objects.values_list('text', flat=True)),
+                         ['Дойдёт'])
+
+    def test_rejected_row_moved_to_dead_letters(self):
+        """Строка, которую отвергла база, уходит в comment_buffer_dead"""
+        self.add_comment('Плохой')
+        self.add_comment('Хороший')
+        bulk_create = QuerySet.bulk_create
+
+        def reject_bad(queryset, objs, *args, **kwargs):
+            if any(comment.text == 'Плохой' for comment in objs):
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', reject_bad):
+            self.assertEqual(comment_buffer.flush_all(), 2)
+        self.assertEqual(list(Comment.objects.values_list('text', flat=True)),
+                         ['Хороший'])
+        dead = comment_buffer._connection().execute(
+            'SELECT text, error FROM comment_buffer_dead'
+        ).fetchall()
+        self.assertEqual(dead, [('Плохой', 'FOREIGN KEY constraint failed')])
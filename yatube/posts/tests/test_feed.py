@@ -0,0 +1,144 @@
+import threading
+from contextlib import contextmanager
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from core import metrics, tasks
+from .. import feed, follows
+from ..models import Group, Post
+from ..pagination import entry_list_page
+
+User = get_user_model()
+
+
+class HybridFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='author')
+        self.star = User.objects.create_user(username='star')
+        self.fan = User.objects.create_user(username='fan')
+        follows.follow(self.reader.id, self.author.id)
+        follows.follow(self.reader.id, self.star.id)
+        follows.follow(self.fan.id, self.star.id)
+
+    def create_posts(self):
+        posts = [
+            Post.objects.create(author=author, text=f'Пост {i}')
+            for i, author in enumerate(
+                [self.author, self.star, self.author, self.star]
+            )
+        ]
+        # Доставка в ленты выполняется фоновой задачей.
+        tasks.run_pending()
+        return posts
+
+    def test_push_feed_delivers_new_posts(self):
+        """Новый пост попадает в закэшированную ленту подписчика"""
+        self.assertEqual(feed.feed_post_ids(self.reader.id), [])
+        posts = self.create_posts()
+        with self.assertNumQueries(0):
+            post_ids = feed.feed_post_ids(self.reader.id)
+        self.assertEqual(post_ids, [post.id for post in reversed(posts)])
+        self.assertGreater(metrics.get('feed.push.delivered'), 0)
+
+    @override_settings(FEED_PULL_THRESHOLD=2)
+    @override_settings(TASKS_EAGER=False)
+    def test_fan_out_waits_for_locked_timeline(self):
+        """Рассылка не перезаписывает хронологию, которую меняет другой
+        воркер, а дожидается её и вставляет пост по порядку"""
+        feed.feed_post_ids(self.reader.id)
+        first, second = [Post.objects.create(author=self.author,
+                                             text=f'Пост {i}')
+                         for i in range(2)]
+        key = feed.timeline_key(self.reader.id)
+        self.assertTrue(feed._lock_timeline(key))
+        timer = threading.Timer(0.05, feed._unlock_timelines, [[key]])
+        timer.start()
+        self.assertEqual(feed.feed_post_ids(self.reader.id), [])
+        feed.fan_out(second)
+        feed.fan_out(first)
+        timer.join()
+        self.assertEqual(feed.feed_post_ids(self.reader.id),
+                         [second.id, first.id])
+
+    @override_settings(FEED_PULL_THRESHOLD=2)
+    def test_popular_author_merged_on_read(self):
+        """Посты популярного автора читаются при запросе и сливаются
+        с лентой по дате публикации"""
+        posts = self.create_posts()
+        self.assertEqual(
+            feed.feed_post_ids(self.reader.id),
+            [post.id for post in reversed(posts)]
+        )
+        self.assertEqual(metrics.get('feed.pull.count'), 1)
+
+    @override_settings(FEED_PULL_THRESHOLD=2)
+    def test_pull_timed_separately_from_merge(self):
+        """Запросы к постам популярных авторов идут внутри таймера
+        feed.pull, а слияние запросов не делает"""
+        self.create_posts()
+        cache.delete(feed.timeline_key(self.reader.id))
+        queries = {}
+        timer = metrics.timer
+
+        @contextmanager
+        def counting_timer(name):
+            with CaptureQueriesContext(connection) as captured, timer(name):
+                yield
+            queries[name] = len(captured)
+
+        with mock.patch.object(metrics, 'timer', counting_timer):
+            feed.feed_post_ids(self.reader.id)
+        self.assertEqual((queries['feed.pull'], queries['feed.merge']),
+                         (1, 0))
+
+    def test_unfollow_removes_posts_from_feed(self):
+        """После отписки посты автора пропадают из ленты"""
+        self.create_posts()
+        follows.unfollow(self.reader.id, self.star.id)
+        authors = set(
+            Post.objects
+            .filter(id__in=feed.feed_post_ids(self.reader.id))
+            .values_list('author_id', flat=True)
+        )
+        self.assertEqual(authors, {self.author.id})
+
+    def test_subscribed_groups_merged_without_duplicates(self):
+        """Посты групп из подписок сливаются с лентой, а пост автора из
+        подписок в такой группе встречается один раз"""
+        group = Group.objects.create(title='Группа', slug='group',
+                                     description='Описание')
+        self.assertEqual(feed.feed_post_ids(self.fan.id), [])
+        follows.subscribe_group(self.reader.id, group.id)
+        follows.subscribe_group(self.fan.id, group.id)
+        posts = self.create_posts()
+        posts += [
+            self.author.posts.create(text='В группе', group=group),
+            self.fan.posts.create(text='Чужой в группе', group=group),
+        ]
+        tasks.run_pending()
+        self.assertEqual(feed.feed_post_ids(self.reader.id),
+                         [post.id for post in reversed(posts)])
+        self.assertEqual(feed.feed_post_ids(self.fan.id),
+                         [posts[5].id, posts[4].id, posts[3].id,
+                          posts[1].id])
+        follows.unsubscribe_group(self.fan.id, group.id)
+        self.assertEqual(feed.feed_post_ids(self.fan.id),
+                         [posts[3].id, posts[1].id])
+
+    def test_cursor_of_removed_post(self):
+        """Курсор — время и id последнего поста: страница продолжается
+        с нужного места, даже если поста-курсора в ленте уже нет, а id
+        идут не по порядку"""
+        entries = [(50.0, 3, 1), (40.0, 7, 1), (30.0, 1, 1), (20.0, 12, 1),
+                   (10.0, 5, 1)]
+        request = RequestFactory().get('/', {'after': '35000000_10'})
+        page = entry_list_page(entries, request, limit=2)
+        self.assertEqual(page, {'object_list': [1, 12],
+                                'next_cursor': '20000000_12'})
@@ -0,0 +1,90 @@
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.cache import cache
+from django.test import TestCase
+
+from .. import follow_graph, follows
+from ..models import Follow
+
+User = get_user_model()
+
+
+class FollowGraphTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader')
+        self.authors = [
+            User.objects.create_user(username=f'author{i}') for i in range(3)
+        ]
+
+    def test_graph_updated_on_follow(self):
+        """Граф подписок обновляется при подписке и отписке"""
+        author = self.authors[0]
+        self.assertFalse(follow_graph.is_following(self.user.id, author.id))
+        follows.follow(self.user.id, author.id)
+        self.assertTrue(follow_graph.is_following(self.user.id, author.id))
+        follows.unfollow(self.user.id, author.id)
+        self.assertFalse(follow_graph.is_following(self.user.id, author.id))
+
+    def test_graph_loaded_without_queries_when_cached(self):
+        """Повторная проверка подписки не обращается к базе"""
+        Follow.objects.create(user=self.user, author=self.authors[1])
+        cache.clear()
+        with self.assertNumQueries(1):
+            follow_graph.get_following_ids(self.user.id)
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                follow_graph.is_following(self.user.id, self.authors[1].id)
+            )
+
+    def test_is_following_many(self):
+        """Пакетная проверка подписок на нескольких авторов"""
+        Follow.objects.create(user=self.user, author=self.authors[0])
+        Follow.objects.create(user=self.user, author=self.authors[2])
+        ids = [author.id for author in self.authors]
+        self.assertEqual(
+            follow_graph.is_following_many(self.user.id, ids),
+            {ids[0]: True, ids[1]: False, ids[2]: True}
+        )
+
+    def test_concurrent_follows_are_not_lost(self):
+        """Подписка, сделанная по устаревшему графу, не затирает другую"""
+        stale = follow_graph.get_following_ids(self.user.id)
+        follows.follow(self.user.id, self.authors[0].id)
+        follows.follow(self.user.id, self.authors[1].id)
+        self.assertEqual(len(stale), 0)
+        self.assertEqual(
+            list(follow_graph.get_following_ids(self.user.id)),
+            sorted([self.authors[0].id, self.authors[1].id])
+        )
+
+    def test_follow_is_idempotent(self):
+        """Повторная подписка не создаёт дубликатов"""
+        author = self.authors[0]
+        follows.follow(self.user.id, author.id)
+        follows.follow(self.user.id, author.id)
+        self.assertEqual(Follow.objects.count(), 1)
+
+    def test_deleted_follow_leaves_graph(self):
+        """Удаление подписки через модель убирает ребро из графа"""
+        author = self.authors[0]
+        follows.follow(self.user.id, author.id)
+        Follow.objects.get(user=self.user, author=author).delete()
+        self.assertFalse(follow_graph.is_following(self.user.id, author.id))
+
+    def test_import_follows_command(self):
+        """Команда import_follows пакетно загружает подписки из CSV"""
+        rows = [f'{self.user.id},{author.id}' for author in self.authors]
+        rows.append(f'{self.user.id},{self.user.id}')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as csv_file:
+            csv_file.write('user_id,author_id\n' + '\n'.join(rows))
+            csv_file.flush()
+            call_command('import_follows', csv_file.name, '--skip-header',
+                         '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(Follow.objects.filter(user=self.user).count(), 3)
+        self.assertTrue(
+            follow_graph.is_following(self.user.id, self.authors[2].id)
+        )
@@ -8,6 +8,7 @@ from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
 from ..models import Comment, Group, Post
+from ..storage import content_name, file_digest
 
 User = get_user_model()
 
@@ -70,7 +71,8 @@ class PostFormTest(TestCase):
         self.assertTrue(
             Post.objects.filter(
                 text=form_data['text'],
-                image=f'posts/{uploaded.name}',
+                image=content_name(f'posts/{uploaded.name}',
+                                   file_digest([small_gif])),
             ).exists()
         )
 
@@ -0,0 +1,58 @@
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from ..models import Post
+
+User = get_user_model()
+
+
+class NewPostsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='poller')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.old_post = Post.objects.create(author=self.user, text='Старый')
+
+    def test_no_new_posts_without_queries(self):
+        """Опрос без новых постов не обращается к базе"""
+        url = reverse('posts:new_posts')
+        self.client.get(url, {'since': self.old_post.id})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'since': self.old_post.id})
+        self.assertEqual(response.json()['count'], 0)
+
+    @override_settings(NEW_POSTS_LIMIT=2)
+    def test_new_posts_cards(self):
+        """Отдаются карточки новых постов, но не больше лимита"""
+        for i in range(3):
+            Post.objects.create(author=self.user, text=f'Новый пост {i}')
+        response = self.client.get(reverse('posts:new_posts'),
+                                   {'since': self.old_post.id})
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertTrue(data['more'])
+        self.assertIn('Новый пост 2', data['cards'][0])
+
+    def test_if_none_match(self):
+        """Повторный опрос с тем же ETag получает 304"""
+        url = reverse('posts:new_posts')
+        response = self.client.get(url, {'since': 0})
+        response = self.client.get(url, {'since': 0},
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_invalid_since_ts_ignored(self):
+        """nan, inf и время вне диапазона дат считаются отсутствующими"""
+        url = reverse('posts:new_posts')
+        for value in ('nan', 'inf', '-1e20', '1e20'):
+            response = self.client.get(url, {'since_ts': value})
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertEqual(response.json()['count'], 1)
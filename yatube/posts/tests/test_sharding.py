@@ -0,0 +1,185 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.http import Http404
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+from django.utils import timezone
+
+from core import routers
+
+from .. import polling, sharding, syndication
+from ..management.commands import rebalance_shards
+from ..models import AuthorShard, Comment, Group, Post, ShardSequence
+
+User = get_user_model()
+
+
+@override_settings(POST_SHARDS=['default'], POST_SHARD_ID_BLOCK=10)
+class ShardingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='sharded')
+        cls.group = Group.objects.create(
+            title='Группа', slug='sharded', description='Описание'
+        )
+
+    def setUp(self):
+        cache.clear()
+        sharding._blocks.clear()
+        self.client = Client()
+
+    def test_author_shard(self):
+        """Шард автора берётся из AuthorShard, иначе по модулю"""
+        self.assertEqual(sharding.shard_for_author(self.user.id), 'default')
+        AuthorShard.objects.create(author=self.user, alias='other')
+        cache.clear()
+        self.assertEqual(sharding.shard_for_author(self.user.id), 'other')
+
+    def test_ids_from_shared_sequence(self):
+        """id новых постов и комментариев выдаются общим счётчиком"""
+        first = Post(author=self.user, text='Первый')
+        first.save()
+        second = Post(author=self.user, text='Второй')
+        second.save()
+        comment = Comment(author=self.user, post=first, text='Комментарий')
+        comment.save()
+        self.assertEqual(second.id, first.id + 1)
+        self.assertEqual(
+            ShardSequence.objects.get(name='posts.post').next_id,
+            first.id + 10
+        )
+        self.assertTrue(ShardSequence.objects.filter(
+            name='posts.comment').exists())
+
+    def test_merged_feeds(self):
+        """Главная и группа собираются слиянием по дате"""
+        for i in range(3):
+            Post(author=self.user, text=f'Пост {i}', group=self.group).save()
+        posts = sharding.all_posts(Post.objects.filter(group=self.group))
+        self.assertEqual(posts.count(), 3)
+        self.assertEqual([post.text for post in posts[1:3]],
+                         ['Пост 1', 'Пост 0'])
+        response = self.client.get(reverse('posts:index'))
+        self.assertEqual(len(response.context['page_obj']), 3)
+        response = self.client.get(
+            reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        )
+        self.assertEqual(len(response.context['page_obj']), 3)
+
+    def test_create_routed_by_author(self):
+        """Post.objects.create() пишет в шард автора и закрепляет чтение
+        за основной базой"""
+        AuthorShard.objects.create(author=self.user, alias='default')
+        routers.reset()
+        post = Post.objects.create(author=self.user, text='Пост')
+        self.assertEqual(post._state.db, 'default')
+        self.assertTrue(routers.wrote())
+        routers.reset()
+
+    def test_missing_post(self):
+        """Поста нет ни в одном шарде — 404"""
+        with self.assertRaises(Http404):
+            sharding.get_post_or_404(10 ** 6)
+
+    def test_rebalance_unknown_shard(self):
+        """Перенос в неизвестный шард отклоняется"""
+        with self.assertRaises(CommandError):
+            call_command('rebalance_shards', self.user.username,
+                         '--to', 'missing')
+
+
+@override_settings(POST_SHARDS=['default', 'test_shard'],
+                   POST_SHARD_ID_BLOCK=10)
+class TwoShardsTest(TransactionTestCase):
+    """Два шарда. TransactionTestCase: TestCase в конце теста проверяет
+    внешние ключи, а постам в шарде не на что ссылаться."""
+    databases = {'default', 'test_shard'}
+
+    def setUp(self):
+        cache.clear()
+        sharding._blocks.clear()
+        # migrate при создании тестовой базы снова включил проверку
+        # внешних ключей на том же соединении.
+        sharding.disable_foreign_keys(connections['test_shard'])
+        self.near = User.objects.create_user(username='near')
+        self.far = User.objects.create_user(username='far')
+        AuthorShard.objects.create(author=self.near, alias='default')
+        AuthorShard.objects.create(author=self.far, alias='test_shard')
+
+    def test_posts_without_users_in_shard(self):
+        """Пост пишется в шард автора, где нет таблицы пользователей с
+        его строкой: проверка внешних ключей в шарде выключена"""
+        post = Post.objects.create(author=self.far, text='Далёкий')
+        self.assertEqual(post._state.db, 'test_shard')
+        with connections['test_shard'].cursor() as cursor:
+            cursor.execute('PRAGMA foreign_keys')
+            self.assertEqual(cursor.fetchone(), (0,))
+        self.assertEqual(sharding.get_post_or_404(post.id), post)
+
+    def test_merge_across_shards(self):
+        """Общие ленты сливают посты обоих шардов по дате"""
+        for i in range(4):
+            author = self.near if i % 2 else self.far
+            Post.objects.create(author=author, text=f'Пост {i}')
+        posts = sharding.all_posts(Post.objects.all())
+        self.assertEqual(posts.count(), 4)
+        self.assertEqual([post.text for post in posts[1:4]],
+                         ['Пост 2', 'Пост 1', 'Пост 0'])
+        response = Client().get(reverse('posts:index'))
+        self.assertEqual(
+            [post.text for post in response.context['page_obj']],
+            ['Пост 3', 'Пост 2', 'Пост 1', 'Пост 0']
+        )
+
+    def test_newer_post_with_smaller_id(self):
+        """Пост из блока id другого процесса может быть новее поста с
+        большим id: опрос и карта сайта это учитывают"""
+        older = Post.objects.create(author=self.near, text='Старше', id=50)
+        newer = Post.objects.create(author=self.far, text='Новее', id=5)
+        self.assertEqual(polling.get_latest()[0], newer.id)
+        self.assertEqual(polling.newer_post_ids(since_id=older.id),
+                         [newer.id])
+        self.assertEqual(polling.newer_post_ids(since_id=newer.id), [])
+        self.assertEqual(polling.max_post_id(), older.id)
+        self.assertEqual(syndication.sitemap_chunks(),
+                         syndication.sitemap_chunk_of(older.id) + 1)
+
+    def test_move_author(self):
+        """Перенос автора: посты и комментарии переезжают, а пост,
+        записанный в старый шард во время переноса, не теряется"""
+        posts = [Post.objects.create(author=self.near, text=f'Пост {i}')
+                 for i in range(3)]
+        Comment.objects.create(post=posts[0], author=self.far, text='Ок')
+        delete_copied = rebalance_shards._delete_copied
+        late = []
+
+        def write_late(*args):
+            if not late:
+                late.append(Post(author=self.near, text='Поздний',
+                                 pub_date=timezone.now()))
+                late[0].save(using='default')
+            delete_copied(*args)
+
+        with mock.patch.object(rebalance_shards, '_delete_copied',
+                               write_late):
+            call_command('rebalance_shards', 'near', '--to', 'test_shard',
+                         '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(Post.objects.using('default').count(), 0)
+        self.assertEqual(Comment.objects.using('default').count(), 0)
+        self.assertEqual(
+            sorted(Post.objects.using('test_shard')
+                   .values_list('text', flat=True)),
+            ['Поздний', 'Пост 0', 'Пост 1', 'Пост 2']
+        )
+        self.assertEqual(Comment.objects.using('test_shard').count(), 1)
+        self.assertEqual(sharding.shard_for_author(self.near.id),
+                         'test_shard')
+        self.assertEqual(sharding.get_post_or_404(late[0].id).text,
+                         'Поздний')
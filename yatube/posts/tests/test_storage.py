@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..models import MediaBlob, Post
+from ..storage import is_content_name, release_on_error
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedStorageTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, name='small.gif'):
+        return Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(name, SMALL_GIF, 'image/gif')
+        )
+
+    def test_identical_uploads_deduplicated(self):
+        """Одинаковые картинки хранятся одним файлом в шарде"""
+        first = self.create_post('one.gif')
+        second = self.create_post('two.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(is_content_name(first.image.name))
+        self.assertEqual(
+            MediaBlob.objects.get(name=first.image.name).refcount, 2
+        )
+
+    def test_file_removed_with_last_reference(self):
+        """Файл удаляется, когда на него не ссылается ни один пост"""
+        first = self.create_post()
+        second = self.create_post()
+        path = first.image.path
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_reupload_same_file_keeps_one_reference(self):
+        """Повторная загрузка той же картинки при правке поста не
+        добавляет ссылку"""
+        post = self.create_post()
+        post.image = SimpleUploadedFile('again.gif', SMALL_GIF, 'image/gif')
+        post.save()
+        self.assertEqual(
+            MediaBlob.objects.get(name=post.image.name).refcount, 1
+        )
+        path = post.image.path
+        post.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_failed_save_releases_reference(self):
+        """Ошибка сохранения поста не оставляет ссылку на файл"""
+        post = Post(author=self.user, text='Не сохранится',
+                    image=SimpleUploadedFile('lost.gif', SMALL_GIF,
+                                             'image/gif'))
+        with self.assertRaises(RuntimeError):
+            with release_on_error(post.image):
+                post.image.save(post.image.name, post.image.file, save=False)
+                raise RuntimeError
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_migrate_media_command(self):
+        """Команда migrate_media переносит файлы из плоского каталога"""
+        storage = Post._meta.get_field('image').storage
+        flat_path = os.path.join(TEMP_MEDIA_ROOT, 'posts', 'legacy.gif')
+        os.makedirs(os.path.dirname(flat_path), exist_ok=True)
+        with open(flat_path, 'wb') as legacy:
+            legacy.write(SMALL_GIF)
+        posts = [
+            Post.objects.create(author=self.user, text=f'Старый пост {i}',
+                                image='posts/legacy.gif')
+            for i in range(2)
+        ]
+        call_command('migrate_media', stdout=StringIO())
+        names = {post.image.name
+                 for post in Post.objects.filter(id__in=[p.id for p in posts])}
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(is_content_name(name))
+        self.assertFalse(os.path.exists(flat_path))
+        with storage.open(name) as migrated:
+            self.assertEqual(migrated.read(), SMALL_GIF)
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 2)
+        self.assertFalse(storage.exists('posts/legacy.gif'))
+        self.assertEqual(
+            storage.save('posts/again.gif', ContentFile(SMALL_GIF)), name
+        )
+
+    def test_gc_media_removes_orphans(self):
+        """Команда gc_media удаляет файлы, на которые нет ссылок"""
+        post = self.create_post()
+        orphans = [
+            os.path.join(TEMP_MEDIA_ROOT, 'posts', 'orphan.gif'),
+            os.path.join(TEMP_MEDIA_ROOT, 'cache', 'ab', 'orphan.jpg'),
+        ]
+        for path in orphans:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as orphan:
+                orphan.write(SMALL_GIF)
+        call_command('gc_media', '--dry-run', '--min-age', '0',
+                     stdout=StringIO())
+        self.assertTrue(all(os.path.exists(path) for path in orphans))
+        call_command('gc_media', '--min-age', '0', '--rate', '0',
+                     stdout=StringIO())
+        self.assertFalse(any(os.path.exists(path) for path in orphans))
+        self.assertTrue(os.path.exists(post.image.path))
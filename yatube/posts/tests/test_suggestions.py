@@ -0,0 +1,58 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from .. import follows, suggestions
+from ..models import Follow, FollowSuggestion, Group
+
+User = get_user_model()
+
+
+class SuggestionsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.users = {
+            name: User.objects.create_user(username=name)
+            for name in ('reader', 'friend', 'star', 'rising', 'writer')
+        }
+        edges = [('reader', 'star'), ('friend', 'star'),
+                 ('friend', 'rising'), ('writer', 'star')]
+        Follow.objects.bulk_create(
+            Follow(user=cls.users[user], author=cls.users[author])
+            for user, author in edges
+        )
+        group = Group.objects.create(title='Группа', slug='group',
+                                     description='Описание')
+        for name in ('reader', 'writer', 'writer'):
+            cls.users[name].posts.create(text='Пост', group=group)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_ranking(self):
+        """Совместные подписки и активность в группах пользователя
+        поднимают автора; своих авторов в рекомендациях нет"""
+        suggestions.compute(batch_size=2)
+        self.assertEqual(
+            suggestions.for_user(self.users['reader'].id),
+            [(self.users['writer'].id, 'writer'),
+             (self.users['rising'].id, 'rising')]
+        )
+
+    def test_single_cached_read(self):
+        """Рекомендации читаются из кэша; подписка сразу убирает автора"""
+        suggestions.compute()
+        reader = self.users['reader']
+        follows.follow(reader.id, self.users['writer'].id)
+        cache.delete(suggestions.suggestions_key(reader.id))
+        self.assertTrue(
+            FollowSuggestion.objects.filter(user=reader).exists()
+        )
+        client = Client()
+        client.force_login(reader)
+        client.get(reverse('posts:follow_index'))
+        response = client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['suggestions'],
+                         [(self.users['rising'].id, 'rising')])
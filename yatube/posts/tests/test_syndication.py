@@ -0,0 +1,79 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from .. import syndication
+from ..models import Group
+
+User = get_user_model()
+
+
+@override_settings(SITEMAP_CHUNK_SIZE=2)
+class SyndicationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='writer')
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='Описание')
+        cls.posts = [cls.author.posts.create(text=f'Пост {i}', group=cls.group)
+                     for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_sitemap(self):
+        """Индекс ссылается на части, часть перечисляет свои посты"""
+        chunk = syndication.sitemap_chunk_of(self.posts[2].id)
+        index = self.client.get(reverse('posts:sitemap')).content.decode()
+        self.assertEqual(index.count('<sitemap>'), chunk + 1)
+        response = self.client.get(
+            reverse('posts:sitemap_chunk', args=[chunk])
+        )
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn(reverse('posts:post_detail', args=[self.posts[2].id]),
+                      body)
+        self.assertNotIn(
+            reverse('posts:post_detail', args=[self.posts[0].id]), body
+        )
+        self.assertEqual(
+            self.client.get(reverse('posts:sitemap_chunk',
+                                    args=[chunk + 1])).status_code,
+            404
+        )
+
+    def test_feeds(self):
+        """Ленты RSS и Atom есть для сайта, групп и авторов"""
+        urls = [
+            reverse('posts:index_feed', args=['rss']),
+            reverse('posts:group_feed', args=['group', 'atom']),
+            reverse('posts:profile_feed', args=['writer', 'rss']),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Пост 2', response.content.decode())
+        self.assertEqual(
+            self.client.get(reverse('posts:index_feed',
+                                    args=['json'])).status_code,
+            404
+        )
+
+    def test_conditional_get(self):
+        """Пока версия не изменилась, ответ 304 и кэш без запросов;
+        новый пост меняет ETag"""
+        url = reverse('posts:group_feed', args=['group', 'rss'])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.author.posts.create(text='Новый', group=self.group)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Новый', response.content.decode())
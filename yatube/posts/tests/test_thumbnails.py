@@ -0,0 +1,119 @@
+import shutil
+import tempfile
+from http import HTTPStatus
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from .. import cards, tasks
+from ..models import Post
+from ..thumbnails import (CARD_GEOMETRY, CARD_OPTIONS, LOCK_KEY, LRUKVStore,
+                          PendingThumbnail, invalidate_local_caches)
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WAIT=0)
+class LockingThumbnailTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='photographer')
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile('small.gif', SMALL_GIF, 'image/gif')
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        default.kvstore.clear()
+        self.client = Client()
+
+    def test_generated_thumbnails_reset_card(self):
+        """После фоновой генерации миниатюр карточка с заглушками
+        рендерится заново"""
+        cache.set(cards.card_key(self.post.id), 'с заглушкой')
+        tasks.generate_post_thumbnails(self.post.id)
+        self.assertIsNone(cache.get(cards.card_key(self.post.id)))
+
+    def test_locked_thumbnail_returns_placeholder(self):
+        """Пока миниатюру рисует другой воркер, отдаётся заглушка,
+        а по её ссылке — готовый файл после снятия блокировки"""
+        _, thumbnail, _ = default.backend.lookup(self.post.image, '960x339')
+        cache.add(LOCK_KEY.format(thumbnail.name), 1)
+        image = get_thumbnail(self.post.image, '960x339')
+        self.assertIsInstance(image, PendingThumbnail)
+        self.assertEqual((image.width, image.height), (960, 339))
+        response = self.client.get(image.url)
+        self.assertEqual(response['Content-Type'], 'image/gif')
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        cache.delete(LOCK_KEY.format(thumbnail.name))
+        response = self.client.get(image.url)
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertEqual(response.url, thumbnail.url)
+
+    def test_unlocked_thumbnail_is_rendered(self):
+        """Без конкуренции миниатюра рисуется сразу"""
+        image = get_thumbnail(self.post.image, '960x339')
+        self.assertNotIsInstance(image, PendingThumbnail)
+        self.assertTrue(image.exists())
+
+    def test_lru_prefetch_serves_without_queries(self):
+        """После пакетной подгрузки запись sorl читается из памяти
+        процесса, а смена поколения сбрасывает локальный кэш"""
+        get_thumbnail(self.post.image, CARD_GEOMETRY, **CARD_OPTIONS)
+        _, thumbnail = default.backend.thumbnail_file(
+            self.post.image, CARD_GEOMETRY, dict(CARD_OPTIONS)
+        )
+        kvstore = LRUKVStore()
+        cache.clear()
+        with self.assertNumQueries(1):
+            kvstore.prefetch([add_prefix(thumbnail.key)])
+        with self.assertNumQueries(0):
+            self.assertEqual(kvstore.get(thumbnail).name, thumbnail.name)
+        invalidate_local_caches()
+        kvstore._checked_at = 0
+        kvstore._sync()
+        self.assertEqual(len(kvstore._lru), 0)
+
+    def test_forged_token_not_found(self):
+        """Неподписанная ссылка на миниатюру возвращает 404"""
+        response = self.client.get('/thumbnail/forged/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_responsive_image_srcset(self):
+        """Карточка выводит srcset только для готовых размеров и
+        ленивую загрузку"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        response = self.client.get(url)
+        self.assertContains(response, 'loading="lazy"')
+        self.assertNotContains(response, 'srcset')
+        call_command('generate_thumbnails', stdout=StringIO())
+        response = self.client.get(url)
+        self.assertContains(response, '480w')
+        self.assertContains(response, '1440w')
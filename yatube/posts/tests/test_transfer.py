@@ -0,0 +1,85 @@
+import os
+import tempfile
+import uuid
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from .. import archive
+from ..management.commands.import_posts import checkpoint_header
+from ..models import Comment, Group, Post
+from ..transfer import _insert_posts
+
+User = get_user_model()
+
+
+class TransferTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='writer')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(title='Группа', slug='group',
+                                          description='Описание')
+        self.posts = [
+            self.author.posts.create(text=f'Пост {i}', group=self.group)
+            for i in range(5)
+        ]
+        Comment.objects.create(post=self.posts[0], author=self.reader,
+                               text='Комментарий')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'posts.ndjson.gz')
+
+    def call(self, name, *args):
+        call_command(name, *args, stdout=StringIO())
+
+    def test_round_trip(self):
+        """Выгрузка загружается в пустую базу с сопоставлением по
+        username и slug и сохраняет даты"""
+        self.call('export_posts', self.path, '--chunk-size', '2')
+        dates = sorted(Post.objects.values_list('pub_date', flat=True))
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        self.call('import_posts', self.path, '--batch-size', '2')
+        self.assertEqual(Post.objects.count(), 5)
+        self.assertEqual(
+            sorted(Post.objects.values_list('pub_date', flat=True)), dates
+        )
+        post = Post.objects.get(text='Пост 0')
+        self.assertEqual((post.author.username, post.group.title),
+                         ('writer', 'Группа'))
+        self.assertEqual(post.comments.get().author.username, 'reader')
+
+    def test_resume_without_duplicates(self):
+        """Пачки из контрольной точки пропускаются, а повторная загрузка
+        уже записанных постов их не дублирует"""
+        self.call('export_posts', self.path)
+        Post.objects.all().delete()
+        with open(self.path + '.checkpoint', 'w') as checkpoint:
+            checkpoint.write(checkpoint_header(self.path, 3) + '0\n')
+        self.call('import_posts', self.path, '--batch-size', '3')
+        self.assertEqual(Post.objects.count(), 3)
+        self.call('import_posts', self.path, '--batch-size', '3')
+        self.assertEqual(Post.objects.count(), 3)
+        with self.assertRaises(CommandError):
+            self.call('import_posts', self.path, '--batch-size', '2')
+        self.call('import_posts', self.path, '--restart')
+        self.assertEqual(Post.objects.count(), 5)
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_conflicting_posts_not_counted(self):
+        """Посты, которые уже записал другой воркер, не попадают
+        в созданные и в счётчики архива"""
+        self.call('export_posts', self.path)
+        Post.objects.all().delete()
+        self.call('rebuild_archive')
+        taken = Post(token=uuid.uuid4(), author=self.author, text='Занят')
+        Post.objects.bulk_create([taken])
+        fresh = Post(token=uuid.uuid4(), author=self.author, text='Новый')
+        duplicate = Post(token=taken.token, author=self.author, text='Дубль')
+        self.assertEqual(_insert_posts(None, [fresh, duplicate]), [fresh])
+        self.call('import_posts', self.path)
+        self.call('import_posts', self.path, '--restart')
+        self.assertEqual(sum(count for _, _, count
+                             in archive.months(archive.SITE)), 5)
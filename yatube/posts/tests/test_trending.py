@@ -0,0 +1,105 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from .. import follows, trending
+from ..models import Comment, TrendingScore
+from ..pagination import ranked_list_page
+
+User = get_user_model()
+
+HALF_LIFE = 60 * 60
+ERA = HALF_LIFE * 4
+
+
+@override_settings(TRENDING_HALF_LIFE=HALF_LIFE, TRENDING_ERA=ERA,
+                   TRENDING_FLUSH_INTERVAL=60 * 60)
+class TrendingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='popular')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.posts = [cls.user.posts.create(text=f'Пост {i}')
+                     for i in range(3)]
+
+    def setUp(self):
+        trending.flush()
+        TrendingScore.objects.all().delete()
+        cache.clear()
+
+    def test_events_ranked_by_weight(self):
+        """Комментарий весит больше просмотра, подписка — больше
+        комментария"""
+        trending.record(self.posts[0].id, 'view', 3)
+        Comment.objects.create(post=self.posts[1], author=self.reader,
+                               text='Комментарий')
+        follows.follow(self.reader.id, self.user.id)
+        self.assertEqual(trending.flush(), 3)
+        self.assertEqual(trending.snapshot(),
+                         [self.posts[2].id, self.posts[1].id,
+                          self.posts[0].id])
+
+    def test_repeated_follow_counted_once(self):
+        """Повторная подписка на автора не поднимает его пост ещё раз"""
+        follows.follow(self.reader.id, self.user.id)
+        trending.flush()
+        score = TrendingScore.objects.get().score
+        follows.follow(self.reader.id, self.user.id)
+        trending.flush()
+        self.assertEqual(TrendingScore.objects.get().score, score)
+
+    def test_recent_events_outweigh_old(self):
+        """Вклад события затухает вдвое за период полураспада"""
+        era_start = trending.current_era() * ERA
+        trending.record(self.posts[0].id, 'view', 3, now=era_start)
+        trending.record(self.posts[1].id, 'view', 1,
+                        now=era_start + HALF_LIFE * 2)
+        trending.flush()
+        scores = dict(TrendingScore.objects.values_list('post_id', 'score'))
+        self.assertAlmostEqual(scores[self.posts[1].id] * 3,
+                               scores[self.posts[0].id] * 4)
+
+    def test_rebase(self):
+        """При смене эпохи счета переносятся, старые удаляются"""
+        era = trending.current_era()
+        TrendingScore.objects.create(post_id=self.posts[0].id, era=era - 1,
+                                     score=16)
+        TrendingScore.objects.create(post_id=self.posts[1].id, era=era - 2,
+                                     score=16)
+        trending.rebase(era)
+        self.assertEqual(
+            list(TrendingScore.objects.values_list('post_id', 'era', 'score')),
+            [(self.posts[0].id, era, 1)]
+        )
+
+    def test_page_served_from_snapshot(self):
+        """Страница читает снимок из кэша, а не пересчитывает рейтинг"""
+        trending.record(self.posts[1].id, 'comment')
+        trending.flush()
+        client = Client()
+        response = client.get(reverse('posts:trending'))
+        self.assertEqual([post.id for post in response.context['page_obj']],
+                         [self.posts[1].id])
+        trending.record(self.posts[0].id, 'comment', 2)
+        trending.flush()
+        response = client.get(reverse('posts:trending'))
+        self.assertEqual([post.id for post in response.context['page_obj']],
+                         [self.posts[1].id])
+
+    def test_ranked_page_keeps_snapshot(self):
+        """Курсор рейтинга — версия снимка и позиция: листание идёт по
+        своему снимку, хотя рейтинг уже пересобран"""
+        snapshots = {1: [3, 7, 1, 12, 5], 2: [12, 5, 3, 7, 1]}
+
+        def ranking(version):
+            version = version if version in snapshots else 2
+            return version, snapshots[version]
+
+        factory = RequestFactory()
+        page = ranked_list_page(ranking, factory.get('/', {'after': '1_2'}),
+                                limit=2)
+        self.assertEqual(page, {'object_list': [1, 12], 'next_cursor': '1_4'})
+        page = ranked_list_page(ranking, factory.get('/'), limit=2)
+        self.assertEqual(page, {'object_list': [12, 5], 'next_cursor': '2_2'})
@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from .. import trending, view_counts
+from ..models import Post
+
+User = get_user_model()
+
+
+class ViewCountsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='viewed')
+        cls.posts = [Post.objects.create(author=cls.user, text=f'Пост {i}')
+                     for i in range(2)]
+
+    def setUp(self):
+        # Буфер общий на процесс: просмотры из других тестов сбрасываются.
+        view_counts.flush()
+        trending.flush()
+        Post.objects.update(views=0)
+        self.client = Client()
+
+    def test_views_shown_before_flush(self):
+        """Просмотры видны сразу, а в базу пишутся позже"""
+        url = reverse('posts:post_detail',
+                      kwargs={'post_id': self.posts[0].id})
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.context['post'].views, 2)
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].views, 0)
+
+    def test_flush_single_update(self):
+        """Накопленные просмотры записываются одним запросом"""
+        for post, count in zip(self.posts, (3, 1)):
+            for _ in range(count):
+                view_counts.record(post.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(view_counts.flush(), 2)
+        self.assertEqual(
+            list(Post.objects.order_by('id').values_list('views', flat=True)),
+            [3, 1]
+        )
@@ -10,7 +10,9 @@ from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
 from yatube.settings import LIMIT_PAGES
+from .. import follows
 from ..models import Follow, Group, Post
+from ..storage import content_name, file_digest
 
 User = get_user_model()
 
@@ -38,6 +40,8 @@ class PostViewTest(TestCase):
             b'\x02\x00\x01\x00\x00\x02\x02\x0C'
             b'\x0A\x00\x3B'
         )
+        cls.image_name = content_name('posts/small.gif',
+                                      file_digest([small_gif]))
         uploaded = SimpleUploadedFile(
             name='small.gif',
             content=small_gif,
@@ -98,7 +102,7 @@ class PostViewTest(TestCase):
         group_description_0 = first_object.group.description
         self.assertEqual(post_text_0, 'Тестовый пост 13')
         self.assertEqual(post_author_0, 'testname')
-        self.assertEqual(post_image_0, 'posts/small.gif')
+        self.assertEqual(post_image_0, self.image_name)
         self.assertEqual(group_title_0, 'Тестовая группа')
         self.assertEqual(group_slug_0, 'test-slug')
         self.assertEqual(group_description_0, 'Тестовое описание')
@@ -112,7 +116,7 @@ class PostViewTest(TestCase):
         post_image_0 = first_object.image
         self.assertEqual(post_group_0,
                          'Тестовая группа')
-        self.assertEqual(post_image_0, 'posts/small.gif')
+        self.assertEqual(post_image_0, self.image_name)
 
     def test_profile_show_correct_context(self):
         """Шаблон profile сформирован с правильным контекстом"""
@@ -124,7 +128,7 @@ class PostViewTest(TestCase):
         post_image_0 = first_object.image
         self.assertEqual(post_author_0,
                          'testname')
-        self.assertEqual(post_image_0, 'posts/small.gif')
+        self.assertEqual(post_image_0, self.image_name)
 
     def test_post_detail_show_correct_context(self):
         """Шаблон post_detail сформирован с правильным контекстом"""
@@ -136,7 +140,7 @@ class PostViewTest(TestCase):
         post_image_0 = first_object.image
         self.assertEqual(post_id_0,
                          101)
-        self.assertEqual(post_image_0, 'posts/small.gif')
+        self.assertEqual(post_image_0, self.image_name)
 
     def test_post_create_show_correct_context(self):
         """Шаблон post_create сформирован с правильным контекстом"""
@@ -165,6 +169,29 @@ class PostViewTest(TestCase):
                 form_field = response.context.get('form').fields.get(value)
                 self.assertIsInstance(form_field, expected)
 
+    def test_fragment_mode_walks_all_posts(self):
+        """Режим фрагментов отдаёт только карточки и курсор следующей
+        порции, по которому обходятся все посты"""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'testname'}),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                seen = 0
+                params = {'fragment': '1'}
+                while True:
+                    response = self.guest_client.get(url, params)
+                    content = response.content.decode()
+                    self.assertNotIn('<html', content)
+                    seen += content.count('Дата публикации')
+                    if 'X-Next-Cursor' not in response:
+                        break
+                    self.assertIn('rel="prefetch"', content)
+                    params['after'] = response['X-Next-Cursor']
+                self.assertEqual(seen, NUMBER_OF_TEST_POSTS + 1)
+
     def test_first_page_contains_ten_posts(self):
         """Паджинатор выводит 10 постов на первую страницу index, group list,
         profile"""
@@ -368,3 +395,44 @@ class FollowTests(TestCase):
                                                       self.user_following.
                                                       username}))
         self.assertEqual(Follow.objects.all().count(), 1)
+
+    def test_follow_unknown_user(self):
+        """Подписка на несуществующего пользователя возвращает 404"""
+        response = self.client_auth_follower.get(
+            reverse('posts:profile_follow', kwargs={'username': 'nobody'})
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Follow.objects.all().count(), 0)
+
+    def test_followers_and_following_lists(self):
+        """Списки подписчиков и подписок выводятся постранично по курсору"""
+        readers = [User.objects.create_user(username=f'reader{i}')
+                   for i in range(LIMIT_PAGES + 2)]
+        follows.bulk_follow(
+            (reader.id, self.user_following.id) for reader in readers
+        )
+        url = reverse('posts:followers',
+                      kwargs={'username': self.user_following.username})
+        response = self.client_auth_follower.get(url)
+        first_page = response.context['users']
+        self.assertEqual(first_page, readers[::-1][:LIMIT_PAGES])
+        response = self.client_auth_follower.get(
+            url, {'after': response.context['next_cursor']}
+        )
+        self.assertEqual(response.context['users'], readers[1::-1])
+        self.assertIsNone(response.context['next_cursor'])
+        response = self.client_auth_follower.get(
+            reverse('posts:following',
+                    kwargs={'username': readers[0].username})
+        )
+        self.assertEqual(response.context['users'], [self.user_following])
+
+    def test_follow_index_fragment(self):
+        """Лента подписок поддерживает режим фрагментов"""
+        Follow.objects.create(user=self.user_follower,
+                              author=self.user_following)
+        response = self.client_auth_follower.get(
+            reverse('posts:follow_index'), {'fragment': '1'}
+        )
+        self.assertContains(response, 'Тестовая запись для теста подписок')
+        self.assertNotContains(response, '<html')
@@ -0,0 +1,302 @@
+"""Миниатюры sorl-thumbnail.
+
+Миниатюру каждого размера рисует ровно один воркер: он берёт блокировку
+в общем кэше. Остальные запросы сразу получают заглушку, ссылка которой
+ведёт на представление posts:thumbnail. Оно дожидается готового файла
+и перенаправляет на него.
+
+Записи хранилища ключей sorl дополнительно кэшируются внутри процесса
+(LRUKVStore) и подгружаются пачкой для всех карточек страницы.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.urls import reverse
+from PIL import features
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import BaseImageFile, ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from sorl.thumbnail.parsers import parse_geometry
+
+LOCK_KEY = 'thumbnail:lock:{}'
+GENERATION_KEY = 'thumbnail:lru:generation'
+TOKEN_SALT = 'posts.thumbnails'
+
+# Основная миниатюра карточки поста; остальные размеры сохраняют её
+# пропорции.
+CARD_GEOMETRY = '960x339'
+CARD_OPTIONS = {'crop': 'center', 'upscale': True}
+MIME_TYPES = {'WEBP': 'image/webp', 'AVIF': 'image/avif'}
+
+# Прозрачный GIF 1x1.
+PLACEHOLDER_GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!'
+    b'\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00'
+    b'\x00\x02\x02D\x01\x00;'
+)
+
+
+class PendingThumbnail(BaseImageFile):
+    """Заглушка на время генерации: размеры берутся из геометрии,
+    ссылка ведёт на представление posts:thumbnail."""
+
+    def __init__(self, source, geometry_string, options):
+        self.size = parse_geometry(geometry_string)
+        self.token = signing.dumps(
+            {'name': source.name, 'geometry': geometry_string,
+             'options': options},
+            salt=TOKEN_SALT
+        )
+
+    def exists(self):
+        return False
+
+    @property
+    def url(self):
+        return reverse('posts:thumbnail', kwargs={'token': self.token})
+
+
+class LockingThumbnailBackend(ThumbnailBackend):
+
+    def thumbnail_file(self, file_, geometry_string, options):
+        """Возвращает (source, thumbnail) без обращения к хранилищу
+        ключей и к диску; options дополняется значениями по умолчанию."""
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return source, ImageFile(name, default.storage)
+
+    def lookup(self, file_, geometry_string, **options):
+        """Возвращает (source, thumbnail, готовая миниатюра или None),
+        ничего не генерируя."""
+        source, thumbnail = self.thumbnail_file(
+            file_, geometry_string, options
+        )
+        return source, thumbnail, default.kvstore.get(thumbnail)
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        source, thumbnail, cached = self.lookup(
+            file_, geometry_string, **options
+        )
+        if cached:
+            return cached
+        lock_key = LOCK_KEY.format(thumbnail.name)
+        if not cache.add(lock_key, 1, settings.THUMBNAIL_LOCK_TIMEOUT):
+            return PendingThumbnail(source, geometry_string, options)
+        try:
+            return super().get_thumbnail(file_, geometry_string, **options)
+        finally:
+            cache.delete(lock_key)
+
+    def wait_thumbnail(self, file_, geometry_string, timeout, **options):
+        """Ждёт, пока другой воркер закончит генерацию, и возвращает
+        миниатюру или PendingThumbnail, если не дождались."""
+        deadline = time.monotonic() + timeout
+        while True:
+            thumbnail = self.get_thumbnail(file_, geometry_string, **options)
+            if (not isinstance(thumbnail, PendingThumbnail)
+                    or time.monotonic() >= deadline):
+                return thumbnail
+            time.sleep(settings.THUMBNAIL_POLL_INTERVAL)
+
+
+def load_token(token):
+    """Разбирает подписанную ссылку заглушки; None, если подпись неверна."""
+    try:
+        return signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        return None
+
+
+class LRUKVStore(KVStore):
+    """Хранилище ключей sorl с LRU-кэшем внутри процесса.
+
+    Записи живут не дольше THUMBNAIL_LRU_TTL, а их число ограничено
+    THUMBNAIL_LRU_SIZE. Чтобы воркеры узнавали об удалённых или
+    заменённых картинках, в общем кэше default (как и блокировки
+    генерации, а не в THUMBNAIL_CACHE) хранится номер поколения: при его
+    изменении локальный кэш очищается. Номер проверяется не чаще раза
+    в THUMBNAIL_LRU_CHECK_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._checked_at = 0
+
+    def _sync(self):
+        now = time.monotonic()
+        if now - self._checked_at < settings.THUMBNAIL_LRU_CHECK_INTERVAL:
+            return
+        generation = cache.get(GENERATION_KEY, 0)
+        with self._lock:
+            if generation != self._generation:
+                self._lru.clear()
+                self._generation = generation
+            self._checked_at = now
+
+    def _remember(self, key, value):
+        expires = time.monotonic() + settings.THUMBNAIL_LRU_TTL
+        with self._lock:
+            self._lru[key] = (expires, value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > settings.THUMBNAIL_LRU_SIZE:
+                self._lru.popitem(last=False)
+
+    def _recall(self, key):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return entry[1]
+
+    def _get_raw(self, key):
+        self._sync()
+        value = self._recall(key)
+        if value is None:
+            value = super()._get_raw(key)
+            # Отсутствие записи не запоминается: миниатюру вот-вот может
+            # создать другой воркер.
+            if value is not None:
+                self._remember(key, value)
+        return value
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self._remember(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        with self._lock:
+            for key in keys:
+                self._lru.pop(key, None)
+        invalidate_local_caches()
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        with self._lock:
+            self._lru.clear()
+        invalidate_local_caches()
+
+    def prefetch(self, keys):
+        """Загружает записи пачкой: один get_many к кэшу и один запрос
+        к базе на промахи."""
+        self._sync()
+        missing = [key for key in keys if self._recall(key) is None]
+        if not missing:
+            return
+        found = self.cache.get_many(missing)
+        absent = [key for key in missing if key not in found]
+        if absent:
+            loaded = dict(KVStoreModel.objects
+                          .filter(key__in=absent)
+                          .values_list('key', 'value'))
+            self.cache.set_many(
+                {key: loaded.get(key, EMPTY_VALUE) for key in absent},
+                thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT
+            )
+            found.update(loaded)
+        for key, value in found.items():
+            if value is not EMPTY_VALUE:
+                self._remember(key, value)
+
+
+def invalidate_local_caches():
+    """Сообщает всем воркерам, что их LRU-кэши миниатюр устарели."""
+    if not cache.add(GENERATION_KEY, 1, None):
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, 1, None)
+
+
+def card_variants():
+    """Перечисляет (format, width, geometry, options) всех вариантов
+    миниатюры карточки. format=None — формат по умолчанию; форматы,
+    которые не поддерживает установленный Pillow, пропускаются."""
+    base_width, base_height = parse_geometry(CARD_GEOMETRY)
+    formats = [None] + [
+        image_format for image_format in settings.POST_IMAGE_FORMATS
+        if features.check(image_format.lower())
+    ]
+    for image_format in formats:
+        for width in settings.POST_IMAGE_WIDTHS:
+            options = dict(CARD_OPTIONS)
+            if image_format:
+                options['format'] = image_format
+            height = round(width * base_height / base_width)
+            yield image_format, width, f'{width}x{height}', options
+
+
+def responsive_image(image):
+    """Собирает данные для <picture>: основную миниатюру и srcset
+    по форматам. Варианты, которые ещё не сгенерированы, пропускаются,
+    а основная миниатюра при необходимости рисуется под блокировкой."""
+    srcsets = defaultdict(list)
+    for image_format, width, geometry, options in card_variants():
+        _, _, ready = default.backend.lookup(image, geometry, **options)
+        if ready:
+            srcsets[image_format].append(f'{ready.url} {width}w')
+    return {
+        'fallback': get_thumbnail(image, CARD_GEOMETRY, **CARD_OPTIONS),
+        'srcset': ', '.join(srcsets.pop(None, [])),
+        'sources': [
+            {'type': MIME_TYPES.get(image_format,
+                                    f'image/{image_format.lower()}'),
+             'srcset': ', '.join(srcset)}
+            for image_format, srcset in srcsets.items()
+        ],
+    }
+
+
+def prefetch_card_thumbnails(posts):
+    """Одной пачкой подгружает записи sorl для всех вариантов миниатюр
+    карточек."""
+    if not hasattr(default.kvstore, 'prefetch'):
+        return
+    variants = [(CARD_GEOMETRY, CARD_OPTIONS)] + [
+        (geometry, options) for _, _, geometry, options in card_variants()
+    ]
+    keys = []
+    for post in posts:
+        if not post.image:
+            continue
+        for geometry, options in variants:
+            _, thumbnail = default.backend.thumbnail_file(
+                post.image, geometry, dict(options)
+            )
+            keys.append(add_prefix(thumbnail.key))
+    default.kvstore.prefetch(keys)
+
+
+def generate_card_thumbnails(image):
+    """Генерирует все варианты миниатюры карточки; возвращает их число."""
+    variants = [(CARD_GEOMETRY, CARD_OPTIONS)] + [
+        (geometry, options) for _, _, geometry, options in card_variants()
+    ]
+    for geometry, options in variants:
+        get_thumbnail(image, geometry, **options)
+    return len(variants)
@@ -0,0 +1,319 @@
+"""Выгрузка и загрузка постов с комментариями в формате NDJSON.
+
+Файл — по записи JSON на строку: сначала группы, затем посты вместе
+с их комментариями. Пользователи и группы указываются естественными
+ключами (username, slug), поэтому выгрузку можно загрузить в базу
+с другими id. Сжатие определяется расширением файла: .gz, .bz2, .xz.
+
+Выгрузка читает посты каждого шарда пачками по первичному ключу и
+пишет их сразу, поэтому в памяти находится одна пачка.
+
+У каждого поста и комментария в файле есть token. У записей без
+сохранённого token он выводится из id, так что повторная выгрузка
+даёт те же значения. Загрузка пропускает записи с уже известным
+token. Поэтому пачку, прерванную на середине, можно загрузить заново,
+а возобновление после сбоя не создаёт дублей. Счётчики архива и ссылки
+на файлы записываются в тех же транзакциях, что и посты, поэтому
+повтор пачки не теряет и не удваивает их.
+"""
+import bz2
+import gzip
+import json
+import lzma
+import uuid
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, router, transaction
+from django.utils.dateparse import parse_datetime
+
+from core.db import retry_on_locked
+from . import archive, sharding, syndication
+from .models import (Comment, Group, MediaBlob, Post, PostMonthCount,
+                     User)
+from .storage import acquire
+
+# Пространство имён для token записей, у которых его нет.
+TOKEN_NAMESPACE = uuid.UUID('2f0c8e36-63e5-4c1e-9a36-0f4f5d1c7b54')
+
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+
+def open_file(path, mode):
+    """Открывает файл в текстовом режиме, распаковывая по расширению."""
+    for suffix, opener in OPENERS.items():
+        if path.endswith(suffix):
+            return opener(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+@contextmanager
+def keep_auto_now_add(*fields):
+    """bulk_create заполняет auto_now_add текущим временем; при переносе
+    нужно сохранить исходные даты."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _token(token, kind, object_id):
+    return str(token or uuid.uuid5(TOKEN_NAMESPACE, f'{kind}:{object_id}'))
+
+
+def _post_chunks(alias, chunk_size):
+    last_id = 0
+    while True:
+        rows = list(Post.objects.using(alias)
+                    .filter(id__gt=last_id)
+                    .order_by('id')
+                    .values_list('id', 'token', 'author_id', 'group_id',
+                                 'text', 'pub_date', 'image')
+                    [:chunk_size])
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+def export_records(chunk_size):
+    """Записи выгрузки по порядку: группы, затем посты всех шардов."""
+    slugs = {}
+    for group_id, slug, title, description in (
+            Group.objects.order_by('id')
+            .values_list('id', 'slug', 'title', 'description')
+            .iterator()):
+        slugs[group_id] = slug
+        yield {'type': 'group', 'slug': slug, 'title': title,
+               'description': description}
+    for alias in sharding.aliases():
+        for rows in _post_chunks(alias, chunk_size):
+            comments = {}
+            for row in (Comment.objects.using(alias)
+                        .filter(post_id__in=[row[0] for row in rows])
+                        .order_by('id')
+                        .values_list('post_id', 'id', 'token', 'author_id',
+                                     'text', 'created')):
+                comments.setdefault(row[0], []).append(row[1:])
+            user_ids = {row[2] for row in rows} | {
+                row[2] for items in comments.values() for row in items
+            }
+            usernames = dict(User.objects.filter(id__in=user_ids)
+                             .values_list('id', 'username'))
+            for (post_id, token, author_id, group_id, text, pub_date,
+                 image) in rows:
+                yield {
+                    'type': 'post',
+                    'token': _token(token, 'post', post_id),
+                    'author': usernames[author_id],
+                    'group': slugs.get(group_id),
+                    'text': text,
+                    'pub_date': pub_date.isoformat(),
+                    'image': image,
+                    'comments': [
+                        {'token': _token(comment_token, 'comment',
+                                         comment_id),
+                         'author': usernames[commenter_id],
+                         'text': comment_text,
+                         'created': created.isoformat()}
+                        for (comment_id, comment_token, commenter_id,
+                             comment_text, created)
+                        in comments.get(post_id, ())
+                    ],
+                }
+
+
+def export_posts(path, chunk_size):
+    """Пишет выгрузку в path; возвращает число постов."""
+    total = 0
+    with open_file(path, 'w') as output:
+        for record in export_records(chunk_size):
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            total += record['type'] == 'post'
+    return total
+
+
+def read_chunks(path, chunk_size, skip=()):
+    """Пары (номер, строки) пачек файла, кроме номеров из skip. Номер
+    пачки зависит от chunk_size."""
+    with open_file(path, 'r') as source:
+        number = 0
+        while True:
+            lines = list(islice(source, chunk_size))
+            if not lines:
+                return
+            if number not in skip:
+                yield number, lines
+            number += 1
+
+
+@retry_on_locked
+def _save_groups(records):
+    Group.objects.bulk_create(
+        [Group(slug=record['slug'], title=record['title'],
+               description=record['description']) for record in records],
+        ignore_conflicts=True
+    )
+    for record in records:
+        Group.objects.filter(slug=record['slug']).update(
+            title=record['title'], description=record['description']
+        )
+
+
+@retry_on_locked
+def _group_ids(slugs):
+    """{slug: id}; группы, которых ещё нет, создаются заготовками —
+    запись группы из той же выгрузки их дополнит."""
+    Group.objects.bulk_create(
+        [Group(slug=slug, title=slug, description='') for slug in slugs],
+        ignore_conflicts=True
+    )
+    return dict(Group.objects.filter(slug__in=slugs)
+                .values_list('slug', 'id'))
+
+
+@retry_on_locked
+def _user_ids(usernames):
+    """{username: id}; недостающие пользователи создаются без пароля."""
+    User.objects.bulk_create(
+        [User(username=username, password=make_password(None))
+         for username in usernames],
+        ignore_conflicts=True
+    )
+    return dict(User.objects.filter(username__in=usernames)
+                .values_list('username', 'id'))
+
+
+def _insert_posts(alias, posts):
+    """Вставляет posts и возвращает те, что действительно записаны.
+
+    Пост с тем же token может успеть записать параллельный воркер;
+    тогда пачка вставляется по одному посту, и занятые token
+    пропускаются, не попадая в счётчики."""
+    queryset = Post.objects.using(alias)
+    try:
+        with transaction.atomic(using=alias):
+            queryset.bulk_create(posts)
+        return posts
+    except IntegrityError:
+        pass
+    inserted = []
+    for post in posts:
+        try:
+            with transaction.atomic(using=alias):
+                queryset.bulk_create([post])
+        except IntegrityError:
+            continue
+        inserted.append(post)
+    return inserted
+
+
+def _save_posts(alias, records, user_ids, group_ids):
+    """Создаёт в шарде alias новые посты из records с комментариями;
+    возвращает созданные посты, id всех постов пачки по token и число
+    комментариев."""
+    tokens = [uuid.UUID(record['token']) for record in records]
+    existing = set(Post.objects.using(alias).filter(token__in=tokens)
+                   .values_list('token', flat=True))
+    posts = []
+    for token, record in zip(tokens, records):
+        if token in existing:
+            continue
+        post = Post(token=token, author_id=user_ids[record['author']],
+                    group_id=group_ids.get(record['group']),
+                    text=record['text'], image=record['image'],
+                    pub_date=parse_datetime(record['pub_date']))
+        if sharding.enabled():
+            post.id = sharding.next_id(Post)
+        posts.append(post)
+    posts = _insert_posts(alias, posts)
+    post_ids = dict(Post.objects.using(alias).filter(token__in=tokens)
+                    .values_list('token', 'id'))
+    for post in posts:
+        post.id = post_ids[post.token]
+    comments = []
+    for token, record in zip(tokens, records):
+        for item in record['comments']:
+            comment = Comment(token=uuid.UUID(item['token']),
+                              post_id=post_ids[token],
+                              author_id=user_ids[item['author']],
+                              text=item['text'],
+                              created=parse_datetime(item['created']))
+            if sharding.enabled():
+                comment.id = sharding.next_id(Comment)
+            comments.append(comment)
+    Comment.objects.using(alias).bulk_create(comments, ignore_conflicts=True)
+    return posts, post_ids, len(comments)
+
+
+def _count_created(posts):
+    """bulk_create не отправляет сигналы: счётчики архива и ссылки на
+    файлы обновляются здесь одной операцией на пачку."""
+    archive.count_posts(posts)
+    images = Counter(post.image.name for post in posts if post.image)
+    for name, count in images.items():
+        acquire(name, count)
+
+
+@retry_on_locked
+def _save_chunk(by_shard, user_ids, group_ids):
+    """Записывает посты пачки вместе со счётчиками архива и ссылками на
+    файлы: в каждом шарде и в default — одной транзакцией, так что
+    после сбоя пачка повторяется целиком."""
+    created = []
+    post_ids = {}
+    comments = 0
+    fields = (Post._meta.get_field('pub_date'),
+              Comment._meta.get_field('created'))
+    with keep_auto_now_add(*fields), ExitStack() as stack:
+        for alias in {router.db_for_write(PostMonthCount),
+                      router.db_for_write(MediaBlob), *by_shard}:
+            stack.enter_context(transaction.atomic(using=alias))
+        for alias, items in by_shard.items():
+            posts, ids, count = _save_posts(alias, items, user_ids,
+                                            group_ids)
+            created.extend(posts)
+            post_ids.update(ids)
+            comments += count
+        _count_created(created)
+    return created, post_ids, comments
+
+
+def import_chunk(lines):
+    """Загружает пачку строк выгрузки; возвращает (новых постов,
+    комментариев в пачке)."""
+    records = [json.loads(line) for line in lines if line.strip()]
+    _save_groups([record for record in records
+                  if record['type'] == 'group'])
+    records = [record for record in records if record['type'] == 'post']
+    if not records:
+        return 0, 0
+    user_ids = _user_ids(
+        {record['author'] for record in records}
+        | {item['author'] for record in records
+           for item in record['comments']}
+    )
+    group_ids = _group_ids({record['group'] for record in records
+                            if record['group']})
+    by_shard = {}
+    for record in records:
+        alias = sharding.shard_for_author(user_ids[record['author']])
+        by_shard.setdefault(alias, []).append(record)
+    created, post_ids, comments = _save_chunk(by_shard, user_ids, group_ids)
+    # Версии лент живут в кэше, а не в базе, поэтому меняются для всех
+    # постов пачки: повтор пачки после сбоя обновит их снова.
+    scopes = set()
+    for record in records:
+        post_id = post_ids[uuid.UUID(record['token'])]
+        scopes.add(syndication.SITEMAP_SCOPE.format(
+            syndication.sitemap_chunk_of(post_id)
+        ))
+        scopes.update(archive.scopes_of(user_ids[record['author']],
+                                        group_ids.get(record['group'])))
+    syndication.bump(scopes)
+    return len(created), comments
@@ -0,0 +1,197 @@
+"""Популярные посты.
+
+У каждого поста есть счёт, который затухает со временем с периодом
+полураспада TRENDING_HALF_LIFE. Чтобы не пересчитывать все счета,
+события (просмотры, комментарии, подписки на автора) добавляют вес,
+умноженный на 2 ** (t / half_life), где t отсчитывается от начала
+текущей эпохи длиной TRENDING_ERA: порядок постов от этого не меняется.
+При смене эпохи счета один раз домножаются на общий множитель, а
+счета старше одной эпохи удаляются.
+
+События копятся в памяти процесса и раз в TRENDING_FLUSH_INTERVAL
+секунд записываются в компактную таблицу TrendingScore двумя запросами.
+Первая страница рейтинга — снимок в кэше, который пересобирается
+индексным запросом не чаще раза в TRENDING_SNAPSHOT_INTERVAL секунд,
+поэтому /trending/ не зависит от размера таблицы постов. Прошлые
+снимки хранятся SNAPSHOT_KEEP секунд под своей версией: курсор ленты
+помнит версию, и листание не сбивается при пересборке.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.db.models import Case, F, FloatField, Value, When
+
+from core import metrics
+from core.db import retry_on_locked
+from . import sharding
+from .models import Post, TrendingScore
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = 'trending:snapshot'
+SNAPSHOT_LOCK_KEY = 'trending:snapshot:lock'
+SNAPSHOT_VERSION_KEY = 'trending:snapshot:{}'
+SNAPSHOT_KEEP = 30 * 60
+
+_pending = Counter()
+_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+def current_era(now=None):
+    """Номер эпохи, в которой лежат счета."""
+    now = time.time() if now is None else now
+    return int(now // settings.TRENDING_ERA)
+
+
+def boost(weight, now=None):
+    """(эпоха, вклад) события с весом weight в момент now."""
+    now = time.time() if now is None else now
+    era = current_era(now)
+    elapsed = now - era * settings.TRENDING_ERA
+    return era, weight * 2 ** (elapsed / settings.TRENDING_HALF_LIFE)
+
+
+def record(post_id, kind, count=1, now=None):
+    """Учитывает count событий kind ('view', 'comment', 'follow')."""
+    era, value = boost(settings.TRENDING_WEIGHTS[kind] * count, now)
+    with _lock:
+        _pending[era, post_id] += value
+        due = (time.monotonic() - _flushed_at
+               >= settings.TRENDING_FLUSH_INTERVAL)
+    if due:
+        try:
+            flush()
+        except DatabaseError:
+            logger.exception('Не удалось записать счета популярности')
+
+
+def record_many(counts, kind):
+    """То же для пачки {post_id: число событий}."""
+    for post_id, count in counts.items():
+        record(post_id, kind, count)
+
+
+def record_follow(author_id):
+    """Подписка поднимает последний пост автора."""
+    post_id = (Post.objects
+               .using(sharding.shard_for_author(author_id))
+               .filter(author_id=author_id)
+               .order_by('-pub_date', '-id')
+               .values_list('id', flat=True).first())
+    if post_id is not None:
+        record(post_id, 'follow')
+
+
+def decay(eras):
+    """Множитель, на который затухает счёт за eras эпох."""
+    return 2 ** (-eras * settings.TRENDING_ERA / settings.TRENDING_HALF_LIFE)
+
+
+@retry_on_locked
+def _save(era, values):
+    TrendingScore.objects.bulk_create(
+        [TrendingScore(post_id=post_id, era=era, score=0)
+         for post_id in values],
+        ignore_conflicts=True
+    )
+    increment = Case(
+        *[When(post_id=post_id, then=Value(value))
+          for post_id, value in values.items()],
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    TrendingScore.objects.filter(post_id__in=list(values), era=era).update(
+        score=F('score') + increment
+    )
+
+
+def flush():
+    """Записывает накопленные события; возвращает число постов."""
+    global _flushed_at
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _flushed_at = time.monotonic()
+    era = current_era()
+    values = Counter()
+    for (event_era, post_id), value in pending.items():
+        values[post_id] += value * decay(era - event_era)
+    try:
+        rebase(era)
+        if values:
+            _save(era, values)
+    except Exception:
+        with _lock:
+            _pending.update(pending)
+        raise
+    metrics.incr('trending.flushed', len(values))
+    return len(values)
+
+
+@retry_on_locked
+def rebase(era=None):
+    """Переводит счета прошлой эпохи в текущую. Более старые счета
+    удаляются: их вклад давно затух."""
+    era = current_era() if era is None else era
+    TrendingScore.objects.filter(era__lt=era - 1).delete()
+    TrendingScore.objects.filter(era=era - 1).update(
+        era=era, score=F('score') * decay(1)
+    )
+
+
+def _take_snapshot():
+    rebase()
+    post_ids = list(TrendingScore.objects
+                    .filter(era=current_era())
+                    .order_by('-score')
+                    .values_list('post_id', flat=True)
+                    [:settings.TRENDING_SIZE])
+    taken_at = time.time()
+    cache.set(SNAPSHOT_KEY, (taken_at, post_ids), None)
+    cache.set(SNAPSHOT_VERSION_KEY.format(_version(taken_at)), post_ids,
+              SNAPSHOT_KEEP)
+    return _version(taken_at), post_ids
+
+
+def _version(taken_at):
+    return int(taken_at * 1000)
+
+
+def snapshot():
+    """Пересобирает снимок рейтинга и возвращает id постов."""
+    return _take_snapshot()[1]
+
+
+def ranking(version=None):
+    """(версия, id постов по убыванию счёта) снимка рейтинга.
+
+    Снимок версии version отдаётся, пока он хранится, иначе — текущий.
+    """
+    if version is not None:
+        post_ids = cache.get(SNAPSHOT_VERSION_KEY.format(version))
+        if post_ids is not None:
+            return version, post_ids
+    cached = cache.get(SNAPSHOT_KEY)
+    if cached is None:
+        return _take_snapshot()
+    taken_at, post_ids = cached
+    if time.time() - taken_at < settings.TRENDING_SNAPSHOT_INTERVAL:
+        return _version(taken_at), post_ids
+    # Пока один воркер пересобирает снимок, остальные отдают старый.
+    if not cache.add(SNAPSHOT_LOCK_KEY, 1, 60):
+        return _version(taken_at), post_ids
+    try:
+        return _take_snapshot()
+    finally:
+        cache.delete(SNAPSHOT_LOCK_KEY)
+
+
+def trending_post_ids():
+    """Id популярных постов по убыванию счёта из снимка в кэше."""
+    return ranking()[1]
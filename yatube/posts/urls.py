@@ -7,13 +7,34 @@ app_name = 'posts'
 urlpatterns = [
     path('', views.index, name='index'),
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
+    path('group/<slug:slug>/subscribe/', views.group_subscribe,
+         name='group_subscribe'),
+    path('group/<slug:slug>/unsubscribe/', views.group_unsubscribe,
+         name='group_unsubscribe'),
     path('profile/<str:username>/', views.profile, name='profile'),
+    path('archive/<int:year>/<int:month>/', views.archive_month,
+         name='archive'),
+    path('group/<slug:slug>/archive/<int:year>/<int:month>/',
+         views.group_archive, name='group_archive'),
+    path('profile/<str:username>/archive/<int:year>/<int:month>/',
+         views.profile_archive, name='profile_archive'),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path('posts/<int:post_id>/comment/', views.add_comment,
          name='add_comment'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('trending/', views.trending_posts, name='trending'),
+    path('new/', views.new_posts, name='new_posts'),
+    path('feeds/<str:kind>/', views.index_feed, name='index_feed'),
+    path('group/<slug:slug>/feeds/<str:kind>/', views.group_feed,
+         name='group_feed'),
+    path('profile/<str:username>/feeds/<str:kind>/', views.profile_feed,
+         name='profile_feed'),
+    path('sitemap.xml', views.sitemap, name='sitemap'),
+    path('sitemap-<int:chunk>.xml', views.sitemap_chunk,
+         name='sitemap_chunk'),
+    path('thumbnail/<str:token>/', views.thumbnail, name='thumbnail'),
     path(
         'profile/<str:username>/follow/',
         views.profile_follow,
@@ -24,4 +45,14 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path(
+        'profile/<str:username>/followers/',
+        views.followers,
+        name='followers'
+    ),
+    path(
+        'profile/<str:username>/following/',
+        views.following,
+        name='following'
+    ),
 ]
@@ -0,0 +1,95 @@
+"""Счётчики просмотров постов.
+
+Просмотр не пишет в базу: приращения копятся в памяти процесса, и
+первый запрос после истечения VIEW_FLUSH_INTERVAL секунд (или после
+VIEW_BUFFER_MAX просмотров) записывает их одним UPDATE с CASE на все
+изменившиеся посты. Если процесс упадёт, пропадут только просмотры
+за последний интервал.
+
+Сохранённое значение лежит в Post.views и загружается вместе с постом,
+поэтому шаблону не нужны дополнительные запросы.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Case, F, IntegerField, Value, When
+from django.dispatch import Signal
+
+from core import metrics
+from core.db import retry_on_locked
+from . import sharding
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Отправляется после каждой записи пачки: counts — {post_id: прирост}.
+views_flushed = Signal(providing_args=['counts'])
+
+_pending = Counter()
+_lock = threading.Lock()
+_flushed_at = time.monotonic()
+_buffered = 0
+
+
+def record(post_id):
+    """Засчитывает просмотр поста."""
+    global _buffered
+    with _lock:
+        _pending[post_id] += 1
+        _buffered += 1
+        due = (_buffered >= settings.VIEW_BUFFER_MAX
+               or time.monotonic() - _flushed_at
+               >= settings.VIEW_FLUSH_INTERVAL)
+    if due:
+        try:
+            flush()
+        except DatabaseError:
+            # Просмотры остались в буфере и запишутся в следующий раз.
+            logger.exception('Не удалось записать просмотры')
+
+
+def pending(post_id):
+    """Просмотры поста, ещё не записанные этим процессом."""
+    with _lock:
+        return _pending.get(post_id, 0)
+
+
+@retry_on_locked
+def _save(counts):
+    increment = Case(
+        *[When(id=post_id, then=Value(count))
+          for post_id, count in counts.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    for alias in sharding.aliases():
+        (Post.objects.using(alias)
+         .filter(id__in=list(counts))
+         .update(views=F('views') + increment))
+
+
+def flush():
+    """Записывает накопленные просмотры; возвращает число постов."""
+    global _flushed_at, _buffered
+    with _lock:
+        counts = dict(_pending)
+        _pending.clear()
+        _buffered = 0
+        _flushed_at = time.monotonic()
+    if not counts:
+        return 0
+    try:
+        _save(counts)
+    except Exception:
+        # Вернуть приращения, чтобы записать их в следующий раз.
+        with _lock:
+            _pending.update(counts)
+            _buffered += sum(counts.values())
+        raise
+    views_flushed.send(sender=Post, counts=counts)
+    metrics.incr('views.flushed', sum(counts.values()))
+    return len(counts)
@@ -1,28 +1,82 @@
+import math
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, quote_etag
+from sorl.thumbnail import default as thumbnail_default
+from sorl.thumbnail.images import ImageFile
 
+from core.db import retry_on_locked
+from core.ratelimit import ratelimit
 from yatube.settings import LIMIT_PAGES
+from . import (archive, cards, comment_buffer, feed, follow_graph, follows,
+               polling, sharding, storage, suggestions, syndication,
+               thumbnails, trending, view_counts)
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post, User
+from .pagination import (CURSOR_PARAM, entry_list_page, keyset_page,
+                         post_keyset_page, ranked_list_page)
+
+
+def wants_fragment(request):
+    return request.GET.get('fragment') == '1'
+
+
+def render_fragment(request, posts, next_cursor):
+    """Отдаёт только список карточек без шаблона base.html и
+    контекст-процессоров, с подсказкой браузеру загрузить следующую
+    порцию заранее."""
+    next_url = None
+    if next_cursor is not None:
+        next_url = f'{request.path}?fragment=1&{CURSOR_PARAM}={next_cursor}'
+    response = HttpResponse(render_to_string(
+        'posts/includes/fragment.html',
+        {'cards': cards.render_cards(posts), 'next_url': next_url}
+    ))
+    if next_cursor is not None:
+        response['X-Next-Cursor'] = next_cursor
+        response['Link'] = f'<{next_url}>; rel=prefetch'
+    return response
+
+
+def fragment_of_posts(request, queryset):
+    page = post_keyset_page(
+        sharding.with_related(queryset, 'author', 'group'), request
+    )
+    return render_fragment(request, page['object_list'], page['next_cursor'])
 
 
 def index(request):
     template = 'posts/index.html'
-    post_list = Post.objects.all()
+    post_list = sharding.all_posts(Post.objects.all())
+    if wants_fragment(request):
+        return fragment_of_posts(request, post_list)
     context = page_number(post_list, request)
+    thumbnails.prefetch_card_thumbnails(context['page_obj'])
     return render(request, template, context)
 
 
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     template = 'posts/group_list.html'
-    posts = group.group.all()
+    posts = sharding.all_posts(group.group.all())
+    if wants_fragment(request):
+        return fragment_of_posts(request, posts)
     context = {
         'group': group,
         'posts': posts,
+        'subscribed': (
+            request.user.is_authenticated
+            and group.id in feed.subscribed_group_ids(request.user.id)
+        ),
     }
     context.update(page_number(posts, request))
+    thumbnails.prefetch_card_thumbnails(context['page_obj'])
     return render(request, template, context)
 
 
@@ -30,28 +84,89 @@ def profile(request, username):
     template = 'posts/profile.html'
     author = get_object_or_404(User, username=username)
     post_list = author.posts.all()
+    if wants_fragment(request):
+        return fragment_of_posts(request, post_list)
     post_count = post_list.count()
-    if request.user.is_authenticated:
-        following = Follow.objects.filter(
-            user=request.user, author=author
-        ).exists()
-    else:
-        following = False
+    following = (
+        request.user.is_authenticated
+        and follow_graph.is_following(request.user.id, author.id)
+    )
     context = {
         'author': author,
         'post_count': post_count,
         'following': following
     }
+    if request.user == author:
+        context['suggestions'] = suggestions.for_user(author.id)
     context.update(page_number(post_list, request))
+    thumbnails.prefetch_card_thumbnails(context['page_obj'])
     return render(request, template, context)
 
 
+def _archive_page(request, queryset, scope, url_name, year, month,
+                  **kwargs):
+    try:
+        start, end = archive.month_range(year, month)
+    except ValueError:
+        raise Http404
+    post_list = sharding.all_posts(sharding.with_related(
+        queryset.filter(pub_date__gte=start, pub_date__lt=end),
+        'author', 'group'
+    ))
+    if wants_fragment(request):
+        return fragment_of_posts(request, post_list)
+    context = {
+        'month': start,
+        'months': [
+            (reverse(f'posts:{url_name}',
+                     kwargs={**kwargs, 'year': y, 'month': m}),
+             archive.month_range(y, m)[0], count)
+            for y, m, count in archive.months(scope)
+        ],
+        **kwargs,
+    }
+    context.update(page_number(post_list, request))
+    thumbnails.prefetch_card_thumbnails(context['page_obj'])
+    return render(request, 'posts/archive.html', context)
+
+
+def archive_month(request, year, month):
+    return _archive_page(request, Post.objects.all(), archive.SITE,
+                         'archive', year, month)
+
+
+def group_archive(request, slug, year, month):
+    group = get_object_or_404(Group, slug=slug)
+    return _archive_page(request, group.group.all(),
+                         archive.group_scope(group.id), 'group_archive',
+                         year, month, slug=slug)
+
+
+def profile_archive(request, username, year, month):
+    author = get_object_or_404(User, username=username)
+    return _archive_page(request, author.posts.all(),
+                         archive.author_scope(author.id), 'profile_archive',
+                         year, month, username=username)
+
+
 def post_detail(request, post_id):
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, pk=post_id)
+    post = sharding.get_post_or_404(post_id)
+    view_counts.record(post.id)
+    post.views += view_counts.pending(post.id)
     post_count = post.author.posts.count()
     form = CommentForm()
     comments = post.comments.all()
+    if settings.COMMENT_BUFFERING and request.user.is_authenticated:
+        # Буфер читается первым: комментарий, перенесённый между двумя
+        # чтениями, найдётся в базе, а не потеряется.
+        pending = comment_buffer.pending(post, request.user)
+        comments = list(comments)
+        saved = {comment.token for comment in comments}
+        comments += [comment for comment in pending
+                     if comment.token not in saved]
+    # Все варианты миниатюры поста — одним чтением хранилища ключей.
+    thumbnails.prefetch_card_thumbnails([post])
     context = {
         'post': post,
         'post_count': post_count,
@@ -62,6 +177,7 @@ def post_detail(request, post_id):
 
 
 @login_required
+@ratelimit('post_create')
 def post_create(request):
     template = 'posts/create_post.html'
     form = PostForm(request.POST or None,
@@ -71,7 +187,8 @@ def post_create(request):
         if form.is_valid():
             post = form.save(commit=False)
             post.author = request.user
-            post.save()
+            with storage.release_on_error(post.image):
+                retry_on_locked(post.save)()
             return redirect('posts:profile', request.user)
     return render(request, template, {'form': form})
 
@@ -79,7 +196,7 @@ def post_create(request):
 @login_required
 def post_edit(request, post_id):
     template = 'posts/create_post.html'
-    post = get_object_or_404(Post, id=post_id)
+    post = sharding.get_post_or_404(post_id)
     if post.author != request.user:
         return redirect('posts:post_detail', post_id)
     form = PostForm(request.POST or None,
@@ -88,8 +205,12 @@ def post_edit(request, post_id):
                     )
     if request.method == 'POST':
         if form.is_valid():
-            post = form.save()
-            post.save()
+            post = form.save(commit=False)
+            # Просмотры пишутся в обход формы, их нельзя перезаписывать.
+            with storage.release_on_error(post.image):
+                retry_on_locked(post.save)(
+                    update_fields=PostForm.Meta.fields
+                )
             return redirect('posts:post_detail', post_id)
     return render(request, template, {'form': form, 'post_id': post_id})
 
@@ -103,38 +224,225 @@ def page_number(queryset, request):
     }
 
 
+def page_of_post_ids(post_ids, request):
+    """Разбивает готовый список id на страницы и загружает только
+    посты текущей страницы."""
+    context = page_number(post_ids, request)
+    page_obj = context['page_obj']
+    page_obj.object_list = load_posts(page_obj.object_list)
+    return context
+
+
+def load_posts(post_ids):
+    """Загружает посты одним запросом, сохраняя порядок post_ids."""
+    posts = sharding.in_bulk(
+        sharding.with_related(Post.objects, 'author', 'group'), post_ids
+    )
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
 @login_required
+@ratelimit('add_comment')
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = sharding.get_post_or_404(post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
-        comment = form.save(commit=False)
-        comment.author = request.user
-        comment.post = post
-        comment.save()
+        if settings.COMMENT_BUFFERING:
+            comment_buffer.append(post.id, request.user.id,
+                                  form.cleaned_data['text'])
+        else:
+            comment = form.save(commit=False)
+            comment.author = request.user
+            comment.post = post
+            retry_on_locked(comment.save)()
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
     template = 'posts/follow.html'
-    post_list = Post.objects.filter(author__following__user=request.user)
-    context = page_number(post_list, request)
+    entries = feed.feed_entries(request.user.id)
+    if wants_fragment(request):
+        page = entry_list_page(entries, request)
+        return render_fragment(request, load_posts(page['object_list']),
+                               page['next_cursor'])
+    context = page_of_post_ids([entry[1] for entry in entries], request)
+    thumbnails.prefetch_card_thumbnails(context['page_obj'])
+    context['suggestions'] = suggestions.for_user(request.user.id)
+    return render(request, template, context)
+
+
+def trending_posts(request):
+    template = 'posts/trending.html'
+    if wants_fragment(request):
+        page = ranked_list_page(trending.ranking, request)
+        return render_fragment(request, load_posts(page['object_list']),
+                               page['next_cursor'])
+    context = page_of_post_ids(trending.trending_post_ids(), request)
+    thumbnails.prefetch_card_thumbnails(context['page_obj'])
+    context['trending'] = True
     return render(request, template, context)
 
 
+def get_user_id_or_404(username):
+    user_id = (User.objects.filter(username=username)
+               .values_list('id', flat=True).first())
+    if user_id is None:
+        raise Http404
+    return user_id
+
+
 @login_required
+@ratelimit('profile_follow', methods=None)
 def profile_follow(request, username):
-    user = request.user
-    author = User.objects.get(username=username)
-    if user != author:
-        Follow.objects.get_or_create(user=user, author=author)
-    return redirect('posts:profile', author)
+    follows.follow(request.user.id, get_user_id_or_404(username))
+    return redirect('posts:profile', username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    user = request.user
+    follows.unfollow(request.user.id, get_user_id_or_404(username))
+    return redirect('posts:profile', username)
+
+
+@login_required
+@ratelimit('group_subscribe', methods=None)
+def group_subscribe(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    follows.subscribe_group(request.user.id, group.id)
+    return redirect('posts:group_list', slug)
+
+
+@login_required
+def group_unsubscribe(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    follows.unsubscribe_group(request.user.id, group.id)
+    return redirect('posts:group_list', slug)
+
+
+def _follow_list(request, username, filter_field, user_field, title):
     author = get_object_or_404(User, username=username)
-    Follow.objects.filter(user=user, author=author).delete()
-    return redirect('posts:profile', author)
+    edges = (Follow.objects
+             .filter(**{filter_field: author.id})
+             .values('id', user_field))
+    context = keyset_page(edges, request)
+    users = User.objects.in_bulk(
+        [edge[user_field] for edge in context['object_list']]
+    )
+    context.update({
+        'author': author,
+        'title': title,
+        'users': [users[edge[user_field]]
+                  for edge in context['object_list']
+                  if edge[user_field] in users],
+    })
+    return render(request, 'posts/follow_list.html', context)
+
+
+def followers(request, username):
+    return _follow_list(request, username, 'author_id', 'user_id',
+                        'Подписчики')
+
+
+def following(request, username):
+    return _follow_list(request, username, 'user_id', 'author_id',
+                        'Подписки')
+
+
+def _timestamp_or_none(value):
+    """Unix-время из запроса. Не число, nan, inf и время вне диапазона
+    дат считаются отсутствующими."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(value) or not 0 <= value <= polling.MAX_TIMESTAMP:
+        return None
+    return value
+
+
+def new_posts(request):
+    """Отдаёт число и карточки постов новее известных клиенту.
+
+    Клиент передаёт since (id самого нового поста) или since_ts
+    (unix-время), а для ленты подписок ещё и feed=follow.
+    """
+    since_id = request.GET.get('since')
+    since_id = int(since_id) if since_id and since_id.isdigit() else None
+    since_ts = _timestamp_or_none(request.GET.get('since_ts'))
+    limit = settings.NEW_POSTS_LIMIT
+    follow_feed = (request.GET.get('feed') == 'follow'
+                   and request.user.is_authenticated)
+    if follow_feed:
+        post_ids = polling.newer_feed_post_ids(
+            request.user.id, since_id, since_ts, limit + 1
+        )
+        scope = f'follow-{request.user.id}'
+    else:
+        post_ids = polling.newer_post_ids(
+            since_id, since_ts, limit + 1
+        )
+        scope = 'index'
+    etag = quote_etag(f'{scope}-{since_id}-{since_ts}-'
+                      f'{post_ids[0] if post_ids else 0}')
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    more = len(post_ids) > limit
+    posts = load_posts(post_ids[:limit])
+    response = JsonResponse({
+        'count': len(posts),
+        'more': more,
+        'latest': posts[0].id if posts else since_id,
+        'cards': cards.render_cards(posts),
+    })
+    response['ETag'] = etag
+    return response
+
+
+def index_feed(request, kind):
+    return syndication.serve_feed(request, kind, 'index', archive.SITE)
+
+
+def group_feed(request, slug, kind):
+    group_id = (Group.objects.filter(slug=slug)
+                .values_list('id', flat=True).first())
+    if group_id is None:
+        raise Http404
+    return syndication.serve_feed(request, kind, 'group',
+                                  archive.group_scope(group_id), slug=slug)
+
+
+def profile_feed(request, username, kind):
+    return syndication.serve_feed(
+        request, kind, 'author',
+        archive.author_scope(get_user_id_or_404(username)),
+        username=username
+    )
+
+
+def sitemap(request):
+    return syndication.sitemap_index(request)
+
+
+def sitemap_chunk(request, chunk):
+    return syndication.sitemap_chunk(request, chunk)
+
+
+def thumbnail(request, token):
+    """Отдаёт готовую миниатюру по ссылке заглушки или, пока её рисует
+    другой воркер, прозрачную картинку-заглушку."""
+    data = thumbnails.load_token(token)
+    if data is None:
+        raise Http404
+    source = ImageFile(data['name'], Post._meta.get_field('image').storage)
+    image = thumbnail_default.backend.wait_thumbnail(
+        source, data['geometry'], settings.THUMBNAIL_WAIT, **data['options']
+    )
+    if isinstance(image, thumbnails.PendingThumbnail):
+        response = HttpResponse(thumbnails.PLACEHOLDER_GIF,
+                                content_type='image/gif')
+        response['Cache-Control'] = 'no-store'
+        response['Retry-After'] = '1'
+        return response
+    return redirect(image.url)
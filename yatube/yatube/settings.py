@@ -26,6 +26,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -35,6 +36,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+AUTHENTICATION_BACKENDS = [
+    'core.backends.CachedModelBackend',
+]
+
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
@@ -61,9 +68,50 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {
+            'timeout': 20,
+        },
+    },
+    # Шард для тестов шардирования: в POST_SHARDS его включают только
+    # тесты (posts/tests/test_sharding.py).
+    'test_shard': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'test_shard.sqlite3'),
+    },
 }
 
+DATABASE_REPLICAS = []
+
+DATABASE_ROUTERS = [
+    'posts.sharding.AuthorShardRouter',
+    'core.routers.ReplicaRouter',
+]
+
+# Алиасы из DATABASES, по которым посты и комментарии раскладываются
+# по автору; пустой список — всё хранится в default.
+POST_SHARDS = []
+
+# Сколько id постов или комментариев процесс резервирует за раз.
+POST_SHARD_ID_BLOCK = 1000
+
+POST_SHARD_TIMEOUT = 60 * 60
+
+READ_AFTER_WRITE_WINDOW = 5
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+DB_RETRY_ATTEMPTS = 5
+
+DB_RETRY_BASE_DELAY = 0.05
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -116,3 +164,136 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
+
+FOLLOW_GRAPH_TIMEOUT = 60 * 60 * 24
+
+FOLLOW_IMPORT_BATCH_SIZE = 5000
+
+FEED_PULL_THRESHOLD = 10000
+
+FEED_TIMELINE_SIZE = 1000
+
+FEED_TIMEOUT = 60 * 60 * 24
+
+POST_CARD_TIMEOUT = 60 * 60
+
+NEW_POSTS_LIMIT = 20
+
+MEDIA_SHARD_DEPTH = 2
+
+MEDIA_MIGRATION_WORKERS = 8
+
+THUMBNAIL_BACKEND = 'posts.thumbnails.LockingThumbnailBackend'
+
+THUMBNAIL_LOCK_TIMEOUT = 60
+
+THUMBNAIL_WAIT = 2
+
+THUMBNAIL_POLL_INTERVAL = 0.1
+
+THUMBNAIL_KVSTORE = 'posts.thumbnails.LRUKVStore'
+
+THUMBNAIL_LRU_SIZE = 10000
+
+THUMBNAIL_LRU_TTL = 60 * 5
+
+THUMBNAIL_LRU_CHECK_INTERVAL = 5
+
+POST_IMAGE_WIDTHS = [480, 960, 1440]
+
+POST_IMAGE_FORMATS = ['WEBP']
+
+USER_CACHE_TIMEOUT = 60 * 5
+
+# Очередь фоновых задач core.tasks. TASKS_EAGER = True выполняет задачи
+# сразу при постановке, False всегда ставит их в очередь, None — ставит,
+# только если воркер run_tasks отмечался в последние TASK_WORKER_TIMEOUT
+# секунд.
+TASKS_EAGER = None
+
+TASK_WORKER_TIMEOUT = 30
+
+TASK_MAX_ATTEMPTS = 5
+
+TASK_LEASE = 60 * 5
+
+TASK_RETRY_BASE_DELAY = 2
+
+TASK_RETRY_MAX_DELAY = 60 * 60
+
+TASK_WORKERS = 4
+
+TASK_POLL_INTERVAL = 1
+
+TASK_KEEP_DONE = 60 * 60 * 24
+
+# Комментарии пишутся в локальный буфер и переносятся в базу пачками
+# (posts.comment_buffer).
+COMMENT_BUFFERING = False
+
+COMMENT_BUFFER_PATH = os.path.join(BASE_DIR, 'comment_buffer.sqlite3')
+
+# Наименьшая пауза между переносами пачек.
+COMMENT_FLUSH_INTERVAL = 1
+
+COMMENT_FLUSH_BATCH = 500
+
+# False — переносом занимается только команда flush_comments --loop.
+COMMENT_FLUSH_IN_PROCESS = True
+
+# Лимиты core.ratelimit: маршрут -> {область: (запросов, за секунд)}.
+RATE_LIMITS = {
+    'post_create': {'user': (10, 60), 'ip': (30, 60)},
+    'add_comment': {'user': (20, 60), 'ip': (60, 60)},
+    'profile_follow': {'user': (30, 60), 'ip': (100, 60)},
+    'group_subscribe': {'user': (30, 60), 'ip': (100, 60)},
+    'signup': {'ip': (5, 60 * 60)},
+}
+
+# Буфер счётчиков просмотров posts.view_counts.
+VIEW_FLUSH_INTERVAL = 5
+
+VIEW_BUFFER_MAX = 10000
+
+# Рейтинг популярных постов posts.trending. Вклад события затухает вдвое
+# за TRENDING_HALF_LIFE секунд.
+TRENDING_HALF_LIFE = 60 * 60 * 6
+
+TRENDING_ERA = 60 * 60 * 24 * 7
+
+TRENDING_WEIGHTS = {'view': 1, 'comment': 5, 'follow': 10}
+
+TRENDING_SIZE = 50
+
+TRENDING_SNAPSHOT_INTERVAL = 60
+
+TRENDING_FLUSH_INTERVAL = 5
+
+# Рекомендации авторов posts.suggestions: сколько хранить на
+# пользователя и сколько показывать.
+SUGGESTIONS_SIZE = 20
+
+SUGGESTIONS_SHOWN = 5
+
+# Сколько подписчиков одного автора учитывать при подсчёте совместных
+# подписок: у популярных авторов берётся равномерная выборка.
+SUGGESTIONS_MAX_FOLLOWERS = 200
+
+SUGGESTIONS_GROUP_AUTHORS = 10
+
+SUGGESTIONS_GROUP_WEIGHT = 2
+
+SUGGESTIONS_BATCH_SIZE = 1000
+
+SUGGESTIONS_TIMEOUT = 60 * 60 * 24
+
+# Кэш навигации архива posts.archive; сбрасывается при изменении счётчиков.
+ARCHIVE_TIMEOUT = 60 * 60 * 24
+
+# Карта сайта и ленты RSS/Atom posts.syndication. В части карты сайта
+# не больше 50 000 адресов.
+SITEMAP_CHUNK_SIZE = 10000
+
+FEED_ITEMS = 50
+
+SYNDICATION_TIMEOUT = 60 * 60 * 24